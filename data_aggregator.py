@@ -5,6 +5,168 @@ and finally aggregates them on a route (origin-destination) level.
 """
 from __future__ import print_function
 
+# imported at module level so the loaders also work when imported (see RouteAggregator)
+from glob import glob
+from multiprocessing import Pool, cpu_count
+import gzip
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import zipfile
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class _LazyModule(object):
+    """
+    Module imported on its first attribute access, so --help and runs that don't need it start without importing it;
+    the module then replaces this placeholder in the module globals, so later accesses (e.g. in per-row loops)
+    are plain module attribute lookups
+    """
+    def __init__(self, name, global_name):
+        self._name = name
+        self._global_name = global_name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        globals()[self._global_name] = module
+        return getattr(module, attr)
+
+np = _LazyModule('numpy', 'np')
+pd = _LazyModule('pandas', 'pd')
+route_utils = _LazyModule('route_utils', 'route_utils')
+
+# input directory, airport data and parsed raw data cache used by the loaders,
+# set in __main__ or for each call of a RouteAggregator session
+data_dir = 'data'
+airports = None
+raw_cache = None
+session_lock = threading.Lock()
+
+# route columns kept with the per-route, per-period partial aggregates (see update_partials)
+ROUTE_INFO_COLS = ['route_id',
+                   'orig_code', 'orig_name', 'orig_city', 'orig_state', 'orig_lat', 'orig_lon',
+                   'dest_code', 'dest_name', 'dest_city', 'dest_state', 'dest_lat', 'dest_lon']
+
+# partial aggregate columns that are not summed measures: stopover airports of a route and period, space separated
+PARTIAL_SET_COLS = ['stopover_airports']
+
+# layout of the route datasets reduced from partials, as written by the dataset loaders
+# (dataset -> orig and dest state columns, metric columns before the route columns)
+REDUCED_LAYOUT = {'aircraft_delay': ('OriginState', 'DestState', []),
+                  'aircraft_occupancy': ('ORIGIN_STATE_ABR', 'DEST_STATE_ABR',
+                                         ['DEPARTURES_PERFORMED_sum', 'SEATS_sum', 'PASSENGERS_sum', 'occupancy_total']),
+                  'flyer_class': ('ORIGIN_STATE_ABR', 'DEST_STATE_ABR', ['PASSENGERS_sum', 'class_bf_frac', 'class_c_frac']),
+                  'flyer_stopover': ('ORIGIN_STATE_ABR', 'DEST_STATE_ABR', ['PASSENGERS_sum'])}
+
+# datasets with partial aggregates (name, raw data directory, partials function name, months per period)
+PARTIAL_DATASETS = [('aircraft_delay', 'aircraft_delays', 'delay_partials', 1),
+                    ('aircraft_occupancy', 'aircraft_occupancy', 'occupancy_partials', 1),
+                    ('flyer_class', 'air_coupons', 'class_partials', 3),
+                    ('flyer_stopover', 'air_coupons', 'stopover_partials', 3)]
+
+# --all task graph in dependency order (task, dependencies): every dataset only needs the airport data, its csv
+# write needs the dataset and the route fact table needs every route dataset written
+ALL_TASKS = [('airports', []),
+             ('aircraft_delay', ['airports']), ('aircraft_delay_write', ['aircraft_delay']),
+             ('aircraft_occupancy', ['airports']), ('aircraft_occupancy_write', ['aircraft_occupancy']),
+             ('flyer_class', ['airports']), ('flyer_class_write', ['flyer_class']),
+             ('flyer_stopover', ['airports']), ('flyer_stopover_write', ['flyer_stopover']),
+             ('amtrak', ['airports']), ('amtrak_write', ['amtrak']),
+             ('route_facts', ['aircraft_delay_write', 'aircraft_occupancy_write', 'flyer_class_write', 'flyer_stopover_write'])]
+# --all dataset tasks run in the task pool (task, loader function name, output file)
+ALL_DATASETS = [('aircraft_delay', 'aircraft_delay_data', 'aircraft_delay_routes.csv'),
+                ('aircraft_occupancy', 'aircraft_occupancy_data', 'aircraft_occupancy_routes.csv'),
+                ('flyer_class', 'flyer_class_data', 'flyer_class_routes.csv'),
+                ('flyer_stopover', 'flyer_stopover_data', 'flyer_stopover_routes.csv'),
+                ('amtrak', 'amtrak_data', 'amtrak_plus.csv')]
+
+# columns read from the Amtrak status archive files (one row per train, origin date and station stop)
+AMTRAK_STATUS_COLS = ['Origin Date', 'Station', 'Sch Ar', 'Sch Dp', 'Act Ar', 'Act Dp']
+# year of the Amtrak station delays used with the 2016 ridership data
+AMTRAK_DELAY_YEAR = 2016
+
+# state columns of the route datasets, one orig_state and dest_state in the route fact table
+FACT_STATE_COLS = {'OriginState': 'orig_state', 'ORIGIN_STATE_ABR': 'orig_state',
+                   'DestState': 'dest_state', 'DEST_STATE_ABR': 'dest_state'}
+
+# raw data read in --sample mode (raw data directory, quarter column, columns read)
+SAMPLE_COLS = {'aircraft_delay': ('aircraft_delays', 'Quarter',
+                                  ['Year', 'Quarter', 'Month', 'Origin', 'OriginState', 'Dest', 'DestState',
+                                   'Flights', 'Distance', 'CarrierDelay', 'LateAircraftDelay']),
+               'aircraft_occupancy': ('aircraft_occupancy', 'QUARTER',
+                                      ['YEAR', 'QUARTER', 'MONTH', 'ORIGIN', 'ORIGIN_STATE_ABR', 'DEST', 'DEST_STATE_ABR',
+                                       'DISTANCE', 'SEATS', 'PASSENGERS']),
+               'flyer_class': ('air_coupons', 'QUARTER',
+                               ['YEAR', 'QUARTER', 'ORIGIN', 'ORIGIN_STATE_ABR', 'DEST', 'DEST_STATE_ABR',
+                                'DISTANCE', 'PASSENGERS', 'FARE_CLASS']),
+               'flyer_stopover': ('air_coupons', 'QUARTER',
+                                  ['YEAR', 'QUARTER', 'MKT_ID', 'SEQ_NUM', 'ORIGIN', 'ORIGIN_STATE_ABR', 'DEST', 'DEST_STATE_ABR',
+                                   'DISTANCE', 'PASSENGERS'])}
+
+# metrics estimated in --sample mode (dataset, metric, numerator column, denominator column, fraction)
+SAMPLE_METRICS = [('aircraft_delay', 'AirlineDelay_10frac', 'delay_10', 'one', True),
+                  ('aircraft_delay', 'AirlineDelay_20frac', 'delay_20', 'one', True),
+                  ('aircraft_delay', 'AirlineDelay_30frac', 'delay_30', 'one', True),
+                  ('aircraft_delay', 'AirlineDelay_mean', 'delay_sum', 'delay_n', False),
+                  ('aircraft_occupancy', 'occupancy_mean', 'occupancy', 'one', True),
+                  ('aircraft_occupancy', 'occupancy_total', 'PASSENGERS', 'SEATS', True),
+                  ('flyer_class', 'class_bf_frac', 'class_bf_w', 'PASSENGERS', True),
+                  ('flyer_class', 'class_c_frac', 'class_c_w', 'PASSENGERS', True),
+                  ('flyer_stopover', 'stopover_frac', 'stopover', 'one', True),
+                  ('flyer_stopover', 'stopovers_mean', 'stopovers', 'one', False)]
+
+# metrics with bootstrap confidence intervals (metric, numerator column, denominator column or None for a mean over rows)
+## boolean numerators without denominator are fractions of rows, resampled from the per-route counts
+BOOTSTRAP_METRICS = {'aircraft_delay': [('AirlineDelay_10frac', 'AirlineDelay_10', None),
+                                        ('AirlineDelay_20frac', 'AirlineDelay_20', None),
+                                        ('AirlineDelay_30frac', 'AirlineDelay_30', None),
+                                        ('AirlineDelay_mean', 'AirlineDelay', None)],
+                     'aircraft_occupancy': [('occupancy_mean', 'occupancy', None),
+                                            ('occupancy_total', 'PASSENGERS', 'SEATS')],
+                     'flyer_class': [('class_bf_frac', 'class_bf_w', 'PASSENGERS'),
+                                     ('class_c_frac', 'class_c_w', 'PASSENGERS')],
+                     'flyer_stopover': [('stopover_frac', 'stopover_true', None),
+                                        ('stopovers_mean', 'stopovers', None)]}
+
+# bootstrap replicates per worker task, fixed so a seed gives the same intervals with any number of workers
+BOOTSTRAP_CHUNK = 50
+
+# raw data file extensions read by the loaders (BTS downloads can be read without unzipping them first)
+RAW_EXTENSIONS = ['.csv', '.zip', '.gz', '.zst']
+
+# histogram bin edges kept as sketches for the medians, last bin is open ended
+DELAY_BINS = [0, 1, 2, 3, 5, 7, 10, 15, 20, 25, 30, 40, 50, 60, 75, 90, 120, 150, 180, 240, 300]
+OCCUPANCY_BINS = [0.05 * i for i in range(21)]
+
+# additive measures per cell of the occupancy cube (route, month, carrier, aircraft type)
+CUBE_MEASURES = ['rows', 'DEPARTURES_SCHEDULED', 'DEPARTURES_PERFORMED', 'SEATS', 'PASSENGERS',
+                 'occupancy_n', 'occupancy_sum', 'DISTANCE_sum', 'AIR_TIME_sum']
+
+# fine delay histogram bin edges in minutes (1 min up to 3 hours, then 5 and 15 min), bin i holds (edges[i-1], edges[i]]
+# so whole minute delays fall on the edges and fractions over any whole minute threshold are exact
+DELAY_HIST_EDGES = {'AirlineDelay': list(range(0, 181)) + list(range(185, 301, 5)) + list(range(315, 721, 15)),
+                    'DepDelay': list(range(-60, 181)) + list(range(185, 301, 5)) + list(range(315, 721, 15)),
+                    'ArrDelay': list(range(-90, 181)) + list(range(185, 301, 5)) + list(range(315, 721, 15)),
+                    'TaxiOut': list(range(0, 121)) + list(range(125, 241, 5))}
+
+# bins per day of the time of day delay profiles (hourly or 15 min) and the AirlineDelay thresholds (min) counted per bin,
+## as the AirlineDelay_<threshold>frac route columns
+TOD_BINS = [24, 96]
+TOD_THRESHOLDS = [10, 20, 30]
+
+# columns of the openflights airports.csv (no header)
+AIRPORT_COLS = ['id', 'name', 'city', 'country', 'code', 'icao', 'lat', 'lon', 'altitude',
+                'utc_offset', 'dst', 'timezone', 'type', 'source']
+
 def geocalc(lat0, lon0, lat1, lon1):
     """
     Return the distance (in mi) between two points in geographical coordinates
@@ -24,40 +186,254 @@ def geocalc(lat0, lon0, lat1, lon1):
     c = np.arctan2(y, x)
     return EARTH_R * c
 
+def bootstrap_poisson_chunk(task):
+    """
+    Poisson bootstrap replicates of per-route ratios sum(w * y) / sum(w * x) over the distinct (y, x) values
+    of each route (sorted by route, starting at starts), each value weighted by a Poisson(count) draw,
+    the sum of its count rows' Poisson(1) resampling weights
+    Return numpy array (routes x replicates)
+    """
+    starts, y, x, counts, replicates, seed = task
+    rng = np.random.RandomState(seed)
+    reps = np.empty((len(starts), replicates))
+    for i in range(0, replicates, 8):
+        w = rng.poisson(counts[:, None], (len(y), min(8, replicates - i)))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            reps[:, i:i + w.shape[1]] = np.add.reduceat(w * y[:, None], starts, axis=0) / \
+                                        np.add.reduceat(w * x[:, None], starts, axis=0)
+    return reps
+
+def bootstrap_cis(routes, rows, metrics, replicates=1000, seed=0, workers=None, alpha=0.05, pool=None):
+    """
+    Percentile bootstrap confidence intervals of route metrics, added as <metric>_lo and <metric>_hi columns
+    Fractions of rows are resampled as multinomial (binomial) draws of each route's counts, other metrics by
+    Poisson weights of the route's rows, split over chunks of BOOTSTRAP_CHUNK replicates in worker processes
+    (a pool of workers created for the call and closed when it returns, unless a pool is given)
+    Rows with a missing numerator or denominator are left out of the metric (as in the pandas means)
+    Return pandas dataframe
+    """
+    workers = workers or cpu_count()
+    if pool is None and workers > 1:
+        with Pool(workers) as pool:
+            return bootstrap_cis(routes, rows, metrics, replicates=replicates, seed=seed, workers=workers, alpha=alpha,
+                                 pool=pool)
+    route_idx = pd.Index(routes['route_id']).get_indexer(rows['route_id'])
+    keep = route_idx >= 0
+    order = np.argsort(route_idx[keep], kind='mergesort')
+    idx = route_idx[keep][order]
+    present, starts = np.unique(idx, return_index=True)
+    rng = np.random.RandomState(seed)
+    for metric, y_col, x_col in metrics:
+        y = rows[y_col].values[keep][order]
+        if x_col is None and y.dtype == bool:
+            ## resample each route's n rows: k successes ~ Binomial(n, k / n)
+            n = np.bincount(idx, minlength=len(routes))
+            k = np.bincount(idx, weights=y, minlength=len(routes))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                p = np.where(n > 0, k / np.maximum(n, 1), 0)
+                reps = rng.binomial(n[:, None], p[:, None], (len(routes), replicates)) / n[:, None].astype(float)
+        else:
+            y = y.astype(float)
+            x = np.ones(len(y)) if x_col is None else rows[x_col].values[keep][order].astype(float)
+            valid = ~np.isnan(y) & ~np.isnan(x)
+            ## identical rows of a route are resampled together (delays, passenger counts and stopovers repeat a lot)
+            values = pd.DataFrame({'idx': idx, 'y': np.where(valid, y, 0), 'x': np.where(valid, x, 0)})
+            values = values.groupby(['idx', 'y', 'x']).size().reset_index()
+            value_starts = np.searchsorted(values['idx'].values, present)
+            chunks = [min(BOOTSTRAP_CHUNK, replicates - i) for i in range(0, replicates, BOOTSTRAP_CHUNK)]
+            tasks = [(value_starts, values['y'].values, values['x'].values, values[0].values, chunk, rng.randint(2 ** 31))
+                     for chunk in chunks]
+            reps = np.full((len(routes), replicates), np.nan)
+            reps[present] = np.concatenate(pool.map(bootstrap_poisson_chunk, tasks) if pool else
+                                           list(map(bootstrap_poisson_chunk, tasks)), axis=1)
+        with np.errstate(invalid='ignore'):
+            lo, hi = np.nanpercentile(reps, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=1)
+        routes['{0}_lo'.format(metric)] = lo
+        routes['{0}_hi'.format(metric)] = hi
+    return routes
+
+def read_stream(stream, chunk_size=1 << 20, **kwargs):
+    """
+    Parse a decompressing stream as csv, with a thread decompressing it into a pipe that pandas reads from,
+    so decompression overlaps with parsing and nothing is written to disk
+    Return pandas dataframe
+    """
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def decompress():
+        try:
+            with os.fdopen(write_fd, 'wb') as pipe:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    pipe.write(chunk)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            stream.close()
+
+    thread = threading.Thread(target=decompress)
+    thread.daemon = True
+    thread.start()
+    with os.fdopen(read_fd, 'rb') as pipe:
+        df = pd.read_csv(pipe, **kwargs)
+    thread.join()
+    ## a failed decompression only shows up as a short csv on the reading end
+    if errors:
+        raise errors[0]
+    return df
+
+def raw_data_files(raw_dir):
+    """
+    Raw data files in a directory: csv files or BTS downloads as they come (.zip, .gz, .zst)
+    Return sorted list of file names
+    """
+    fnames = []
+    for ext in RAW_EXTENSIONS:
+        fnames += glob('{0}/*{1}'.format(raw_dir, ext))
+    return sorted(set(fnames))
+
+def read_raw(fname, usecols=None):
+    """
+    Read a raw data file (only usecols if given), from the parsed raw data cache of a RouteAggregator session
+    when there is one: files are parsed once in full and parsed again only when they change
+    Return pandas dataframe
+    """
+    if raw_cache is None:
+        return read_raw_file(fname, usecols=usecols)
+    key = (fname, os.path.getmtime(fname))
+    if key not in raw_cache:
+        for old_key in [k for k in raw_cache if k[0] == fname]:
+            del raw_cache[old_key]
+        raw_cache[key] = read_raw_file(fname)
+    return raw_cache[key][usecols] if usecols else raw_cache[key]
+
+def read_raw_file(fname, **kwargs):
+    """
+    Read a raw data file, stream-decompressing archives straight into the csv parser (no temporary files)
+    zip archives are read member by member (every .csv member), .zst needs the zstandard package
+    Return pandas dataframe
+    """
+    if fname.endswith('.zip'):
+        with zipfile.ZipFile(fname) as archive:
+            members = [name for name in archive.namelist() if name.lower().endswith('.csv')]
+            return pd.concat([read_stream(archive.open(name), **kwargs) for name in members], ignore_index=True)
+    elif fname.endswith('.gz'):
+        return read_stream(gzip.open(fname, 'rb'), **kwargs)
+    elif fname.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError('reading {0} needs the zstandard package'.format(fname))
+        stream = zstandard.ZstdDecompressor().stream_reader(open(fname, 'rb'), closefd=True)
+        return read_stream(stream, **kwargs)
+    return pd.read_csv(fname, **kwargs)
+
+def raw_chunks(fname, chunksize, **kwargs):
+    """
+    Read a raw data file (csv or archive as in read_raw_file) in chunks of rows, decompressing as it goes,
+    so only one chunk is in memory at a time
+    Return generator of pandas dataframes
+    """
+    if fname.endswith('.zip'):
+        with zipfile.ZipFile(fname) as archive:
+            for name in [name for name in archive.namelist() if name.lower().endswith('.csv')]:
+                with archive.open(name) as member:
+                    for chunk in pd.read_csv(member, chunksize=chunksize, **kwargs):
+                        yield chunk
+    elif fname.endswith('.gz'):
+        with gzip.open(fname, 'rb') as stream:
+            for chunk in pd.read_csv(stream, chunksize=chunksize, **kwargs):
+                yield chunk
+    elif fname.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError('reading {0} needs the zstandard package'.format(fname))
+        with open(fname, 'rb') as f:
+            for chunk in pd.read_csv(zstandard.ZstdDecompressor().stream_reader(f), chunksize=chunksize, **kwargs):
+                yield chunk
+    else:
+        for chunk in pd.read_csv(fname, chunksize=chunksize, **kwargs):
+            yield chunk
+
+def raw_base_name(fname):
+    """Raw data file name without its archive extension, e.g. On_Time_2016_1.zip -> On_Time_2016_1.csv"""
+    name = os.path.basename(fname)
+    for ext in ['.zip', '.gz', '.zst']:
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return name if name.endswith('.csv') else name + '.csv'
+
 def remove_return_list(l, el):
     """Used for cleaning up the stopover airports list"""
     l.remove(el)
     return l
 
+def airport_snapshot(csv_fname):
+    """
+    Parse airports.csv once into a snapshot: a numpy structured array with every column as fixed width strings
+    and a null flag per column, names with non-ascii chars cleaned up for mapping html
+    Return numpy structured array
+    """
+    raw = pd.read_csv(csv_fname, header=None, dtype=str)
+    raw.columns = AIRPORT_COLS
+    fields = []
+    for col in AIRPORT_COLS:
+        fields += [(col, 'U{0}'.format(max(int(raw[col].str.len().max()), 1))), ('{0}_null'.format(col), bool)]
+    snapshot = np.zeros(len(raw), dtype=fields)
+    for col in AIRPORT_COLS:
+        snapshot[col] = raw[col].fillna('').values
+        snapshot['{0}_null'.format(col)] = raw[col].isnull().values
+    # clean up non-ascii chars for mapping html, on the code points of all names at once (0 is padding)
+    names = np.ascontiguousarray(snapshot['name'])
+    chars = names.view(np.uint32).reshape(len(names), -1)
+    chars[(chars > 0) & ((chars < 32) | (chars > 126))] = ord(' ')
+    snapshot['name'] = names
+    return snapshot
+
 def airport_data():
     """
-    Read in airport data
+    Read in airport data, from the airport snapshot (data/airports/airports.npy, memory-mapped) which is only
+    rebuilt when airports.csv changes
     Source: http://openflights.org/data.html#airport
     Return pandas dataframe
     """
     airport_data_dir = '{0}/airports'.format(data_dir)
-    airports = pd.read_csv('{0}/airports.csv'.format(airport_data_dir), header=None, dtype=str)
-    airports.columns = ['id', 'name', 'city', 'country', 'code', 'icao', 'lat', 'lon', 'altitude',
-                        'utc_offset', 'dst', 'timezone', 'type', 'source']
-    # clean up non-ascii chars for mapping html
-    airports['name'] = airports['name'].map(lambda x: ''.join([" " if ord(i) < 32 or ord(i) > 126 else i for i in x]))
-    #airports['city'] = airports['city'].map(lambda x: ''.join([" " if ord(i) < 32 or ord(i) > 126 else i for i in x]))
+    csv_fname = '{0}/airports.csv'.format(airport_data_dir)
+    snapshot_fname = '{0}/airports.npy'.format(airport_data_dir)
+    if os.path.exists(snapshot_fname) and os.path.getmtime(snapshot_fname) >= os.path.getmtime(csv_fname):
+        snapshot = np.load(snapshot_fname, mmap_mode='r')
+    else:
+        snapshot = airport_snapshot(csv_fname)
+        ## written next to airports.csv when the data directory is writable
+        try:
+            tmp_fname = '{0}.{1}.tmp'.format(snapshot_fname, os.getpid())
+            with open(tmp_fname, 'wb') as f:
+                np.save(f, snapshot)
+            os.rename(tmp_fname, snapshot_fname)
+        except (IOError, OSError):
+            pass
+    airports = pd.DataFrame(dict((col, snapshot[col].astype(object)) for col in AIRPORT_COLS), columns=AIRPORT_COLS)
+    for col in AIRPORT_COLS:
+        null = np.asarray(snapshot['{0}_null'.format(col)])
+        if null.any():
+            airports.loc[null, col] = np.nan
     return airports
 
-def aircraft_delay_data(quarter, anchor_state='CA', max_dist=800):
+def aircraft_delay_rows(quarter, anchor_state='CA', max_dist=800):
     """
-    Read in aircraft delay (a.k.a. on time performance) data
+    Read in aircraft delay (a.k.a. on time performance) flights, cut down to the anchor state and max distance,
+    with the orig/dest airport data, the airline delay columns and the route id of each flight
     Note: "ot" stands for "on time"
     Source: On-Time Performance Database in https://www.transtats.bts.gov/Tables.asp?DB_ID=120&DB_Name=Airline%20On-Time%20Performance%20Data&DB_Short_Name=On-Time
-    Return pandas dataframe aggregated to a collection of routes
+    Return pandas dataframe of flights
     """
     ot_data_dir = '{0}/aircraft_delays'.format(data_dir)
-    ot_files = sorted(glob('{0}/*.csv'.format(ot_data_dir)))
+    ot_files = raw_data_files(ot_data_dir)
     print('using files {0}'.format(ot_files))
     sys.stdout.flush()
     ot_df_list = []
     for fname in ot_files:
-        ot_df_i = pd.read_csv(fname)
+        ot_df_i = read_raw(fname)
         ot_df_list.append(ot_df_i)
     ot_df = pd.concat(ot_df_list)
 
@@ -68,7 +444,7 @@ def aircraft_delay_data(quarter, anchor_state='CA', max_dist=800):
                'DestAirportID', 'Dest', 'DestState', 'DestStateName',
                'DepDelay', 'TaxiOut', 'ArrDelay', 'Cancelled', 'CancellationCode',
                'CarrierDelay', 'SecurityDelay', 'WeatherDelay', 'NASDelay', 'LateAircraftDelay',
-               'AirTime', 'ActualElapsedTime', 'Flights', 'Distance']
+               'AirTime', 'ActualElapsedTime', 'Flights', 'Distance', 'CRSDepTime']
 
     # cut down to anchor state and max distance
     if quarter:
@@ -105,6 +481,19 @@ def aircraft_delay_data(quarter, anchor_state='CA', max_dist=800):
     ot_ca_airports['AirlineDelay_10'] = ot_ca_airports['AirlineDelay'] > 10.0
     ot_ca_airports['AirlineDelay_20'] = ot_ca_airports['AirlineDelay'] > 20.0
     ot_ca_airports['AirlineDelay_30'] = ot_ca_airports['AirlineDelay'] > 30.0
+    ot_ca_airports['route_id'] = route_utils.route_ids(ot_ca_airports['orig_code'], ot_ca_airports['dest_code'])
+    return ot_ca_airports
+
+def aircraft_delay_data(quarter, anchor_state='CA', max_dist=800, bootstrap=0, workers=None, seed=0, rows=None):
+    """
+    Aircraft delay flights (aircraft_delay_rows) aggregated to routes
+    With bootstrap > 0 replicates, route metrics come with bootstrap confidence intervals (_lo, _hi)
+    rows are the flights of aircraft_delay_rows if already read in (e.g. to build the delay sketches from the same pass)
+    Return pandas dataframe aggregated to a collection of routes
+    """
+    if rows is None:
+        rows = aircraft_delay_rows(quarter, anchor_state=anchor_state, max_dist=max_dist)
+    ot_ca_airports = rows
 
     # aggregate stats for each route
     ## median delay time, fraction of delays > x minutes, total flights taken
@@ -169,24 +558,83 @@ def aircraft_delay_data(quarter, anchor_state='CA', max_dist=800):
                                              how='inner')
 
     route_merge = route_med_mean_count_merge
+    route_merge.insert(0, 'route_id', route_utils.route_ids(route_merge['orig_code'], route_merge['dest_code']))
+    if bootstrap:
+        route_merge = bootstrap_cis(route_merge, ot_ca_airports, BOOTSTRAP_METRICS['aircraft_delay'],
+                                    replicates=bootstrap, seed=seed, workers=workers)
     print('{0} routes'.format(len(route_merge)))
-
     return route_merge
 
-def aircraft_occupancy_data(quarter, anchor_state='CA', max_dist=800):
+def delay_sketches(rows, hist_cols=None, tod_bins=None):
+    """
+    Per-route delay histograms of hist_cols (e.g. ['AirlineDelay', 'DepDelay']) and, with tod_bins (24 or 96),
+    time of day delay profiles of aircraft delay flights (aircraft_delay_rows), written to delay_histograms.npz
+    Return dict of numpy arrays
+    """
+    sketches = delay_histograms(rows, hist_cols or [])
+    if tod_bins:
+        sketches.update(tod_profiles(rows, tod_bins))
+    return sketches
+
+def delay_histograms(rows, cols):
+    """
+    Per-route fixed-bin histograms of delay columns (DELAY_HIST_EDGES, first and last bin open ended),
+    one bincount over route x bin per column, plus the route's flights without a value (e.g. AirlineDelay
+    is only reported for flights arriving 15+ min late); histograms of the same column add up across
+    files and quarters by route id
+    Return dict of numpy arrays: route_id, <col>_edges, <col>_counts (routes x bins) and <col>_missing
+    """
+    routes, route_idx = np.unique(rows['route_id'].values, return_inverse=True)
+    histograms = {'route_id': routes}
+    for col in cols:
+        edges = DELAY_HIST_EDGES[col]
+        n_bins = len(edges) + 1
+        values = rows[col].values.astype(float)
+        valid = ~np.isnan(values)
+        bin_idx = np.searchsorted(edges, values[valid], side='left')
+        counts = np.bincount(route_idx[valid] * n_bins + bin_idx, minlength=len(routes) * n_bins)
+        histograms['{0}_edges'.format(col)] = edges
+        histograms['{0}_counts'.format(col)] = counts.reshape(len(routes), n_bins).astype(np.int32)
+        histograms['{0}_missing'.format(col)] = np.bincount(route_idx[~valid], minlength=len(routes)).astype(np.int32)
+    return histograms
+
+def tod_profiles(rows, n_bins=24):
+    """
+    Per-route time of day delay profiles: flights and flights with an AirlineDelay over each of TOD_THRESHOLDS per
+    scheduled departure time bin (CRSDepTime, local hhmm), one bincount over route x bin per count; profiles add up
+    across files and quarters by route id as the delay histograms (flights without a scheduled time are left out)
+    Return dict of numpy arrays: route_id, tod_bins, tod_flights and tod_AirlineDelay_<threshold> (routes x bins)
+    """
+    routes, route_idx = np.unique(rows['route_id'].values, return_inverse=True)
+    hhmm = rows['CRSDepTime'].values.astype(float)
+    valid = ~np.isnan(hhmm)
+    ## 2400 is midnight
+    minutes = (hhmm[valid] // 100 * 60 + hhmm[valid] % 100) % 1440
+    cells = route_idx[valid] * n_bins + (minutes * n_bins // 1440).astype(np.int64)
+    delay = rows['AirlineDelay'].values[valid]
+    profiles = {'route_id': routes, 'tod_bins': np.int32(n_bins),
+                'tod_flights': np.bincount(cells, minlength=len(routes) * n_bins).reshape(len(routes), n_bins).astype(np.int32)}
+    for threshold in TOD_THRESHOLDS:
+        ## missing delays are not over the threshold, as in the AirlineDelay_<threshold>frac route columns
+        counts = np.bincount(cells, weights=delay > threshold, minlength=len(routes) * n_bins)
+        profiles['tod_AirlineDelay_{0}'.format(threshold)] = counts.reshape(len(routes), n_bins).astype(np.int32)
+    return profiles
+
+def aircraft_occupancy_data(quarter, anchor_state='CA', max_dist=800, bootstrap=0, workers=None, seed=0):
     """
     Read in aircraft occupancy data
     Note: "pas" stands for "passenger"
     Source: T-100 Domestic Segment Database in https://www.transtats.bts.gov/Tables.asp?DB_ID=110&DB_Name=Air%20Carrier%20Statistics%20%28Form%2041%20Traffic%29-%20%20U.S.%20Carriers&DB_Short_Name=Air%20Carriers
+    With bootstrap > 0 replicates, route metrics come with bootstrap confidence intervals (_lo, _hi)
     Return pandas dataframe aggregated to a collection of routes
     """
     pas_dir = '{0}/aircraft_occupancy'.format(data_dir)
-    pas_files = sorted(glob('{0}/*.csv'.format(pas_dir)))
+    pas_files = raw_data_files(pas_dir)
     print('using files {0}'.format(pas_files))
     sys.stdout.flush()
     pas_df_list = []
     for fname in pas_files:
-        pas_df_i = pd.read_csv(fname)
+        pas_df_i = read_raw(fname)
         pas_df_list.append(pas_df_i)
     pas_df = pd.concat(pas_df_list)
 
@@ -280,26 +728,32 @@ def aircraft_occupancy_data(quarter, anchor_state='CA', max_dist=800):
                                   how='inner')
 
     route_merge = route_sum_med_mean_merge
+    route_merge.insert(0, 'route_id', route_utils.route_ids(route_merge['orig_code'], route_merge['dest_code']))
+    if bootstrap:
+        pas_ca_airports['route_id'] = route_utils.route_ids(pas_ca_airports['orig_code'], pas_ca_airports['dest_code'])
+        route_merge = bootstrap_cis(route_merge, pas_ca_airports, BOOTSTRAP_METRICS['aircraft_occupancy'],
+                                    replicates=bootstrap, seed=seed, workers=workers)
     print('{0} routes'.format(len(route_merge)))
 
     return route_merge
 
-def flyer_class_data(quarter, anchor_state='CA', max_dist=800):
+def flyer_class_data(quarter, anchor_state='CA', max_dist=800, bootstrap=0, workers=None, seed=0):
     """
     Read in flyer class data
     Note: this is the same dataset used for the stopover statistics
         "so" stands for "stopover"
         "cl" stands for "class"
     Source: DB1BCoupon database in https://www.transtats.bts.gov/Tables.asp?DB_ID=125&DB_Name=Airline%20Origin%20and%20Destination%20Survey%20%28DB1B%29&DB_Short_Name=Origin%20and%20Destination%20Survey
+    With bootstrap > 0 replicates, route metrics come with bootstrap confidence intervals (_lo, _hi)
     Return pandas dataframe aggregated to a collection of routes
     """
     so_dir = '{0}/air_coupons'.format(data_dir)
-    so_files = sorted(glob('{0}/*.csv'.format(so_dir)))
+    so_files = raw_data_files(so_dir)
     print('using files {0}'.format(so_files))
     sys.stdout.flush()
     so_df_list = []
     for fname in so_files:
-        so_df_i = pd.read_csv(fname)
+        so_df_i = read_raw(fname)
         so_df_list.append(so_df_i)
     so_df = pd.concat(so_df_list)
 
@@ -379,25 +833,31 @@ def flyer_class_data(quarter, anchor_state='CA', max_dist=800):
                                  how='inner')
 
     route_merge = route_sum_mean_merge
+    route_merge.insert(0, 'route_id', route_utils.route_ids(route_merge['orig_code'], route_merge['dest_code']))
+    if bootstrap:
+        so_ca_airports['route_id'] = route_utils.route_ids(so_ca_airports['orig_code'], so_ca_airports['dest_code'])
+        route_merge = bootstrap_cis(route_merge, so_ca_airports, BOOTSTRAP_METRICS['flyer_class'],
+                                    replicates=bootstrap, seed=seed, workers=workers)
     print('{0} routes'.format(len(route_merge)))
 
     return route_merge
 
-def flyer_stopover_data(quarter, anchor_state='CA', max_dist=800):
+def flyer_stopover_data(quarter, anchor_state='CA', max_dist=800, bootstrap=0, workers=None, seed=0):
     """
     Read in flyer stopover data
     Note: this is the same dataset used for the fare class statistics
         "so" stands for "stopover"
     Source: DB1BCoupon database in https://www.transtats.bts.gov/Tables.asp?DB_ID=125&DB_Name=Airline%20Origin%20and%20Destination%20Survey%20%28DB1B%29&DB_Short_Name=Origin%20and%20Destination%20Survey
+    With bootstrap > 0 replicates, route metrics come with bootstrap confidence intervals (_lo, _hi)
     Return pandas dataframe aggregated to a collection of routes
     """
     so_dir = '{0}/air_coupons'.format(data_dir)
-    so_files = sorted(glob('{0}/*.csv'.format(so_dir)))
+    so_files = raw_data_files(so_dir)
     print('using files {0}'.format(so_files))
     sys.stdout.flush()
     so_df_list = []
     for fname in so_files:
-        so_df_i = pd.read_csv(fname)
+        so_df_i = read_raw(fname)
         so_df_list.append(so_df_i)
     so_df = pd.concat(so_df_list)
 
@@ -520,6 +980,7 @@ def flyer_stopover_data(quarter, anchor_state='CA', max_dist=800):
 
     ## merge
     route_merge = route_sum_mean_set_merge
+    route_merge.insert(0, 'route_id', route_utils.route_ids(route_merge['orig_code'], route_merge['dest_code']))
 
     ## remove orig from stopover_airports
     route_merge['stopover_airports_clean'] = route_merge.apply(lambda f: remove_return_list(list(f['stopover_airports']),f['orig_code']) if f['orig_code'] in list(f['stopover_airports']) \
@@ -529,15 +990,79 @@ def flyer_stopover_data(quarter, anchor_state='CA', max_dist=800):
                                                              float(f['dest_lat']), float(f['dest_lon'])), axis=1)
     route_merge_short = route_merge.loc[((route_merge['ORIGIN_STATE_ABR'] == anchor_state) | (route_merge['DEST_STATE_ABR'] == anchor_state)) & \
                                          (route_merge['dist_calc'] < max_dist)]
+    if bootstrap:
+        so_ca_merge['route_id'] = route_utils.route_ids(so_ca_merge['orig_code'], so_ca_merge['dest_code'])
+        route_merge_short = bootstrap_cis(route_merge_short.copy(), so_ca_merge, BOOTSTRAP_METRICS['flyer_stopover'],
+                                          replicates=bootstrap, seed=seed, workers=workers)
 
     print('{0} routes'.format(len(route_merge_short)))
 
     return route_merge_short
 
+def route_network_data(quarter):
+    """
+    Read in the air coupon data as a route network in compressed sparse row (CSR) form
+    Nodes are airports (sorted codes), leg edges are coupon legs orig -> dest with their passengers and coupons,
+    and every orig -> dest market (first coupon's orig to last coupon's dest) keeps its nonstop and connecting
+    passengers along with the connection airports its connecting passengers go through
+    Note: coupon data is a 10% sample of all tickets, passengers are not scaled up
+    Source: DB1BCoupon database in https://www.transtats.bts.gov/Tables.asp?DB_ID=125&DB_Name=Airline%20Origin%20and%20Destination%20Survey%20%28DB1B%29&DB_Short_Name=Origin%20and%20Destination%20Survey
+    Return dict of numpy arrays
+    """
+    so_df = read_raw_cols('air_coupons', ['QUARTER', 'MKT_ID', 'SEQ_NUM', 'ORIGIN', 'DEST', 'PASSENGERS'],
+                          quarter, 'QUARTER')
+    so_df = so_df.loc[so_df['PASSENGERS'] > 0].sort_values(['MKT_ID', 'SEQ_NUM'])
+    codes, nodes = np.unique(np.concatenate([so_df['ORIGIN'].values.astype(str), so_df['DEST'].values.astype(str)]),
+                             return_inverse=True)
+    n_nodes = len(codes)
+    orig = nodes[:len(so_df)]
+    dest = nodes[len(so_df):]
+    passengers = so_df['PASSENGERS'].values.astype(float)
+
+    # coupon legs, edges sorted by orig then dest
+    edges, edge_idx = np.unique(orig * n_nodes + dest, return_inverse=True)
+    network = {'airports': codes,
+               'leg_indptr': np.concatenate([[0], np.cumsum(np.bincount(edges // n_nodes, minlength=n_nodes))]),
+               'leg_indices': edges % n_nodes,
+               'leg_passengers': np.bincount(edge_idx, weights=passengers),
+               'leg_coupons': np.bincount(edge_idx)}
+
+    # markets (itinerary before prolonged stop), passengers from the last coupon as in flyer_stopover_data
+    mkt_ids = so_df['MKT_ID'].values
+    first = np.flatnonzero(np.concatenate([[True], mkt_ids[1:] != mkt_ids[:-1]]))
+    last = np.concatenate([first[1:], [len(mkt_ids)]]) - 1
+    ods, od_idx = np.unique(orig[first] * n_nodes + dest[last], return_inverse=True)
+    nonstop = (last == first)
+    network['od_orig'] = ods // n_nodes
+    network['od_dest'] = ods % n_nodes
+    network['od_nonstop_passengers'] = np.bincount(od_idx, weights=passengers[last] * nonstop, minlength=len(ods))
+    network['od_connecting_passengers'] = np.bincount(od_idx, weights=passengers[last] * ~nonstop, minlength=len(ods))
+
+    ## connection airports: dest of every coupon but the market's last one
+    market = np.repeat(np.arange(len(first)), last - first + 1)
+    connection = np.ones(len(mkt_ids), dtype=bool)
+    connection[last] = False
+    vias, via_idx = np.unique(od_idx[market[connection]] * n_nodes + dest[connection], return_inverse=True)
+    network['via_indptr'] = np.concatenate([[0], np.cumsum(np.bincount(vias // n_nodes, minlength=len(ods)))])
+    network['via_nodes'] = vias % n_nodes
+    network['via_passengers'] = np.bincount(via_idx, weights=passengers[last][market[connection]])
+    print('{0} airports, {1} legs, {2} markets ({3} with connections)'.format(
+        n_nodes, len(edges), len(ods), (network['od_connecting_passengers'] > 0).sum()))
+    return network
+
+def save_route_network(network, network_dir):
+    """Write every route network array as an .npy file (memory-mappable with np.load(mmap_mode='r'))"""
+    if not os.path.exists(network_dir):
+        os.makedirs(network_dir)
+    for key, values in network.items():
+        np.save('{0}/{1}.npy'.format(network_dir, key), values)
+
 def amtrak_data(anchor_state='CA'):
     """
     Read in amtrak data (station locations, station ridership, station delays)
-    Note: amtrak locations are entire U.S. while station ridership and delays are compiled initially in CA only
+    Note: amtrak locations are entire U.S. while station ridership is compiled initially in CA only, as are station delays
+          unless they have been created for every station from the status archive (--amtrak-status), then
+            every station with status archive delays is kept along with the anchor state's stations
           State added in with ridership data
           amtrak stations outside of anchor state with the same city name as one in the anchor state
             (e.g., Richmond, Colfax) included in amtrak_plus.csv output due to airport merge
@@ -591,9 +1116,9 @@ def amtrak_data(anchor_state='CA'):
                                           on=['city_lower'],
                                           how='left')
 
-    # add delay data (CA only for now)
-    ca_delays = pd.read_csv('{0}/amtrak_station_delays_ca_2016.csv'.format(amtrak_dir))
-    stations_airports_ca_users_delays = pd.merge(stations_airports_ca_users, ca_delays,
+    # add delay data (every station from the status archive, CA only without it)
+    delays = station_delays()
+    stations_airports_ca_users_delays = pd.merge(stations_airports_ca_users, delays,
                                                  on=['code'],
                                                  how='left')
 
@@ -605,20 +1130,1060 @@ def amtrak_data(anchor_state='CA'):
                                                      'closest_a2_lat', 'closest_a2_lon', 'closest_a2_dist',
                                                      'Users', 'delay_avg', 'delay_med']]
 
-    # cut on anchor state (State added in with ridership data)
-    amtrak_plus = amtrak_plus.loc[amtrak_plus['State'] == anchor_state]
+    # cut on anchor state (State added in with ridership data), keeping the stations of every state
+    # with status archive delays (their State is only known for the ridership stations)
+    keep = amtrak_plus['State'] == anchor_state
+    if os.path.exists('{0}/aggregated/amtrak_station_delays.csv'.format(data_dir)):
+        keep |= amtrak_plus['delay_avg'].notnull()
+    amtrak_plus = amtrak_plus.loc[keep]
 
     return amtrak_plus
 
+def status_minutes(times):
+    """
+    Minutes after midnight of Amtrak status archive times (e.g. 1015A, 10:15A, 1245P or 24 hour 2215), parsed column-wise
+    Return numpy array (NaN where there is no time)
+    """
+    parts = times.astype(str).str.upper().str.replace(':', '', regex=False).str.strip().str.extract(r'^(\d{1,2})(\d{2})([AP]?)')
+    hours = parts[0].astype(float).values
+    hours = np.where(parts[2] == 'P', hours % 12 + 12, np.where(parts[2] == 'A', hours % 12, hours))
+    return hours * 60 + parts[1].astype(float).values
+
+def status_delays(status):
+    """
+    Delay in minutes at every station stop of Amtrak status archive rows: actual minus scheduled departure
+    (arrival where there is no departure, e.g. the end of the line), wrapped to within 12 hours of the schedule
+    for trains running past midnight
+    Return pandas dataframe of station code, year (of the train's origin date) and delay
+    """
+    sch = status_minutes(status['Sch Dp'])
+    act = status_minutes(status['Act Dp'])
+    no_dp = np.isnan(sch) | np.isnan(act)
+    sch = np.where(no_dp, status_minutes(status['Sch Ar']), sch)
+    act = np.where(no_dp, status_minutes(status['Act Ar']), act)
+    delays = pd.DataFrame({'code': status['Station'].str.strip().str.upper().values,
+                           'year': pd.to_datetime(status['Origin Date'], format='%m/%d/%Y', errors='coerce').dt.year.values,
+                           'delay': (act - sch + 720) % 1440 - 720})
+    return delays.dropna()
+
+def amtrak_status_delays(status_dir, chunksize=200000):
+    """
+    Read in raw Amtrak status archive files (csv, or zip/gz/zst archives of them; columns AMTRAK_STATUS_COLS),
+    streamed chunk by chunk into per-station, per-year delay histograms (DELAY_HIST_EDGES['DepDelay'] bins) and sums,
+    so memory is bounded by the chunk size and the number of stations, whatever the size of the archive
+    Source: https://juckins.net/amtrak_status/archive/html/history.php (local copy)
+    Return pandas dataframe of every station and year with its number of stops, mean, median and 90th percentile delay
+    """
+    edges = DELAY_HIST_EDGES['DepDelay']
+    n_bins = len(edges) + 1
+    keys = np.array([], dtype=str)
+    counts = np.zeros((0, n_bins), dtype=np.int64)
+    sums = np.zeros(0)
+    for fname in raw_data_files(status_dir):
+        print('streaming {0}...'.format(fname))
+        sys.stdout.flush()
+        for chunk in raw_chunks(fname, chunksize, usecols=AMTRAK_STATUS_COLS, dtype=str):
+            delays = status_delays(chunk)
+            chunk_keys, key_idx = np.unique((delays['code'] + ' ' + delays['year'].astype(int).astype(str)).values.astype(str),
+                                            return_inverse=True)
+            ## grow the accumulators by the stations (and years) not seen before
+            new_keys = np.union1d(keys, chunk_keys)
+            if len(new_keys) > len(keys):
+                old_rows = np.searchsorted(new_keys, keys)
+                counts_grown = np.zeros((len(new_keys), n_bins), dtype=np.int64)
+                sums_grown = np.zeros(len(new_keys))
+                counts_grown[old_rows] = counts
+                sums_grown[old_rows] = sums
+                keys, counts, sums = new_keys, counts_grown, sums_grown
+            rows = np.searchsorted(keys, chunk_keys)[key_idx]
+            bin_idx = np.searchsorted(edges, delays['delay'].values, side='left')
+            counts += np.bincount(rows * n_bins + bin_idx, minlength=counts.size).reshape(counts.shape)
+            sums += np.bincount(rows, weights=delays['delay'].values, minlength=len(keys))
+
+    station_delays = pd.DataFrame([key.split(' ') for key in keys], columns=['code', 'year'])
+    station_delays['year'] = station_delays['year'].astype(int)
+    station_delays['delay_n'] = counts.sum(axis=1)
+    station_delays['delay_avg'] = sums / np.maximum(station_delays['delay_n'].values, 1)
+    station_delays['delay_med'] = route_utils.hist_quantile(counts, edges, 0.5)
+    station_delays['delay_q90'] = route_utils.hist_quantile(counts, edges, 0.9)
+    print('{0} stations'.format(station_delays['code'].nunique()))
+    return station_delays.round({'delay_avg': 1, 'delay_med': 1, 'delay_q90': 1})
+
+def station_delays(year=AMTRAK_DELAY_YEAR):
+    """
+    Amtrak station delays of a year, from the status archive delays of every U.S. station when they have been
+    created (data/aggregated/amtrak_station_delays.csv), from the CA 2016 station delays otherwise
+    Return pandas dataframe of code, delay_avg and delay_med
+    """
+    fname = '{0}/aggregated/amtrak_station_delays.csv'.format(data_dir)
+    if os.path.exists(fname):
+        delays = pd.read_csv(fname)
+        return delays.loc[delays['year'] == year, ['code', 'delay_avg', 'delay_med']]
+    return pd.read_csv('{0}/amtrak/amtrak_station_delays_ca_2016.csv'.format(data_dir))[['code', 'delay_avg', 'delay_med']]
+
+def station_data():
+    """
+    Read in U.S. Amtrak station locations with ridership (CA only for now) and delay data where available
+    (merged as in amtrak_data)
+    Return pandas dataframe
+    """
+    amtrak_dir = '{0}/amtrak'.format(data_dir)
+    stations = pd.read_csv('{0}/amtrak_stations.csv'.format(amtrak_dir))
+    stations['city_lower'] = stations['city_caps'].str.lower()
+    ca_users = pd.read_csv('{0}/amtrak_station_ridership_ca_2016.csv'.format(amtrak_dir))
+    ca_users['city_lower'] = ca_users['City'].str.lower()
+    stations = pd.merge(stations, ca_users[['city_lower', 'Users', 'State']], on=['city_lower'], how='left')
+    stations = pd.merge(stations, station_delays(), on=['code'], how='left')
+    return stations[['city_caps', 'State', 'code', 'lat', 'lon', 'Users', 'delay_avg', 'delay_med']].drop_duplicates('code')
+
+def points_within(lat, lon, query_lat, query_lon, radius):
+    """
+    Spatial join of query points to the points within radius (mi), using a grid index over the points:
+    points are bucketed in cells of radius/69 degrees (sorted by cell, CSR style), and each query only computes
+    distances to the points in its own and neighboring cells (more longitude cells away from the equator,
+    wrapping around the antimeridian)
+    Return query index, point index and distance (numpy arrays) of every pair within radius
+    """
+    cell = radius / 69.0
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    query_lat = np.asarray(query_lat, dtype=float)
+    query_lon = np.asarray(query_lon, dtype=float)
+    ## longitude cells wrap around the antimeridian
+    n_x = max(int(np.floor(360 / cell)), 1)
+    cell_x = 360.0 / n_x
+    ## points sorted by cell key
+    keys = np.floor((lat + 90) / cell).astype(np.int64) * n_x + np.floor((lon + 180) / cell_x).astype(np.int64) % n_x
+    order = np.argsort(keys, kind='mergesort')
+    cells, cell_starts, cell_counts = np.unique(keys[order], return_index=True, return_counts=True)
+
+    ## neighboring cells of every query: +-1 in latitude, in longitude the cells within the widest longitude
+    ## difference on the radius circle, asin(sin(radius / R) / cos(lat)), or all of them around the poles
+    ratio = np.sin(radius / (6372.8 / 1.609)) / np.maximum(np.cos(np.radians(query_lat)), 1e-12)
+    dlon = np.where(ratio >= 1, 180.0, np.degrees(np.arcsin(np.minimum(ratio, 1))))
+    span_x = np.minimum(np.ceil(dlon / cell_x), n_x).astype(int)
+    width_x = np.minimum(2 * span_x + 1, n_x)
+    span = 3 * width_x
+    query = np.repeat(np.arange(len(query_lat)), span)
+    offset = np.arange(span.sum()) - np.repeat(np.cumsum(span) - span, span)
+    dy = offset // width_x[query] - 1
+    dx = offset % width_x[query] - span_x[query]
+    query_keys = (np.floor((query_lat[query] + 90) / cell).astype(np.int64) + dy) * n_x + \
+                 (np.floor((query_lon[query] + 180) / cell_x).astype(np.int64) + dx) % n_x
+    found = np.minimum(np.searchsorted(cells, query_keys), len(cells) - 1)
+    found_mask = cells[found] == query_keys
+    query, found = query[found_mask], found[found_mask]
+
+    ## points in those cells
+    counts = cell_counts[found]
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    point = order[np.repeat(cell_starts[found], counts) + offsets]
+    query = np.repeat(query, counts)
+    dist = geocalc(query_lat[query], query_lon[query], lat[point], lon[point])
+    within = dist <= radius
+    return query[within], point[within], dist[within]
+
+def rail_alternatives(routes, stations, radius=25):
+    """
+    Candidate rail substitutes for every air route: pairs of distinct Amtrak stations within radius (mi)
+    of the orig and the dest airport, with their distances, straight line station to station distance,
+    and the stations' ridership and delays
+    Return pandas dataframe with one row per route and station pair
+    """
+    endpoints = pd.concat([routes[['orig_code', 'orig_lat', 'orig_lon']].rename(columns=lambda c: c.replace('orig_', '')),
+                           routes[['dest_code', 'dest_lat', 'dest_lon']].rename(columns=lambda c: c.replace('dest_', ''))])
+    endpoints = endpoints.drop_duplicates('code').reset_index(drop=True)
+    airport_idx, station_idx, dist = points_within(stations['lat'], stations['lon'],
+                                                   endpoints['lat'], endpoints['lon'], radius)
+    near = stations.iloc[station_idx][['code', 'city_caps', 'lat', 'lon', 'Users', 'delay_avg', 'delay_med']].reset_index(drop=True)
+    near.insert(0, 'airport_code', endpoints['code'].values[airport_idx])
+    near['airport_dist'] = dist
+
+    alternatives = routes[['route_id', 'orig_code', 'orig_city', 'dest_code', 'dest_city']]
+    for prefix in ['orig', 'dest']:
+        prefixed = near.rename(columns=lambda c: '{0}_station_{1}'.format(prefix, c))
+        alternatives = pd.merge(alternatives, prefixed,
+                                left_on=['{0}_code'.format(prefix)], right_on=['{0}_station_airport_code'.format(prefix)],
+                                how='inner')
+        alternatives = alternatives.drop('{0}_station_airport_code'.format(prefix), axis=1)
+    alternatives = alternatives.loc[alternatives['orig_station_code'] != alternatives['dest_station_code']]
+    alternatives['station_dist'] = geocalc(alternatives['orig_station_lat'].values, alternatives['orig_station_lon'].values,
+                                           alternatives['dest_station_lat'].values, alternatives['dest_station_lon'].values)
+    alternatives = alternatives.sort_values(['route_id', 'orig_station_airport_dist', 'dest_station_airport_dist'])
+    print('{0} rail alternatives for {1} of {2} routes'.format(len(alternatives), alternatives['route_id'].nunique(),
+                                                                 len(routes)))
+    return alternatives.reset_index(drop=True)
+
+def route_fact_table(input_dir):
+    """
+    Combine the route datasets of a directory (any of the PARTIAL_DATASETS <dataset>_routes.csv files)
+    into one wide route fact table keyed by route id: the route info columns once, every column of a dataset
+    prefixed by the dataset (e.g. aircraft_delay__Flight_Count) and has_<dataset> flags of the routes it covers
+    Return pandas dataframe and dict of its column dtypes (route info as category, counts as nullable Int64,
+    since a dataset's columns are missing for the routes it doesn't cover)
+    """
+    datasets = []
+    for dataset, raw_dir, partials_func, period_months in PARTIAL_DATASETS:
+        fname = '{0}/{1}_routes.csv'.format(input_dir, dataset)
+        if not os.path.exists(fname):
+            continue
+        routes = pd.read_csv(fname).rename(columns=FACT_STATE_COLS)
+        ## route ids also for datasets aggregated before they were written out
+        if 'route_id' not in routes.columns:
+            routes.insert(0, 'route_id', route_utils.route_ids(routes['orig_code'], routes['dest_code']))
+        datasets.append((dataset, routes.set_index('route_id')))
+    info_cols = ROUTE_INFO_COLS[1:]
+
+    ## every route once, in route id order
+    route_info = pd.concat([routes[info_cols] for dataset, routes in datasets])
+    facts = route_info[~route_info.index.duplicated()].sort_index()
+    dtypes = {'route_id': 'int64'}
+    for col in info_cols:
+        dtypes[col] = 'float64' if col.endswith('_lat') or col.endswith('_lon') else 'category'
+    for dataset, routes in datasets:
+        facts['has_{0}'.format(dataset)] = facts.index.isin(routes.index)
+        dtypes['has_{0}'.format(dataset)] = 'bool'
+    for dataset, routes in datasets:
+        for col in [col for col in routes.columns if col not in info_cols]:
+            fact_col = '{0}__{1}'.format(dataset, col)
+            facts[fact_col] = routes[col].reindex(facts.index)
+            if routes[col].dtype.kind in 'iu':
+                dtypes[fact_col] = 'Int64'
+            elif routes[col].dtype.kind == 'f':
+                dtypes[fact_col] = 'float64'
+            else:
+                dtypes[fact_col] = 'object'
+    facts = facts.reset_index()
+    print('{0} routes in the route fact table'.format(len(facts)))
+    return facts.astype(dtypes), dtypes
+
+def route_rows(df, orig_col, dest_col, orig_state_col, dest_state_col, dist_col, anchor_state, max_dist):
+    """
+    Cut raw rows down to the anchor state and max distance and merge in the orig/dest airport data
+    (same cut and airport merge as the route datasets above)
+    Return pandas dataframe with route id and orig_/dest_ airport columns (ROUTE_INFO_COLS)
+    """
+    rows = df.loc[((df[orig_state_col] == anchor_state) | (df[dest_state_col] == anchor_state)) & \
+                  (df[dist_col] < max_dist) & (df[dist_col] > 0)]
+    rows = rows.rename(columns={orig_state_col: 'orig_state', dest_state_col: 'dest_state'})
+    airport_cols = ['code', 'name', 'city', 'lat', 'lon']
+    for prefix, col in [('orig', orig_col), ('dest', dest_col)]:
+        prefixed = airports[airport_cols].rename(columns=dict((c, '{0}_{1}'.format(prefix, c)) for c in airport_cols))
+        rows = pd.merge(rows, prefixed, left_on=[col], right_on=['{0}_code'.format(prefix)], how='inner')
+    rows.insert(0, 'route_id', route_utils.route_ids(rows['orig_code'], rows['dest_code']))
+    return rows
+
+def bin_counts(group_idx, n_groups, values, bins, prefix):
+    """
+    Histogram sketch of a column per group, one count column per bin (missing values are not counted),
+    counted with one bincount over group * bins + bin
+    Return pandas dataframe with one row per group
+    """
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    idx = np.clip(np.searchsorted(bins, values[valid], side='right') - 1, 0, len(bins) - 1)
+    counts = np.bincount(np.asarray(group_idx)[valid] * len(bins) + idx, minlength=n_groups * len(bins))
+    return pd.DataFrame(counts.reshape(n_groups, len(bins)),
+                        columns=['{0}_hist_{1:02d}'.format(prefix, i) for i in range(len(bins))])
+
+def sum_partials(rows, parts, hists=None):
+    """
+    Sum per-row additive measures to route and period level, grouped by route id and period only
+    (the route info columns are attached once per route afterwards)
+    hists: list of (prefix, values, bins) of histogram sketches counted per route and period (see bin_counts)
+    Return pandas dataframe of ROUTE_INFO_COLS, period and the summed measures
+    """
+    ## one int64 key per route and period (periods are yyyymm)
+    keys, group_idx = np.unique(rows['route_id'].values.astype(np.int64) * 1000000 + rows['period'].values,
+                                return_inverse=True)
+    group_idx = group_idx.ravel()
+    sums = pd.DataFrame({'route_id': keys // 1000000, 'period': keys % 1000000})
+    for col in parts.columns:
+        sums[col] = np.bincount(group_idx, weights=parts[col].values.astype(float), minlength=len(keys))
+    for prefix, values, bins in hists or []:
+        sums = pd.concat([sums, bin_counts(group_idx, len(keys), values, bins, prefix)], axis=1)
+    route_info = rows[ROUTE_INFO_COLS].drop_duplicates('route_id')
+    return pd.merge(route_info, sums, on='route_id', how='right')[ROUTE_INFO_COLS + list(sums.columns[1:])]
+
+def delay_partials(ot_df, anchor_state, max_dist):
+    """
+    Additive per-route, per-month aggregates of aircraft delay data (counts, sums and a delay histogram)
+    Return pandas dataframe
+    """
+    rows = route_rows(ot_df.loc[ot_df['Flights'] == 1.0], 'Origin', 'Dest', 'OriginState', 'DestState', 'Distance',
+                      anchor_state, max_dist)
+    rows['period'] = rows['Year'] * 100 + rows['Month']
+    delay = rows['LateAircraftDelay'] + rows['CarrierDelay']
+    parts = pd.DataFrame({'flights': np.ones(len(rows)),
+                          'AirlineDelay_n': delay.notnull().values,
+                          'AirlineDelay_sum': delay.fillna(0).values,
+                          'AirlineDelay_10': (delay > 10.0).values,
+                          'AirlineDelay_20': (delay > 20.0).values,
+                          'AirlineDelay_30': (delay > 30.0).values})
+    for col in ['Distance', 'AirTime', 'ActualElapsedTime']:
+        parts['{0}_n'.format(col)] = rows[col].notnull().values
+        parts['{0}_sum'.format(col)] = rows[col].fillna(0).values
+    return sum_partials(rows, parts, hists=[('AirlineDelay', delay, DELAY_BINS)])
+
+def occupancy_partials(pas_df, anchor_state, max_dist):
+    """
+    Additive per-route, per-month aggregates of aircraft occupancy data (sums and an occupancy histogram)
+    Return pandas dataframe
+    """
+    rows = route_rows(pas_df.loc[pas_df['PASSENGERS'] > 0], 'ORIGIN', 'DEST', 'ORIGIN_STATE_ABR', 'DEST_STATE_ABR',
+                      'DISTANCE', anchor_state, max_dist)
+    rows['period'] = rows['YEAR'] * 100 + rows['MONTH']
+    occupancy = rows['PASSENGERS'] * 1.0 / rows['SEATS']
+    parts = pd.DataFrame({'rows': np.ones(len(rows)),
+                          'DEPARTURES_PERFORMED': rows['DEPARTURES_PERFORMED'].values,
+                          'SEATS': rows['SEATS'].values,
+                          'PASSENGERS': rows['PASSENGERS'].values,
+                          'occupancy_n': occupancy.notnull().values,
+                          'occupancy_sum': occupancy.fillna(0).values,
+                          'DISTANCE_sum': rows['DISTANCE'].values})
+    for col in ['RAMP_TO_RAMP', 'AIR_TIME']:
+        parts['{0}_n'.format(col)] = rows[col].notnull().values
+        parts['{0}_sum'.format(col)] = rows[col].fillna(0).values
+    return sum_partials(rows, parts, hists=[('occupancy', occupancy, OCCUPANCY_BINS)])
+
+def occupancy_cube(anchor_state='CA', max_dist=800):
+    """
+    Pre-aggregated aircraft occupancy cube at route, month, carrier and aircraft type grain: the additive measures
+    (CUBE_MEASURES) and an occupancy histogram sketch (OCCUPANCY_BINS) of every cell, so occupancy of any slice
+    (quarter, carriers, aircraft types) is rolled up from the cube with occupancy_query.py instead of the T-100 data
+    Return dict of numpy arrays (one row per cell, carrier is an index into carriers)
+    """
+    pas_df = read_raw_cols('aircraft_occupancy', ['DEPARTURES_SCHEDULED', 'DEPARTURES_PERFORMED', 'SEATS', 'PASSENGERS',
+                                                  'DISTANCE', 'AIR_TIME', 'UNIQUE_CARRIER', 'AIRCRAFT_TYPE', 'ORIGIN',
+                                                  'ORIGIN_STATE_ABR', 'DEST', 'DEST_STATE_ABR', 'YEAR', 'MONTH'],
+                           None, 'QUARTER')
+    rows = cut_routes(pas_df.loc[pas_df['PASSENGERS'] > 0], 'ORIGIN', 'DEST', 'ORIGIN_STATE_ABR', 'DEST_STATE_ABR',
+                      'DISTANCE', anchor_state, max_dist)
+    ## same routes as aircraft_occupancy_data (airports merged in)
+    rows = rows.loc[rows['orig_code'].isin(airports['code']) & rows['dest_code'].isin(airports['code'])]
+    carriers, carrier_idx = np.unique(rows['UNIQUE_CARRIER'].fillna('').values.astype(str), return_inverse=True)
+    occupancy = rows['PASSENGERS'] * 1.0 / rows['SEATS']
+    measures = pd.DataFrame({'rows': np.ones(len(rows)),
+                             'DEPARTURES_SCHEDULED': rows['DEPARTURES_SCHEDULED'].values,
+                             'DEPARTURES_PERFORMED': rows['DEPARTURES_PERFORMED'].values,
+                             'SEATS': rows['SEATS'].values,
+                             'PASSENGERS': rows['PASSENGERS'].values,
+                             'occupancy_n': occupancy.notnull().values,
+                             'occupancy_sum': occupancy.fillna(0).values,
+                             'DISTANCE_sum': rows['DISTANCE'].values,
+                             'AIR_TIME_sum': rows['AIR_TIME'].fillna(0).values})
+    ## cells: unique (route, month, carrier, aircraft type) keys, summed with bincounts over the cell index
+    cells, cell_idx = np.unique(np.stack([rows['route_id'].values.astype(np.int64),
+                                          (rows['YEAR'] * 100 + rows['MONTH']).values.astype(np.int64),
+                                          carrier_idx.astype(np.int64),
+                                          rows['AIRCRAFT_TYPE'].values.astype(np.int64)], axis=1),
+                                axis=0, return_inverse=True)
+    cell_idx = cell_idx.ravel()
+    cube = {'route_id': cells[:, 0],
+            'period': cells[:, 1].astype(np.int32),
+            'carrier': cells[:, 2].astype(np.int16),
+            'aircraft_type': cells[:, 3].astype(np.int32),
+            'carriers': carriers,
+            'occupancy_bins': np.asarray(OCCUPANCY_BINS),
+            'occupancy_hist': bin_counts(cell_idx, len(cells), occupancy, OCCUPANCY_BINS, 'occupancy').values.astype(np.int32)}
+    for col in CUBE_MEASURES:
+        cube[col] = np.bincount(cell_idx, weights=measures[col].values.astype(float), minlength=len(cells))
+    print('{0} cells of {1} routes, {2} carriers, {3} aircraft types'.format(
+        len(cells), len(np.unique(cube['route_id'])), len(carriers), len(np.unique(cube['aircraft_type']))))
+    return cube
+
+def class_partials(so_df, anchor_state, max_dist):
+    """
+    Additive per-route, per-quarter aggregates of flyer fare class data (passenger weighted class counts)
+    Return pandas dataframe
+    """
+    rows = route_rows(so_df.loc[so_df['PASSENGERS'] > 0], 'ORIGIN', 'DEST', 'ORIGIN_STATE_ABR', 'DEST_STATE_ABR',
+                      'DISTANCE', anchor_state, max_dist)
+    rows['period'] = rows['YEAR'] * 100 + (rows['QUARTER'] - 1) * 3 + 1
+    class_bf = rows['FARE_CLASS'].isin(['C', 'D', 'F', 'G'])
+    class_c = rows['FARE_CLASS'].isin(['X', 'Y']) | pd.isnull(rows['FARE_CLASS'])
+    parts = pd.DataFrame({'rows': np.ones(len(rows)),
+                          'PASSENGERS': rows['PASSENGERS'].values,
+                          'class_bf_w': (class_bf * rows['PASSENGERS']).values,
+                          'class_c_w': (class_c * rows['PASSENGERS']).values,
+                          'DISTANCE_sum': rows['DISTANCE'].values})
+    return sum_partials(rows, parts)
+
+def stopover_partials(so_df, anchor_state, max_dist):
+    """
+    Additive per-route, per-quarter aggregates of flyer stopover data (market and stopover counts)
+    Return pandas dataframe
+    """
+    rows = route_rows(so_df.loc[so_df['PASSENGERS'] > 0], 'ORIGIN', 'DEST', 'ORIGIN_STATE_ABR', 'DEST_STATE_ABR',
+                      'DISTANCE', anchor_state, max_dist)
+    # one market (itinerary before prolonged stop) from its first coupon's orig to its last coupon's dest
+    markets = rows.sort_values('SEQ_NUM').groupby('MKT_ID')
+    orig_cols = [col for col in ROUTE_INFO_COLS if col.startswith('orig_')]
+    dest_cols = [col for col in ROUTE_INFO_COLS if col.startswith('dest_')]
+    mkts = markets[['YEAR', 'QUARTER'] + orig_cols].first().join(markets[dest_cols + ['PASSENGERS']].last())
+    mkts['stopovers'] = markets.size() - 1
+    ## stopover airport of a market: orig of its last coupon (as in flyer_stopover_data)
+    mkts['stopover_airport'] = markets['orig_code'].last()
+    mkts = mkts.reset_index()
+    ## ensure short-haul routes from orig to dest, still anchored in anchor state
+    dist_calc = geocalc(mkts['orig_lat'].astype(float), mkts['orig_lon'].astype(float),
+                        mkts['dest_lat'].astype(float), mkts['dest_lon'].astype(float))
+    mkts = mkts.loc[((mkts['orig_state'] == anchor_state) | (mkts['dest_state'] == anchor_state)) & \
+                    (dist_calc < max_dist)].reset_index(drop=True)
+    mkts.insert(0, 'route_id', route_utils.route_ids(mkts['orig_code'], mkts['dest_code']))
+    mkts['period'] = mkts['YEAR'] * 100 + (mkts['QUARTER'] - 1) * 3 + 1
+    parts = pd.DataFrame({'markets': np.ones(len(mkts)),
+                          'stopover_markets': (mkts['stopovers'] > 0).values,
+                          'stopovers_sum': mkts['stopovers'].values,
+                          'PASSENGERS': mkts['PASSENGERS'].values})
+    sums = sum_partials(mkts, parts)
+    airports_set = mkts.groupby(['route_id', 'period'])['stopover_airport'].apply(lambda codes: ' '.join(sorted(set(codes))))
+    sums['stopover_airports'] = airports_set.reindex(pd.MultiIndex.from_frame(sums[['route_id', 'period']])).values
+    return sums
+
+def partials_version(partials_func):
+    """
+    Hash of the code that builds a dataset's partial aggregates, so partials stored by other code are recomputed
+    Return str
+    """
+    key = hashlib.sha1()
+    for func in [globals()[partials_func], route_rows, sum_partials, bin_counts]:
+        key.update(inspect.getsource(func).encode('utf8'))
+    return key.hexdigest()
+
+def update_partials(dataset, raw_dir, partials_func, anchor_state='CA', max_dist=800):
+    """
+    Per-route, per-period partial aggregates of a dataset, stored once per raw data file
+    (data/aggregated/partials/<anchor state>_<max dist>mi/<dataset>/<raw file name>) and only
+    recomputed when the raw file is newer than its partials or the partials code changed (partials_version)
+    Return pandas dataframe of all partials
+    """
+    partials_dir = '{0}/aggregated/partials/{1}_{2}mi/{3}'.format(data_dir, anchor_state, max_dist, dataset)
+    if not os.path.exists(partials_dir):
+        os.makedirs(partials_dir)
+    version = partials_version(partials_func)
+    version_fname = '{0}/version.txt'.format(partials_dir)
+    if not os.path.exists(version_fname) or open(version_fname).read() != version:
+        for partials_fname in glob('{0}/*.csv'.format(partials_dir)):
+            os.remove(partials_fname)
+        with open(version_fname, 'w') as f:
+            f.write(version)
+    raw_files = raw_data_files('{0}/{1}'.format(data_dir, raw_dir))
+    partials_list = []
+    for fname in raw_files:
+        partials_fname = '{0}/{1}'.format(partials_dir, raw_base_name(fname))
+        if not os.path.exists(partials_fname) or os.path.getmtime(partials_fname) < os.path.getmtime(fname):
+            print('creating {0}...'.format(partials_fname))
+            sys.stdout.flush()
+            globals()[partials_func](read_raw(fname), anchor_state, max_dist).to_csv(partials_fname, index=False)
+        partials_list.append(pd.read_csv(partials_fname))
+    # drop partials of raw files that are gone
+    for partials_fname in glob('{0}/*.csv'.format(partials_dir)):
+        if os.path.basename(partials_fname) not in [raw_base_name(fname) for fname in raw_files]:
+            os.remove(partials_fname)
+    return pd.concat(partials_list, ignore_index=True)
+
+def window_metrics(dataset, sums):
+    """
+    Route metrics (same names as the aggregated route datasets) from summed partials
+    Return pandas dataframe
+    """
+    metrics = pd.DataFrame(index=sums.index)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if dataset == 'aircraft_delay':
+            hist = sums[[col for col in sums.columns if col.startswith('AirlineDelay_hist_')]].values
+            metrics['AirlineDelay_med'] = route_utils.hist_median(hist, DELAY_BINS)
+            metrics['AirlineDelay_10frac'] = sums['AirlineDelay_10'] / sums['flights']
+            metrics['AirlineDelay_20frac'] = sums['AirlineDelay_20'] / sums['flights']
+            metrics['AirlineDelay_30frac'] = sums['AirlineDelay_30'] / sums['flights']
+            metrics['AirlineDelay_mean'] = sums['AirlineDelay_sum'] / sums['AirlineDelay_n']
+            for col in ['Distance', 'AirTime', 'ActualElapsedTime']:
+                metrics['{0}_mean'.format(col)] = sums['{0}_sum'.format(col)] / sums['{0}_n'.format(col)]
+            metrics['Flight_Count'] = sums['flights']
+        elif dataset == 'aircraft_occupancy':
+            hist = sums[[col for col in sums.columns if col.startswith('occupancy_hist_')]].values
+            metrics['DEPARTURES_PERFORMED_sum'] = sums['DEPARTURES_PERFORMED']
+            metrics['SEATS_sum'] = sums['SEATS']
+            metrics['PASSENGERS_sum'] = sums['PASSENGERS']
+            metrics['occupancy_total'] = sums['PASSENGERS'] / sums['SEATS']
+            metrics['occupancy_med'] = route_utils.hist_median(hist, OCCUPANCY_BINS)
+            metrics['occupancy_mean'] = sums['occupancy_sum'] / sums['occupancy_n']
+            metrics['DISTANCE_mean'] = sums['DISTANCE_sum'] / sums['rows']
+            for col in ['RAMP_TO_RAMP', 'AIR_TIME']:
+                metrics['{0}_mean'.format(col)] = sums['{0}_sum'.format(col)] / sums['{0}_n'.format(col)]
+        elif dataset == 'flyer_class':
+            metrics['PASSENGERS_sum'] = sums['PASSENGERS']
+            metrics['class_bf_frac'] = sums['class_bf_w'] / sums['PASSENGERS']
+            metrics['class_c_frac'] = sums['class_c_w'] / sums['PASSENGERS']
+            metrics['DISTANCE_mean'] = sums['DISTANCE_sum'] / sums['rows']
+        elif dataset == 'flyer_stopover':
+            metrics['PASSENGERS_sum'] = sums['PASSENGERS']
+            metrics['stopover_frac'] = sums['stopover_markets'] / sums['markets']
+            metrics['no_stopover_frac'] = 1 - metrics['stopover_frac']
+            metrics['stopovers_mean'] = sums['stopovers_sum'] / sums['markets']
+    return metrics
+
+def rolling_routes(dataset, partials, period_months, window_months=12):
+    """
+    Rolling window route metrics from the per-route, per-period partials: every window is the running
+    (cumulative) sums at its last month minus those just before its first month, i.e. the new month
+    added and the expired one subtracted, with year over year changes against the window 12 months earlier
+    Only complete windows (fully covered by the data) are kept
+    Return pandas dataframe with one row per route and window end month
+    """
+    route_info = partials[ROUTE_INFO_COLS].drop_duplicates('route_id').set_index('route_id')
+    measure_cols = [col for col in partials.columns if col not in ROUTE_INFO_COLS + ['period'] + PARTIAL_SET_COLS]
+    # month index of each period's last month
+    month = (partials['period'].values // 100) * 12 + partials['period'].values % 100 - 1 + period_months - 1
+    first_month = month.min() - period_months + 1
+    routes, route_idx = np.unique(partials['route_id'].values, return_inverse=True)
+
+    # running sums per route over months, index 0 is before the first month
+    sums = np.zeros((len(routes), month.max() - first_month + 2, len(measure_cols)))
+    np.add.at(sums, (route_idx, month - first_month + 1), partials[measure_cols].values.astype(float))
+    sums = np.cumsum(sums, axis=1)
+
+    ends = np.unique(month)
+    ends = ends[ends - window_months + 1 >= first_month]
+    end_idx = ends - first_month + 1
+    window = sums[:, end_idx] - sums[:, end_idx - window_months]
+    prev_idx = end_idx - 12
+    prev_complete = prev_idx - window_months >= 0
+    prev_idx = np.where(prev_complete, prev_idx, window_months)
+    prev = np.where(prev_complete[None, :, None], sums[:, prev_idx] - sums[:, prev_idx - window_months], np.nan)
+
+    # long table, routes without data in a window are dropped
+    route_col = np.repeat(routes, len(ends))
+    end_col = np.tile(ends, len(routes))
+    window = pd.DataFrame(window.reshape(-1, len(measure_cols)), columns=measure_cols)
+    prev = pd.DataFrame(prev.reshape(-1, len(measure_cols)), columns=measure_cols)
+    active = (window[measure_cols[0]] > 0).values
+    metrics = window_metrics(dataset, window[active].reset_index(drop=True))
+    prev_metrics = window_metrics(dataset, prev[active].reset_index(drop=True))
+
+    rolling = route_info.loc[route_col[active]].reset_index()
+    rolling['window_end'] = ['{0}-{1:02d}'.format(m // 12, m % 12 + 1) for m in end_col[active]]
+    rolling['window_months'] = window_months
+    rolling = pd.concat([rolling, metrics], axis=1)
+    for col in metrics.columns:
+        rolling['{0}_yoy'.format(col)] = metrics[col] - prev_metrics[col]
+    return rolling.sort_values(['route_id', 'window_end']).reset_index(drop=True)
+
+def task_dirs(shared_dir):
+    """Return task, claim, done and failed directories of a shared task directory"""
+    return ['{0}/{1}'.format(shared_dir, name) for name in ['tasks', 'claims', 'done', 'failed']]
+
+def write_tasks(shared_dir, datasets, anchor_state='CA', max_dist=800):
+    """
+    Split the selected datasets into one task per raw data file on the shared directory
+    Tasks whose partial aggregates are done, newer than their raw file and of the same partials code
+    (partials_version) are kept as they are
+    Return list of task ids
+    """
+    tasks_dir, claims_dir, done_dir, failed_dir = task_dirs(shared_dir)
+    for path in task_dirs(shared_dir):
+        if not os.path.exists(path):
+            os.makedirs(path)
+    task_ids = []
+    for dataset, raw_dir, partials_func, period_months in PARTIAL_DATASETS:
+        if dataset not in datasets:
+            continue
+        for fname in raw_data_files('{0}/{1}'.format(data_dir, raw_dir)):
+            task_id = '{0}-{1}'.format(dataset, raw_base_name(fname)[:-len('.csv')])
+            task = {'dataset': dataset, 'raw_file': os.path.abspath(fname), 'partials_func': partials_func,
+                    'data_dir': os.path.abspath(data_dir), 'anchor_state': anchor_state, 'max_dist': max_dist,
+                    'version': partials_version(partials_func)}
+            done = '{0}/{1}.csv'.format(done_dir, task_id)
+            task_fname = '{0}/{1}.json'.format(tasks_dir, task_id)
+            done_version = None
+            if os.path.exists(task_fname):
+                with open(task_fname) as f:
+                    done_version = json.load(f).get('version')
+            if not os.path.exists(done) or os.path.getmtime(done) < os.path.getmtime(fname) or \
+                    done_version != task['version']:
+                for path in [done, '{0}/{1}'.format(claims_dir, task_id), '{0}/{1}.txt'.format(failed_dir, task_id)]:
+                    if os.path.exists(path):
+                        os.remove(path)
+                with open(task_fname, 'w') as f:
+                    json.dump(task, f)
+            task_ids.append(task_id)
+    ## workers stop once every task of a ready task directory is done
+    with open('{0}/ready'.format(shared_dir), 'w') as f:
+        f.write('\n'.join(task_ids))
+    return task_ids
+
+def claim_task(claims_dir, task_id):
+    """
+    Claim a task with a lock file, created atomically (O_CREAT | O_EXCL) so only one worker gets it
+    Return True if claimed
+    """
+    try:
+        fd = os.open('{0}/{1}'.format(claims_dir, task_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except OSError:
+        return False
+    os.write(fd, '{0}:{1}'.format(socket.gethostname(), os.getpid()).encode('utf8'))
+    os.close(fd)
+    return True
+
+def run_worker(shared_dir, poll=2.0, heartbeat=30.0):
+    """
+    Worker loop: claim open tasks, write their per-route, per-period partial aggregates to the done directory
+    (written to a temporary file and renamed, so a done file is always complete), touching the claim file
+    every heartbeat seconds while working; stops once every task is done
+    """
+    tasks_dir, claims_dir, done_dir, failed_dir = task_dirs(shared_dir)
+    global data_dir, airports
+    while not os.path.exists('{0}/ready'.format(shared_dir)):
+        time.sleep(poll)
+    while True:
+        with open('{0}/ready'.format(shared_dir)) as f:
+            task_ids = f.read().split()
+        open_ids = [task_id for task_id in task_ids if not os.path.exists('{0}/{1}.csv'.format(done_dir, task_id)) and
+                    not os.path.exists('{0}/{1}.txt'.format(failed_dir, task_id))]
+        if not open_ids:
+            return
+        claimed = [task_id for task_id in open_ids if not os.path.exists('{0}/{1}'.format(claims_dir, task_id))]
+        claimed = next((task_id for task_id in claimed if claim_task(claims_dir, task_id)), None)
+        if claimed is None:
+            time.sleep(poll)
+            continue
+        task_id = claimed
+        claim = '{0}/{1}'.format(claims_dir, task_id)
+        with open('{0}/{1}.json'.format(tasks_dir, task_id)) as f:
+            task = json.load(f)
+        print('{0}: {1}...'.format(socket.gethostname(), task_id))
+        sys.stdout.flush()
+
+        stop = threading.Event()
+        def touch():
+            while not stop.wait(heartbeat):
+                if os.path.exists(claim):
+                    os.utime(claim, None)
+        toucher = threading.Thread(target=touch)
+        toucher.daemon = True
+        toucher.start()
+        try:
+            if data_dir != task['data_dir'] or airports is None:
+                data_dir = task['data_dir']
+                airports = airport_data()
+            partials = globals()[task['partials_func']](read_raw(task['raw_file']), task['anchor_state'], task['max_dist'])
+            tmp = '{0}/.{1}.{2}.{3}.csv'.format(done_dir, task_id, socket.gethostname(), os.getpid())
+            partials.to_csv(tmp, index=False)
+            os.rename(tmp, '{0}/{1}.csv'.format(done_dir, task_id))
+        except Exception as e:
+            with open('{0}/{1}.txt'.format(failed_dir, task_id), 'w') as f:
+                f.write('{0}:{1} {2!r}'.format(socket.gethostname(), os.getpid(), e))
+        finally:
+            stop.set()
+
+def wait_for_tasks(shared_dir, task_ids, poll=2.0, task_timeout=300.0):
+    """
+    Wait until every task is done, releasing claims whose worker stopped touching them for task_timeout seconds
+    Return list of failed task messages
+    """
+    tasks_dir, claims_dir, done_dir, failed_dir = task_dirs(shared_dir)
+    while True:
+        open_ids = [task_id for task_id in task_ids if not os.path.exists('{0}/{1}.csv'.format(done_dir, task_id))]
+        failed = [task_id for task_id in open_ids if os.path.exists('{0}/{1}.txt'.format(failed_dir, task_id))]
+        if len(failed) == len(open_ids):
+            messages = []
+            for task_id in failed:
+                with open('{0}/{1}.txt'.format(failed_dir, task_id)) as f:
+                    messages.append('{0}: {1}'.format(task_id, f.read()))
+            return messages
+        for task_id in open_ids:
+            claim = '{0}/{1}'.format(claims_dir, task_id)
+            try:
+                if time.time() - os.path.getmtime(claim) > task_timeout:
+                    print('releasing stale claim of {0}'.format(task_id))
+                    os.remove(claim)
+            except OSError:
+                pass
+        time.sleep(poll)
+
+def reduce_partials(shared_dir, dataset, task_ids, quarter=None):
+    """
+    Reduce the partial aggregates of a dataset's tasks (optionally only a quarter's periods) to route metrics,
+    with the column names and order of the dataset's loader (REDUCED_LAYOUT)
+    Return pandas dataframe aggregated to a collection of routes (medians approximated from the delay and
+    occupancy histograms as in rolling_routes)
+    """
+    tasks_dir, claims_dir, done_dir, failed_dir = task_dirs(shared_dir)
+    partials = pd.concat([pd.read_csv('{0}/{1}.csv'.format(done_dir, task_id))
+                          for task_id in task_ids if task_id.startswith(dataset + '-')], ignore_index=True)
+    if quarter:
+        partials = partials.loc[(partials['period'] % 100 - 1) // 3 + 1 == quarter]
+    measure_cols = [col for col in partials.columns if col not in ROUTE_INFO_COLS + ['period'] + PARTIAL_SET_COLS]
+    sums = partials.groupby('route_id')[measure_cols].sum()
+    route_info = partials[ROUTE_INFO_COLS].drop_duplicates('route_id').set_index('route_id')
+    route_merge = route_info.join(window_metrics(dataset, sums)).reset_index()
+
+    orig_state_col, dest_state_col, lead_cols = REDUCED_LAYOUT[dataset]
+    route_merge = route_merge.rename(columns={'orig_state': orig_state_col, 'dest_state': dest_state_col})
+    if dataset == 'aircraft_delay':
+        route_merge['Flight_Count'] = route_merge['Flight_Count'].astype(np.int64)
+    if dataset == 'flyer_stopover':
+        ## stopover airports of every period, without the route's orig
+        stopovers = partials.groupby('route_id')['stopover_airports'].apply(
+            lambda codes: sorted(set(' '.join(codes.fillna('')).split()))).reindex(route_merge['route_id'])
+        route_merge['stopover_airports'] = ['{' + ', '.join(repr(code) for code in codes) + '}' for codes in stopovers]
+        route_merge['stopover_airports_clean'] = [str([code for code in codes if code != orig])
+                                                  for codes, orig in zip(stopovers, route_merge['orig_code'])]
+        route_merge['dist_calc'] = geocalc(route_merge['orig_lat'].astype(float), route_merge['orig_lon'].astype(float),
+                                           route_merge['dest_lat'].astype(float), route_merge['dest_lon'].astype(float))
+    info_cols = [orig_state_col if col == 'orig_state' else dest_state_col if col == 'dest_state' else col
+                 for col in ROUTE_INFO_COLS[1:]]
+    cols = ['route_id'] + lead_cols + info_cols
+    route_merge = route_merge[cols + [col for col in route_merge.columns if col not in cols]]
+    print('{0} routes'.format(len(route_merge)))
+    return route_merge
+
+def read_raw_cols(raw_dir, usecols, quarter, quarter_col):
+    """
+    Read only the given columns of every raw data file (optionally cut down to a quarter)
+    Return pandas dataframe
+    """
+    fnames = raw_data_files('{0}/{1}'.format(data_dir, raw_dir))
+    print('using files {0}'.format(fnames))
+    sys.stdout.flush()
+    df = pd.concat([read_raw(fname, usecols=usecols) for fname in fnames], ignore_index=True)
+    if quarter:
+        df = df.loc[df[quarter_col] == quarter]
+    return df
+
+def cut_routes(df, orig_col, dest_col, orig_state_col, dest_state_col, dist_col, anchor_state, max_dist):
+    """
+    Cut raw rows down to the anchor state and max distance (without merging in the airport data)
+    Return pandas dataframe with route_id, orig_code, dest_code, orig_state and dest_state columns added
+    """
+    rows = df.loc[((df[orig_state_col] == anchor_state) | (df[dest_state_col] == anchor_state)) & \
+                  (df[dist_col] < max_dist) & (df[dist_col] > 0)].copy()
+    rows['orig_code'] = rows[orig_col].astype(str)
+    rows['dest_code'] = rows[dest_col].astype(str)
+    rows['orig_state'] = rows[orig_state_col]
+    rows['dest_state'] = rows[dest_state_col]
+    rows['route_id'] = route_utils.route_ids(rows['orig_code'], rows['dest_code'])
+    return rows
+
+def stratified_sample(rows, strata_cols, frac, min_rows=20, seed=0):
+    """
+    Simple random sample without replacement within every stratum (e.g. route and month) of
+    max(min_rows, frac * stratum rows) rows, all rows of smaller strata
+    Return pandas dataframe of the sampled rows with their stratum_rows and sampled_rows
+    """
+    rng = np.random.RandomState(seed)
+    rows = rows.iloc[rng.permutation(len(rows))].reset_index(drop=True)
+    strata = rows.groupby(strata_cols, sort=False)
+    stratum_rows = strata[strata_cols[0]].transform('size').values
+    sampled_rows = np.minimum(stratum_rows, np.maximum(min_rows, np.ceil(frac * stratum_rows))).astype(int)
+    keep = strata.cumcount().values < sampled_rows
+    sample = rows.loc[keep].reset_index(drop=True)
+    sample['stratum_rows'] = stratum_rows[keep]
+    sample['sampled_rows'] = sampled_rows[keep]
+    return sample
+
+def sample_estimates(sample, strata_cols, y_col, x_col, z=1.96):
+    """
+    Stratified ratio estimate (sum y / sum x) per route with its standard error (linearized, with
+    finite population correction) and normal confidence interval; a mean or fraction has x = 1
+    Return pandas dataframe indexed by route_id with estimate, se, lo and hi columns
+    """
+    units = pd.DataFrame({'route_id': sample['route_id'].values,
+                          'y': sample[y_col].values.astype(float),
+                          'x': sample[x_col].values.astype(float)})
+    for col in strata_cols[1:]:
+        units[col] = sample[col].values
+    units['yy'] = units['y'] ** 2
+    units['xx'] = units['x'] ** 2
+    units['xy'] = units['x'] * units['y']
+    strata = units.groupby(strata_cols).sum()
+    strata['N'] = sample.groupby(strata_cols)['stratum_rows'].first()
+    strata['n'] = sample.groupby(strata_cols)['sampled_rows'].first()
+    ## stratum totals scaled up to the stratum rows
+    strata['Y'] = strata['y'] * strata['N'] / strata['n']
+    strata['X'] = strata['x'] * strata['N'] / strata['n']
+    totals = strata[['Y', 'X']].groupby(level='route_id').sum()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = totals['Y'] / totals['X']
+        R = ratio.reindex(strata.index.get_level_values('route_id')).values
+        ## sample variance of the residuals e = y - R x within each stratum
+        e_sum = strata['y'] - R * strata['x']
+        e_sq = strata['yy'] - 2 * R * strata['xy'] + R ** 2 * strata['xx']
+        s2 = np.where(strata['n'] > 1, (e_sq - e_sum ** 2 / strata['n']) / (strata['n'] - 1), 0)
+        var = strata['N'] ** 2 * (1 - strata['n'] / strata['N']) * np.maximum(s2, 0) / strata['n']
+        se = np.sqrt(var.groupby(level='route_id').sum()) / totals['X']
+    return pd.DataFrame({'estimate': ratio, 'se': se, 'lo': ratio - z * se, 'hi': ratio + z * se})
+
+def rank_intervals(lo, hi, estimate, top=20):
+    """
+    Rank routes by a metric (1 = highest) along with the best and worst ranks their confidence intervals allow:
+    best rank counts the routes whose lower bound is above the route's upper bound, worst rank the routes
+    whose upper bound is above the route's lower bound
+    A route's rank is uncertain when it could be both inside and outside the top routes
+    Return rank, best rank, worst rank, uncertain (numpy arrays)
+    """
+    rank = np.argsort(np.argsort(-estimate, kind='mergesort'), kind='mergesort') + 1
+    best = len(lo) - np.searchsorted(np.sort(lo), hi, side='right') + 1
+    worst = len(hi) - np.searchsorted(np.sort(hi), lo, side='left')
+    uncertain = (best <= top) & (worst > top)
+    return rank, best, worst, uncertain
+
+def sample_routes(dataset, quarter, frac, min_rows=20, anchor_state='CA', max_dist=800, top=20, seed=0):
+    """
+    Quick preview of a route dataset from a stratified sample of the raw rows per route and month
+    (per route and quarter for the air coupon data, markets instead of coupons for stopovers)
+    Every metric comes with a 95% confidence interval (_lo, _hi) and routes are ranked by it with
+    the range of ranks their intervals allow (_rank_best, _rank_worst), _rank_uncertain flags routes
+    that could be both inside and outside the top routes
+    Return pandas dataframe aggregated to a collection of routes
+    """
+    raw_dir, quarter_col, usecols = SAMPLE_COLS[dataset]
+    df = read_raw_cols(raw_dir, usecols, quarter, quarter_col)
+
+    if dataset == 'aircraft_delay':
+        rows = cut_routes(df.loc[df['Flights'] == 1.0], 'Origin', 'Dest', 'OriginState', 'DestState', 'Distance',
+                          anchor_state, max_dist)
+        rows['period'] = rows['Year'] * 100 + rows['Month']
+        delay = rows['LateAircraftDelay'] + rows['CarrierDelay']
+        rows['delay_10'] = delay > 10.0
+        rows['delay_20'] = delay > 20.0
+        rows['delay_30'] = delay > 30.0
+        rows['delay_sum'] = delay.fillna(0)
+        rows['delay_n'] = delay.notnull()
+    elif dataset == 'aircraft_occupancy':
+        rows = cut_routes(df.loc[df['PASSENGERS'] > 0], 'ORIGIN', 'DEST', 'ORIGIN_STATE_ABR', 'DEST_STATE_ABR', 'DISTANCE',
+                          anchor_state, max_dist)
+        rows['period'] = rows['YEAR'] * 100 + rows['MONTH']
+        rows['occupancy'] = rows['PASSENGERS'] * 1.0 / rows['SEATS']
+    elif dataset == 'flyer_class':
+        rows = cut_routes(df.loc[df['PASSENGERS'] > 0], 'ORIGIN', 'DEST', 'ORIGIN_STATE_ABR', 'DEST_STATE_ABR', 'DISTANCE',
+                          anchor_state, max_dist)
+        rows['period'] = rows['YEAR'] * 10 + rows['QUARTER']
+        rows['class_bf_w'] = rows['FARE_CLASS'].isin(['C', 'D', 'F', 'G']) * rows['PASSENGERS']
+        rows['class_c_w'] = (rows['FARE_CLASS'].isin(['X', 'Y']) | pd.isnull(rows['FARE_CLASS'])) * rows['PASSENGERS']
+    elif dataset == 'flyer_stopover':
+        legs = cut_routes(df.loc[df['PASSENGERS'] > 0], 'ORIGIN', 'DEST', 'ORIGIN_STATE_ABR', 'DEST_STATE_ABR', 'DISTANCE',
+                          anchor_state, max_dist)
+        # one market (itinerary before prolonged stop) from its first coupon's orig to its last coupon's dest
+        markets = legs.sort_values('SEQ_NUM').groupby('MKT_ID')
+        rows = markets[['YEAR', 'QUARTER', 'orig_code', 'orig_state']].first().join(
+            markets[['dest_code', 'dest_state', 'PASSENGERS']].last())
+        rows['stopovers'] = markets.size() - 1
+        rows = rows.reset_index()
+        ## ensure short-haul routes from orig to dest, still anchored in anchor state
+        coords = airports.drop_duplicates('code').set_index('code')[['lat', 'lon']].astype(float)
+        orig = coords.reindex(rows['orig_code']).values
+        dest = coords.reindex(rows['dest_code']).values
+        rows = rows.loc[((rows['orig_state'] == anchor_state) | (rows['dest_state'] == anchor_state)).values & \
+                        (geocalc(orig[:, 0], orig[:, 1], dest[:, 0], dest[:, 1]) < max_dist)].copy()
+        rows['route_id'] = route_utils.route_ids(rows['orig_code'], rows['dest_code'])
+        rows['period'] = rows['YEAR'] * 10 + rows['QUARTER']
+        rows['stopover'] = rows['stopovers'] > 0
+    rows['one'] = 1
+
+    sample = stratified_sample(rows, ['route_id', 'period'], frac, min_rows=min_rows, seed=seed)
+    print('sampled {0} of {1} rows'.format(len(sample), len(rows)))
+    sys.stdout.flush()
+
+    # route info (inner merge with the airport data as in the full datasets)
+    route_info = rows.drop_duplicates('route_id')[['route_id', 'orig_code', 'orig_state', 'dest_code', 'dest_state']]
+    airport_cols = ['code', 'name', 'city', 'lat', 'lon']
+    for prefix in ['orig', 'dest']:
+        prefixed = airports[airport_cols].rename(columns=dict((c, '{0}_{1}'.format(prefix, c)) for c in airport_cols))
+        route_info = pd.merge(route_info, prefixed, on=['{0}_code'.format(prefix)], how='inner')
+    route_merge = route_info[ROUTE_INFO_COLS].set_index('route_id')
+
+    ## row counts (exact) and sampled rows per route
+    strata = sample.groupby(['route_id', 'period'])[['stratum_rows', 'sampled_rows']].first()
+    counts = strata.groupby(level='route_id').sum()
+    route_merge['rows'] = counts['stratum_rows']
+    route_merge['sampled_rows'] = counts['sampled_rows']
+    if dataset == 'aircraft_delay':
+        route_merge['Flight_Count'] = counts['stratum_rows']
+    else:
+        route_merge['PASSENGERS_sum'] = sample_estimates(sample, ['route_id', 'period'], 'PASSENGERS', 'one')['estimate'] * \
+                                        counts['stratum_rows']
+
+    for metric_dataset, metric, y_col, x_col, fraction in SAMPLE_METRICS:
+        if metric_dataset != dataset:
+            continue
+        est = sample_estimates(sample, ['route_id', 'period'], y_col, x_col).reindex(route_merge.index)
+        if fraction:
+            est['lo'] = est['lo'].clip(lower=0)
+            est['hi'] = est['hi'].clip(upper=1)
+        route_merge[metric] = est['estimate']
+        route_merge['{0}_lo'.format(metric)] = est['lo']
+        route_merge['{0}_hi'.format(metric)] = est['hi']
+        rank, best, worst, uncertain = rank_intervals(est['lo'].fillna(-np.inf).values, est['hi'].fillna(-np.inf).values,
+                                                      est['estimate'].fillna(-np.inf).values, top=top)
+        route_merge['{0}_rank'.format(metric)] = rank
+        route_merge['{0}_rank_best'.format(metric)] = best
+        route_merge['{0}_rank_worst'.format(metric)] = worst
+        route_merge['{0}_rank_uncertain'.format(metric)] = uncertain
+
+    route_merge = route_merge.reset_index()
+    print('{0} routes'.format(len(route_merge)))
+    return route_merge
 
+def init_task_worker(task_data_dir, task_airports):
+    """Task pool worker set up: the airport data is loaded once by the parent and shared with every worker"""
+    global data_dir, airports
+    data_dir = task_data_dir
+    airports = task_airports
 
+def run_dataset_task(task, func_name, fname, kwargs, output_dir):
+    """
+    Create one dataset of an --all run and write it (the dataset and its write task) in a task pool worker
+    Return task, start, dataset done and write done times
+    """
+    start = time.time()
+    kwargs = dict(kwargs)
+    hist_cols = kwargs.pop('hist_cols', None)
+    tod_bins = kwargs.pop('tod_bins', None)
+    if hist_cols or tod_bins:
+        ## delay sketches from the same flights as the routes
+        kwargs['rows'] = aircraft_delay_rows(kwargs['quarter'], anchor_state=kwargs['anchor_state'], max_dist=kwargs['max_dist'])
+    dataset = globals()[func_name](**kwargs)
+    computed = time.time()
+    if hist_cols or tod_bins:
+        np.savez_compressed('{0}/delay_histograms.npz'.format(output_dir), **delay_sketches(kwargs['rows'], hist_cols, tod_bins))
+    dataset.to_csv('{0}/{1}'.format(output_dir, fname), index=False)
+    return task, start, computed, time.time()
+
+def run_all(output_dir, kwargs, workers=None):
+    """
+    Create every dataset (ALL_DATASETS) and the route fact table following the ALL_TASKS graph: the airport data
+    is loaded once, the datasets run concurrently in a process pool as soon as their dependencies are done,
+    so the wall clock time is bounded by the slowest chain of tasks instead of the sum of all of them
+    kwargs are the loader arguments of each dataset task
+    Return dict of task -> (start, end) seconds from the start of the run
+    """
+    global airports
+    run_start = time.time()
+    airports = airport_data()
+    times = {'airports': (0, time.time() - run_start)}
+    pool = Pool(workers or cpu_count(), initializer=init_task_worker, initargs=(data_dir, airports))
+    datasets = dict((task, (func_name, fname)) for task, func_name, fname in ALL_DATASETS)
+    running = {}
+    try:
+        while len(times) < len(ALL_TASKS):
+            for task, deps in ALL_TASKS:
+                if task in times or task in running or not all(dep in times for dep in deps):
+                    continue
+                if task in datasets:
+                    print('starting {0}...'.format(task))
+                    sys.stdout.flush()
+                    running[task] = pool.apply_async(run_dataset_task, (task, datasets[task][0], datasets[task][1],
+                                                                        kwargs[task], output_dir))
+                elif task == 'route_facts':
+                    start = time.time()
+                    route_facts, route_fact_dtypes = route_fact_table(output_dir)
+                    route_facts.to_csv('{0}/route_facts.csv'.format(output_dir), index=False)
+                    with open('{0}/route_facts_dtypes.json'.format(output_dir), 'w') as f:
+                        json.dump(route_fact_dtypes, f, indent=1)
+                    times[task] = (start - run_start, time.time() - run_start)
+            for task in [task for task in running if running[task].ready()]:
+                ## worker errors are raised here
+                task, start, computed, end = running.pop(task).get()
+                print('{0} done in {1:.1f}s'.format(task, end - start))
+                sys.stdout.flush()
+                times[task] = (start - run_start, computed - run_start)
+                times['{0}_write'.format(task)] = (computed - run_start, end - run_start)
+            time.sleep(0.05)
+    finally:
+        pool.terminate()
+        pool.join()
+    return times
+
+def critical_path(tasks, times):
+    """
+    Longest chain of dependent tasks by duration, the wall clock time a run can't go below however many workers
+    Return list of tasks on the path and its length in seconds
+    """
+    finish = {}
+    previous = {}
+    for task, deps in tasks:
+        previous[task] = max(deps, key=lambda dep: finish[dep]) if deps else None
+        finish[task] = (finish[previous[task]] if deps else 0) + times[task][1] - times[task][0]
+    task = max(finish, key=lambda task: finish[task])
+    length = finish[task]
+    path = []
+    while task:
+        path.append(task)
+        task = previous[task]
+    return path[::-1], length
+
+class RouteAggregator(object):
+    """
+    Aggregation session: loads the airport data once and keeps every parsed raw data file in memory
+    (parsed again only when the file changes), so route datasets for many quarters, anchor states and
+    max distances are created from warm data, e.g. in a notebook or service:
+        session = RouteAggregator('data')
+        delays = session.aircraft_delay(quarter=2, max_dist=500)
+    Calls are serialized, the loaders read the session's data through the module globals
+    """
+    def __init__(self, data_dir='data', anchor_state='CA', max_dist=800, bootstrap=0, workers=None, seed=0,
+                 cache_raw=True):
+        self.data_dir = data_dir
+        self.anchor_state = anchor_state
+        self.max_dist = max_dist
+        self.bootstrap = bootstrap
+        self.workers = workers
+        self.seed = seed
+        self.raw_cache = {} if cache_raw else None
+        self.airports = self.run(airport_data)
+
+    def run(self, func, *args, **kwargs):
+        """Call a loader with the module globals bound to this session's data, restoring them afterwards"""
+        module = globals()
+        with session_lock:
+            previous = dict((key, module[key]) for key in ['data_dir', 'airports', 'raw_cache'])
+            module.update(data_dir=self.data_dir, airports=getattr(self, 'airports', None), raw_cache=self.raw_cache)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                module.update(previous)
+
+    def route_kwargs(self, quarter, anchor_state, max_dist):
+        """Loader arguments, the session's defaults where not given"""
+        return {'quarter': quarter,
+                'anchor_state': anchor_state or self.anchor_state,
+                'max_dist': max_dist or self.max_dist,
+                'bootstrap': self.bootstrap, 'workers': self.workers, 'seed': self.seed}
+
+    def aircraft_delay(self, quarter=None, anchor_state=None, max_dist=None):
+        """Return pandas dataframe of aircraft delay routes (see aircraft_delay_data)"""
+        return self.run(aircraft_delay_data, **self.route_kwargs(quarter, anchor_state, max_dist))
+
+    def delay_sketches(self, quarter=None, anchor_state=None, max_dist=None, hist_cols=('AirlineDelay',), tod_bins=24):
+        """Return dict of numpy arrays of per-route delay histograms and time of day profiles (see delay_sketches)"""
+        kwargs = self.route_kwargs(quarter, anchor_state, max_dist)
+        rows = self.run(aircraft_delay_rows, kwargs['quarter'], anchor_state=kwargs['anchor_state'], max_dist=kwargs['max_dist'])
+        return delay_sketches(rows, hist_cols=list(hist_cols), tod_bins=tod_bins)
+
+    def aircraft_occupancy(self, quarter=None, anchor_state=None, max_dist=None):
+        """Return pandas dataframe of aircraft occupancy routes (see aircraft_occupancy_data)"""
+        return self.run(aircraft_occupancy_data, **self.route_kwargs(quarter, anchor_state, max_dist))
+
+    def flyer_class(self, quarter=None, anchor_state=None, max_dist=None):
+        """Return pandas dataframe of flyer fare class routes (see flyer_class_data)"""
+        return self.run(flyer_class_data, **self.route_kwargs(quarter, anchor_state, max_dist))
+
+    def flyer_stopover(self, quarter=None, anchor_state=None, max_dist=None):
+        """Return pandas dataframe of flyer stopover routes (see flyer_stopover_data)"""
+        return self.run(flyer_stopover_data, **self.route_kwargs(quarter, anchor_state, max_dist))
+
+    def amtrak(self, anchor_state=None):
+        """Return pandas dataframe of Amtrak stations with nearest airports, ridership and delays (see amtrak_data)"""
+        return self.run(amtrak_data, anchor_state=anchor_state or self.anchor_state)
+
+    def clear_cache(self):
+        """Drop the parsed raw data files"""
+        if self.raw_cache is not None:
+            self.raw_cache.clear()
 
 
 if __name__ == '__main__':
-    import numpy as np
-    import pandas as pd
-    from glob import glob
-    import sys
     from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
     parser = ArgumentParser(description='This script loads the airline datasets,\n'
@@ -629,27 +2194,106 @@ if __name__ == '__main__':
     parser.add_argument('-q', '--quarter', dest='quarter',
                         default=None, metavar='QUARTER', type=int,
                         help='QUARTER over which to aggregate data, default None aggregates over all quarters')
+    parser.add_argument('--all', dest='all',
+                        default=False, action='store_true',
+                        help='Create every route dataset, the Amtrak dataset and the route fact table, running the datasets '
+                             'concurrently in --workers processes (bootstrap replicates then run in each dataset\'s process), '
+                             'with a timing report of the critical path')
     parser.add_argument('--air-delay', dest='air_delay',
                         default=False, action='store_true',
                         help='Create route aircraft delay dataset')
+    parser.add_argument('--delay-hist', dest='delay_hist',
+                        default=['AirlineDelay'], nargs='*', choices=sorted(DELAY_HIST_EDGES),
+                        help='Delay columns whose per-route histograms are written with --air-delay (delay_histograms.npz), '
+                             'queried with delay_query.py; no columns for none')
+    parser.add_argument('--tod-bins', dest='tod_bins',
+                        default=24, type=int, choices=[0] + TOD_BINS,
+                        help='Scheduled departure time bins per day of the per-route time of day delay profiles written '
+                             'with --air-delay (delay_histograms.npz) and shown in the map; 0 for none')
     parser.add_argument('--air-occ', dest='air_occ',
                         default=False, action='store_true',
                         help='Create route aircraft occupancy dataset')
+    parser.add_argument('--occ-cube', dest='occ_cube',
+                        default=False, action='store_true',
+                        help='Create the aircraft occupancy cube (route x month x carrier x aircraft type, data/aggregated/occupancy_cube.npz) '
+                             'over every month, rolled up with occupancy_query.py')
     parser.add_argument('--air-class', dest='air_class',
                         default=False, action='store_true',
                         help='Create flyer fare class dataset')
     parser.add_argument('--air-stopover', dest='air_stopover',
                         default=False, action='store_true',
                         help='Create flyer stopover dataset')
+    parser.add_argument('--air-network', dest='air_network',
+                        default=False, action='store_true',
+                        help='Create route network (CSR arrays of coupon legs, markets and their connections) from the air coupon data')
     parser.add_argument('--amtrak', dest='amtrak',
                         default=False, action='store_true',
                         help='Create amtrak stations + ridership + delays + nearest airports dataset')
+    parser.add_argument('--amtrak-status', dest='amtrak_status',
+                        default=False, action='store_true',
+                        help='Create per-station, per-year delays of every U.S. Amtrak station (amtrak_station_delays.csv) '
+                             'from the status archive files in data/amtrak/status_archive, used by --amtrak and --rail-alternatives')
+    parser.add_argument('--route-facts', dest='route_facts',
+                        default=False, action='store_true',
+                        help='Create the route fact table (route_facts.csv, also created along with any route dataset) '
+                             'from the route datasets in the output directory')
+    parser.add_argument('--rail-alternatives', dest='rail_alternatives',
+                        default=False, action='store_true',
+                        help='Create candidate Amtrak station pairs near both ends of every aggregated air route '
+                             '(route datasets in the output directory)')
+    parser.add_argument('--rail-radius', dest='rail_radius',
+                        default=25, type=float,
+                        help='Maximum distance in miles from a route\'s airport to its candidate Amtrak stations')
+    parser.add_argument('--shared-dir', dest='shared_dir',
+                        default=None,
+                        help='Shared directory (any POSIX filesystem the hosts mount) of a distributed run '
+                             'with --coordinator and --worker processes')
+    parser.add_argument('--coordinator', dest='coordinator',
+                        default=False, action='store_true',
+                        help='Split the selected route datasets into one task per raw data file on --shared-dir, '
+                             'wait for the workers and reduce their partial aggregates to the route datasets (data/aggregated/distributed)')
+    parser.add_argument('--worker', dest='worker',
+                        default=False, action='store_true',
+                        help='Claim and run tasks of --shared-dir until every task is done')
+    parser.add_argument('--local-workers', dest='local_workers',
+                        default=0, type=int,
+                        help='Start this many worker processes on this host along with the coordinator')
+    parser.add_argument('--task-timeout', dest='task_timeout',
+                        default=300, type=float,
+                        help='Seconds without a worker heartbeat before its task is claimed again')
     parser.add_argument('--anchor-state', dest='anchor_state',
                         default='CA',
                         help='Orig or Dest for each route must be in this anchor state')
     parser.add_argument('--max-dist', dest='max_dist',
                         default=800, type=int,
                         help='Maximum distance in miles of routes')
+    parser.add_argument('--rolling', dest='rolling',
+                        default=False, action='store_true',
+                        help='Create rolling window time series of the selected route datasets (data/aggregated/rolling) '
+                             'from per-route, per-month partial aggregates stored once per raw data file')
+    parser.add_argument('--window-months', dest='window_months',
+                        default=12, type=int,
+                        help='Months per rolling window')
+    parser.add_argument('--sample', dest='sample',
+                        default=None, metavar='FRAC', type=float,
+                        help='Quick preview of the selected route datasets (data/aggregated/sample) from a stratified sample '
+                             'of FRAC of the rows per route and month, with confidence intervals and uncertain rank flags')
+    parser.add_argument('--sample-min', dest='sample_min',
+                        default=20, type=int,
+                        help='Minimum sampled rows per route and month (all rows of smaller routes are used)')
+    parser.add_argument('--sample-top', dest='sample_top',
+                        default=20, type=int,
+                        help='Flag routes whose confidence interval allows a rank both inside and outside this many top routes')
+    parser.add_argument('--bootstrap', dest='bootstrap',
+                        default=0, type=int,
+                        help='Bootstrap replicates for the confidence intervals (_lo, _hi columns) of the route metrics '
+                             '(e.g. 1000), 0 for none')
+    parser.add_argument('--workers', dest='workers',
+                        default=None, type=int,
+                        help='Processes the bootstrap replicates (or the datasets with --all) are split over, default None uses every core')
+    parser.add_argument('--seed', dest='seed',
+                        default=0, type=int,
+                        help='Random seed of the sample and bootstrap replicates')
     args = parser.parse_args()
 
     # input directory
@@ -666,39 +2310,178 @@ if __name__ == '__main__':
         print('for all quarters...')
         sys.stdout.flush()
 
+    # Distributed worker (data directory and airports come with its tasks)
+    if args.worker:
+        run_worker(args.shared_dir)
+        sys.exit(0)
+
+    # Every Dataset, concurrently (loads the airport data itself)
+    if args.all:
+        route_kwargs = {'quarter': args.quarter, 'anchor_state': args.anchor_state, 'max_dist': args.max_dist,
+                        'bootstrap': args.bootstrap, 'workers': 1, 'seed': args.seed}
+        task_kwargs = dict((dataset, route_kwargs) for dataset in ['aircraft_occupancy', 'flyer_class', 'flyer_stopover'])
+        task_kwargs['aircraft_delay'] = dict(route_kwargs, hist_cols=args.delay_hist, tod_bins=args.tod_bins)
+        task_kwargs['amtrak'] = {'anchor_state': args.anchor_state}
+        start = time.time()
+        times = run_all(output_dir, task_kwargs, workers=args.workers)
+        wall = time.time() - start
+        path, length = critical_path(ALL_TASKS, times)
+        print('\n{0:<28} {1:>8} {2:>8} {3:>8}'.format('task', 'start', 'end', 'seconds'))
+        for task, deps in ALL_TASKS:
+            print('{0:<28} {1:8.1f} {2:8.1f} {3:8.1f}{4}'.format(task, times[task][0], times[task][1],
+                                                                  times[task][1] - times[task][0], ' *' if task in path else ''))
+        print('critical path (*): {0}, {1:.1f}s'.format(' -> '.join(path), length))
+        print('wall clock {0:.1f}s, {1:.1f}s one task after another'.format(
+            wall, sum(end - start for start, end in times.values())))
+        sys.exit(0)
+
     # Airport Data (need for all)
     airports = airport_data()
 
+    # Distributed coordinator
+    if args.coordinator:
+        distributed_dir = '{0}/distributed'.format(output_dir)
+        if not os.path.exists(distributed_dir):
+            os.makedirs(distributed_dir)
+        selected = {'aircraft_delay': args.air_delay, 'aircraft_occupancy': args.air_occ,
+                    'flyer_class': args.air_class, 'flyer_stopover': args.air_stopover}
+        shared_dir = '{0}/{1}_{2}mi'.format(args.shared_dir, args.anchor_state, args.max_dist)
+        task_ids = write_tasks(shared_dir, [dataset for dataset in selected if selected[dataset]],
+                               anchor_state=args.anchor_state, max_dist=args.max_dist)
+        print('{0} tasks in {1}'.format(len(task_ids), shared_dir))
+        sys.stdout.flush()
+        local_workers = [subprocess.Popen([sys.executable, sys.argv[0], '--worker', '--shared-dir', shared_dir])
+                         for i in range(args.local_workers)]
+        failed = wait_for_tasks(shared_dir, task_ids, task_timeout=args.task_timeout)
+        for worker in local_workers:
+            worker.wait()
+        if failed:
+            print('failed tasks:\n{0}'.format('\n'.join(failed)))
+            sys.exit(1)
+        for dataset in [dataset for dataset, raw_dir, partials_func, period_months in PARTIAL_DATASETS if selected[dataset]]:
+            fname = '{0}/{1}_routes.csv'.format(distributed_dir, dataset)
+            print('creating {0}...'.format(fname))
+            sys.stdout.flush()
+            reduce_partials(shared_dir, dataset, task_ids, quarter=args.quarter).to_csv(fname, index=False)
+        sys.exit(0)
+
+    # Rolling window time series
+    if args.rolling:
+        rolling_dir = 'data/aggregated/rolling'
+        if not os.path.exists(rolling_dir):
+            os.makedirs(rolling_dir)
+        selected = {'aircraft_delay': args.air_delay, 'aircraft_occupancy': args.air_occ,
+                    'flyer_class': args.air_class, 'flyer_stopover': args.air_stopover}
+        for dataset, raw_dir, partials_func, period_months in PARTIAL_DATASETS:
+            if not selected[dataset]:
+                continue
+            fname = '{0}/{1}_routes_rolling_{2}m.csv'.format(rolling_dir, dataset, args.window_months)
+            print('creating {0}...'.format(fname))
+            sys.stdout.flush()
+            partials = update_partials(dataset, raw_dir, partials_func,
+                                       anchor_state=args.anchor_state, max_dist=args.max_dist)
+            rolling = rolling_routes(dataset, partials, period_months, window_months=args.window_months)
+            rolling.to_csv(fname, index=False)
+            print('{0} route windows'.format(len(rolling)))
+        sys.exit(0)
+
+    # Sampled preview
+    if args.sample:
+        sample_dir = '{0}/sample'.format(output_dir)
+        if not os.path.exists(sample_dir):
+            os.makedirs(sample_dir)
+        selected = {'aircraft_delay': args.air_delay, 'aircraft_occupancy': args.air_occ,
+                    'flyer_class': args.air_class, 'flyer_stopover': args.air_stopover}
+        for dataset in ['aircraft_delay', 'aircraft_occupancy', 'flyer_class', 'flyer_stopover']:
+            if not selected[dataset]:
+                continue
+            fname = '{0}/{1}_routes_sample.csv'.format(sample_dir, dataset)
+            print('creating {0}...'.format(fname))
+            sys.stdout.flush()
+            sample_routes(dataset, args.quarter, args.sample, min_rows=args.sample_min, anchor_state=args.anchor_state,
+                          max_dist=args.max_dist, top=args.sample_top, seed=args.seed).to_csv(fname, index=False)
+        sys.exit(0)
+
     # Aircraft Delay Data
     if args.air_delay:
         print('creating {0}/aircraft_delay_routes.csv...'.format(output_dir))
         sys.stdout.flush()
-        aircraft_delay_routes = aircraft_delay_data(quarter=args.quarter, anchor_state=args.anchor_state, max_dist=args.max_dist)
+        ot_rows = aircraft_delay_rows(quarter=args.quarter, anchor_state=args.anchor_state, max_dist=args.max_dist)
+        aircraft_delay_routes = aircraft_delay_data(quarter=args.quarter, anchor_state=args.anchor_state, max_dist=args.max_dist,
+                                                    bootstrap=args.bootstrap, workers=args.workers, seed=args.seed,
+                                                    rows=ot_rows)
+        if args.delay_hist or args.tod_bins:
+            print('creating {0}/delay_histograms.npz...'.format(output_dir))
+            np.savez_compressed('{0}/delay_histograms.npz'.format(output_dir),
+                                **delay_sketches(ot_rows, hist_cols=args.delay_hist, tod_bins=args.tod_bins))
         aircraft_delay_routes.to_csv('{0}/aircraft_delay_routes.csv'.format(output_dir), index=False)
 
     # Aircraft Occupancy Data
     if args.air_occ:
         print('creating {0}/aircraft_occupancy_routes.csv...'.format(output_dir))
         sys.stdout.flush()
-        aircraft_occupancy_routes = aircraft_occupancy_data(quarter=args.quarter, anchor_state=args.anchor_state, max_dist=args.max_dist)
+        aircraft_occupancy_routes = aircraft_occupancy_data(quarter=args.quarter, anchor_state=args.anchor_state, max_dist=args.max_dist,
+                                                            bootstrap=args.bootstrap, workers=args.workers, seed=args.seed)
         aircraft_occupancy_routes.to_csv('{0}/aircraft_occupancy_routes.csv'.format(output_dir), index=False)
 
+    # Aircraft Occupancy Cube (every month, slices are rolled up from it)
+    if args.occ_cube:
+        print('creating {0}/aggregated/occupancy_cube.npz...'.format(data_dir))
+        sys.stdout.flush()
+        np.savez_compressed('{0}/aggregated/occupancy_cube.npz'.format(data_dir),
+                            **occupancy_cube(anchor_state=args.anchor_state, max_dist=args.max_dist))
+
     # Flyer Fare Class Data
     if args.air_class:
         print('creating {0}/flyer_class_routes.csv...'.format(output_dir))
         sys.stdout.flush()
-        flyer_class_routes = flyer_class_data(quarter=args.quarter, anchor_state=args.anchor_state, max_dist=args.max_dist)
+        flyer_class_routes = flyer_class_data(quarter=args.quarter, anchor_state=args.anchor_state, max_dist=args.max_dist,
+                                              bootstrap=args.bootstrap, workers=args.workers, seed=args.seed)
         flyer_class_routes.to_csv('{0}/flyer_class_routes.csv'.format(output_dir), index=False)
 
     # Flyer Stopover Data
     if args.air_stopover:
         print('creating {0}/flyer_stopover_routes.csv...'.format(output_dir))
         sys.stdout.flush()
-        flyer_stopover_routes = flyer_stopover_data(quarter=args.quarter, anchor_state=args.anchor_state, max_dist=args.max_dist)
+        flyer_stopover_routes = flyer_stopover_data(quarter=args.quarter, anchor_state=args.anchor_state, max_dist=args.max_dist,
+                                                    bootstrap=args.bootstrap, workers=args.workers, seed=args.seed)
         flyer_stopover_routes.to_csv('{0}/flyer_stopover_routes.csv'.format(output_dir), index=False)
 
+    # Route Fact Table of every Route Dataset in the output directory
+    if args.route_facts or args.air_delay or args.air_occ or args.air_class or args.air_stopover:
+        print('creating {0}/route_facts.csv...'.format(output_dir))
+        sys.stdout.flush()
+        route_facts, route_fact_dtypes = route_fact_table(output_dir)
+        route_facts.to_csv('{0}/route_facts.csv'.format(output_dir), index=False)
+        with open('{0}/route_facts_dtypes.json'.format(output_dir), 'w') as f:
+            json.dump(route_fact_dtypes, f, indent=1)
+
+    # Route Network
+    if args.air_network:
+        print('creating {0}/route_network...'.format(output_dir))
+        sys.stdout.flush()
+        save_route_network(route_network_data(quarter=args.quarter), '{0}/route_network'.format(output_dir))
+
+    # Amtrak Station Delays from the Status Archive (every station, before the Amtrak data that uses them)
+    if args.amtrak_status:
+        fname = '{0}/aggregated/amtrak_station_delays.csv'.format(data_dir)
+        print('creating {0}...'.format(fname))
+        sys.stdout.flush()
+        amtrak_status_delays('{0}/amtrak/status_archive'.format(data_dir)).to_csv(fname, index=False)
+
     # Amtrak Locations, Delays + Nearest Airport Data
     if args.amtrak:
         print('creating {0}/amtrak_plus.csv...'.format(output_dir))
         amtrak_plus = amtrak_data(anchor_state=args.anchor_state)
         amtrak_plus.to_csv('{0}/amtrak_plus.csv'.format(output_dir), index=False)
+
+    # Rail Alternatives to the Aggregated Air Routes
+    if args.rail_alternatives:
+        print('creating {0}/rail_alternatives.csv...'.format(output_dir))
+        sys.stdout.flush()
+        route_cols = ['orig_code', 'orig_city', 'orig_lat', 'orig_lon', 'dest_code', 'dest_city', 'dest_lat', 'dest_lon']
+        routes = pd.concat([pd.read_csv(fname)[route_cols] for fname in sorted(glob('{0}/*_routes.csv'.format(output_dir)))])
+        ## route ids also for datasets aggregated before they were written out
+        routes.insert(0, 'route_id', route_utils.route_ids(routes['orig_code'], routes['dest_code']))
+        rail = rail_alternatives(routes.drop_duplicates('route_id'), station_data(), radius=args.rail_radius)
+        rail.to_csv('{0}/rail_alternatives.csv'.format(output_dir), index=False)
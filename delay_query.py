@@ -0,0 +1,190 @@
+"""
+This script answers delay threshold and quantile queries per route from the delay histograms created by
+data_aggregator.py --air-delay (delay_histograms.npz), so a new threshold doesn't need another pass over the raw flights,
+and lists the routes' time of day delay profiles stored along with them.
+"""
+from __future__ import print_function
+
+# periods whose histograms can be merged (quarter, input directory)
+PERIODS = [(None, 'data/aggregated'),
+           (1, 'data/aggregated/q1'),
+           (2, 'data/aggregated/q2'),
+           (3, 'data/aggregated/q3'),
+           (4, 'data/aggregated/q4')]
+
+def load_delay_histograms(fname, col):
+    """
+    Load the delay histograms of one column
+    Return dict of numpy arrays: route_id, edges, counts (routes x bins) and missing
+    Raise ValueError for columns without histograms
+    """
+    saved = np.load(fname)
+    if '{0}_counts'.format(col) not in saved:
+        raise ValueError('no {0} histograms in {1}'.format(col, fname))
+    return {'route_id': saved['route_id'],
+            'edges': saved['{0}_edges'.format(col)],
+            'counts': saved['{0}_counts'.format(col)].astype(np.int64),
+            'missing': saved['{0}_missing'.format(col)].astype(np.int64)}
+
+def merge_delay_histograms(histograms):
+    """
+    Merge delay histograms (e.g. of several quarters or files) by adding their counts per route id
+    Return dict of numpy arrays as load_delay_histograms
+    Raise ValueError for histograms with different bin edges
+    """
+    edges = histograms[0]['edges']
+    if any(not np.array_equal(hist['edges'], edges) for hist in histograms):
+        raise ValueError('histograms have different bin edges')
+    routes, route_idx = np.unique(np.concatenate([hist['route_id'] for hist in histograms]), return_inverse=True)
+    counts = np.zeros((len(routes), len(edges) + 1), dtype=np.int64)
+    missing = np.zeros(len(routes), dtype=np.int64)
+    np.add.at(counts, route_idx, np.concatenate([hist['counts'] for hist in histograms]))
+    np.add.at(missing, route_idx, np.concatenate([hist['missing'] for hist in histograms]))
+    return {'route_id': routes, 'edges': edges, 'counts': counts, 'missing': missing}
+
+def load_tod_profiles(fname):
+    """
+    Load the time of day delay profiles
+    Return dict of numpy arrays: route_id, bins and the tod_ count arrays (routes x bins)
+    Raise ValueError for files without profiles
+    """
+    saved = np.load(fname)
+    if 'tod_flights' not in saved:
+        raise ValueError('no time of day profiles in {0}'.format(fname))
+    profiles = {'route_id': saved['route_id'], 'bins': int(saved['tod_bins'])}
+    for key in saved.files:
+        if key.startswith('tod_') and key != 'tod_bins':
+            profiles[key] = saved[key].astype(np.int64)
+    return profiles
+
+def merge_tod_profiles(profiles):
+    """
+    Merge time of day delay profiles (e.g. of several quarters) by adding their counts per route id
+    Return dict of numpy arrays as load_tod_profiles
+    Raise ValueError for profiles with different bins
+    """
+    bins = profiles[0]['bins']
+    if any(profile['bins'] != bins for profile in profiles):
+        raise ValueError('profiles have different time of day bins')
+    routes, route_idx = np.unique(np.concatenate([profile['route_id'] for profile in profiles]), return_inverse=True)
+    merged = {'route_id': routes, 'bins': bins}
+    for key in [key for key in profiles[0] if key.startswith('tod_')]:
+        merged[key] = np.zeros((len(routes), bins), dtype=np.int64)
+        np.add.at(merged[key], route_idx, np.concatenate([profile[key] for profile in profiles]))
+    return merged
+
+def tod_table(profiles):
+    """
+    Per-route, per-time of day bin flights and fractions of flights over each AirlineDelay threshold
+    Return pandas dataframe of orig, dest, departure bin start (hh:mm), flights and AirlineDelay_<threshold>frac columns
+    """
+    bins = profiles['bins']
+    orig, dest = route_codes(profiles['route_id'])
+    starts = ['{0:02d}:{1:02d}'.format(minute // 60, minute % 60) for minute in range(0, 1440, 1440 // bins)]
+    table = pd.DataFrame({'orig_code': np.repeat(orig, bins), 'dest_code': np.repeat(dest, bins),
+                          'departure': np.tile(starts, len(orig)),
+                          'flights': profiles['tod_flights'].ravel()})
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for key in sorted(key for key in profiles if key.startswith('tod_AirlineDelay_')):
+            table['{0}frac'.format(key[len('tod_'):])] = profiles[key].ravel() / table['flights'].values
+    return table
+
+def hist_exceedance(hist, threshold):
+    """
+    Fraction of each route's flights with a delay over the threshold, flights without a value count as not over it
+    Bin i holds (edges[i-1], edges[i]], so thresholds on an edge are exact and the bin holding any other threshold
+    is split linearly; thresholds outside the edges are clipped to them
+    Return numpy array
+    """
+    edges = np.asarray(hist['edges'], dtype=float)
+    threshold = min(max(threshold, edges[0]), edges[-1])
+    idx = max(np.searchsorted(edges, threshold, side='left'), 1)
+    above = hist['counts'][:, idx + 1:].sum(axis=1) + \
+            hist['counts'][:, idx] * (edges[idx] - threshold) / (edges[idx] - edges[idx - 1])
+    total = hist['counts'].sum(axis=1) + hist['missing']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total > 0, above / total, np.nan)
+
+def delay_table(hist, thresholds, quantiles):
+    """
+    Per-route delay fractions over the thresholds and delay quantiles
+    Return pandas dataframe of orig, dest, flights, <col>_<threshold>frac and <col>_q<quantile> columns
+    """
+    orig, dest = route_codes(hist['route_id'])
+    table = pd.DataFrame({'orig_code': orig, 'dest_code': dest,
+                          'Flight_Count': hist['counts'].sum(axis=1) + hist['missing']})
+    for threshold in thresholds:
+        table['{0}_{1:g}frac'.format(hist['col'], threshold)] = hist_exceedance(hist, threshold)
+    for q in quantiles:
+        table['{0}_q{1:g}'.format(hist['col'], q * 100)] = hist_quantile(hist['counts'], hist['edges'], q)
+    return table
+
+
+if __name__ == '__main__':
+    import numpy as np
+    import pandas as pd
+    from route_utils import route_codes, hist_quantile
+    import sys
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+    parser = ArgumentParser(description='This script answers delay threshold and quantile queries per route from the delay histograms\n'
+                                        'created by data_aggregator.py --air-delay, e.g. the fraction of flights delayed over 15 or 45 min.',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-q', '--quarter', dest='quarter',
+                        default=None, nargs='+', metavar='QUARTER', type=int,
+                        help='QUARTER(s) of the histograms, several quarters are merged; default None uses the full year')
+    parser.add_argument('--col', dest='col',
+                        default='AirlineDelay',
+                        help='Delay column of the histograms (AirlineDelay, DepDelay, ArrDelay or TaxiOut)')
+    parser.add_argument('--threshold', dest='thresholds',
+                        default=[15, 45], nargs='*', type=float,
+                        help='Delay thresholds in minutes, one fraction of flights over each')
+    parser.add_argument('--quantile', dest='quantiles',
+                        default=[0.5, 0.9], nargs='*', type=float,
+                        help='Delay quantiles (0-1) of the flights with a delay value')
+    parser.add_argument('--route', dest='route',
+                        default=None, nargs=2, metavar=('ORIG', 'DEST'),
+                        help='Only list the route from ORIG to DEST')
+    parser.add_argument('--min-flights', dest='min_flights',
+                        default=0, type=int,
+                        help='Minimum flights of a listed route')
+    parser.add_argument('--tod', dest='tod',
+                        default=False, action='store_true',
+                        help='List the time of day delay profiles (flights and fractions over 10, 20 and 30 min '
+                             'per scheduled departure time bin) instead')
+    parser.add_argument('--output', dest='output',
+                        default=None,
+                        help='Write the table to this csv file instead of printing it')
+    args = parser.parse_args()
+
+    # input directories
+    input_dirs = dict(PERIODS)
+    quarters = args.quarter or [None]
+
+    try:
+        if args.tod:
+            profiles = merge_tod_profiles([load_tod_profiles('{0}/delay_histograms.npz'.format(input_dirs[quarter]))
+                                           for quarter in quarters])
+        else:
+            hist = merge_delay_histograms([load_delay_histograms('{0}/delay_histograms.npz'.format(input_dirs[quarter]), args.col)
+                                           for quarter in quarters])
+    except (ValueError, IOError) as e:
+        print(e)
+        sys.exit(1)
+
+    if args.tod:
+        ## route flights over every bin for --min-flights
+        table = tod_table(profiles)
+        table = table.loc[np.repeat(profiles['tod_flights'].sum(axis=1), profiles['bins']) >= args.min_flights]
+    else:
+        hist['col'] = args.col
+        table = delay_table(hist, args.thresholds, args.quantiles)
+        table = table.loc[table['Flight_Count'] >= args.min_flights]
+    if args.route:
+        table = table.loc[(table['orig_code'] == args.route[0]) & (table['dest_code'] == args.route[1])]
+    if args.output:
+        table.to_csv(args.output, index=False)
+        print('wrote {0} routes to {1}'.format(len(table), args.output))
+    else:
+        print(table.to_string(index=False))
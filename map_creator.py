@@ -5,6 +5,138 @@ combines them, and finally creates an interactive map to visualize the routes an
 """
 from __future__ import print_function
 
+# periods that can be selected in the multi-period map (quarter, map name suffix, label)
+PERIODS = [(None, '_Full_Year', 'Full Year'),
+           (1, '_Q1', 'Q1'),
+           (2, '_Q2', 'Q2'),
+           (3, '_Q3', 'Q3'),
+           (4, '_Q4', 'Q4')]
+
+# route layers (key, name, popup html function name, route popup height,
+#               offset in degrees between the arcs of out and back routes)
+ROUTE_LAYERS = [('ot', 'Airline Delays (top 20 routes)', 'ot_route_html', 480, .2),
+                ('occ', 'Aircraft Occupancy (top 20 routes)', 'occ_route_html', 250, .3),
+                ('cl', 'First/Business Class (top 20 routes)', 'cl_route_html', 250, .2),
+                ('so', 'Stopovers (top 20 routes)', 'so_route_html', 250, .2),
+                ('ot_occ', 'Airline Delays & Occupancy (in top 40 of each)', 'ot_occ_route_html', 480, .2),
+                ('ot_cl', 'Airline Delays & First/Business (in top 40 of each)', 'ot_route_html', 480, .2),
+                ('occ_cl', 'Occupancy & First/Business (in top 40 of each)', 'occ_route_html', 250, .2),
+                ('ot_occ_cl', 'Airline Delays & Occupancy & First/Business (in top 40 of each)', 'ot_occ_route_html', 480, .2),
+                ('pareto', 'Pain Point Skyline (routes no other route beats on every metric)', 'pareto_route_html', 250, .2)]
+
+# metrics ranked together for the pain point skyline (route fact table dataset, column), higher is worse for each
+PARETO_METRICS = [('aircraft_delay', 'AirlineDelay_20frac'),
+                  ('aircraft_occupancy', 'occupancy_mean'),
+                  ('flyer_class', 'class_bf_frac'),
+                  ('flyer_stopover', 'stopover_frac')]
+
+# width in pixels of the time of day delay profile bar charts in the delay popups
+TOD_CHART_WIDTH = 192
+
+# points per great-circle route arc (odd, so the middle point is the route's midpoint)
+ARC_POINTS = 17
+
+# Leaflet control for the multi-period map, draws a period's route layers once its data script has loaded
+PERIOD_SELECTOR_TEMPLATE = u"""
+{% macro script(this, kwargs) %}
+    var {{this.get_name()}} = (function(map, layers, periods) {
+        var cache = {};
+        var current = null;
+
+        function draw(period) {
+            for (var key in layers) {
+                layers[key].clearLayers();
+                var layer = period[key];
+                layer.airports.forEach(function(a) {
+                    L.marker([a[0], a[1]]).bindPopup(a[2], {maxWidth: 300}).addTo(layers[key]);
+                });
+                layer.routes.forEach(function(r) {
+                    L.polyline(r.line, {color: 'green', weight: 3}).addTo(layers[key]);
+                    L.marker(r.marker, {icon: L.AwesomeMarkers.icon({icon: 'info-sign', iconColor: 'white',
+                                                                     markerColor: 'green', prefix: 'glyphicon'})})
+                        .bindPopup(r.html, {maxWidth: 300}).addTo(layers[key]);
+                });
+            }
+        }
+
+        // called by each maps/periods/*.js data script
+        window.routeMapperPeriodLoaded = function(key, period) {
+            cache[key] = period;
+            if (key === current) {
+                draw(period);
+            }
+        };
+
+        function select(key) {
+            current = key;
+            if (cache[key]) {
+                draw(cache[key]);
+                return;
+            }
+            var s = document.createElement('script');
+            s.src = '{{this.period_dir}}/Route_Mapper' + key + '.js';
+            document.body.appendChild(s);
+        }
+
+        var control = L.control({position: 'topleft'});
+        control.onAdd = function() {
+            var div = L.DomUtil.create('div', 'leaflet-bar');
+            var sel = L.DomUtil.create('select', '', div);
+            periods.forEach(function(p) {
+                var opt = document.createElement('option');
+                opt.value = p[0];
+                opt.text = p[1];
+                sel.appendChild(opt);
+            });
+            L.DomEvent.disableClickPropagation(div);
+            sel.onchange = function() { select(sel.value); };
+            return div;
+        };
+        control.addTo(map);
+        select(periods[0][0]);
+        return control;
+    })({{this._parent.get_name()}},
+       { {% for key, group in this.groups %}"{{key}}": {{group.get_name()}},{% endfor %} },
+       {{this.periods}});
+{% endmacro %}
+"""
+
+# density layer weights (route fact table dataset, weight column, weight fraction column, label)
+DENSITY_WEIGHTS = {'passengers': ('aircraft_occupancy', 'PASSENGERS_sum', None, 'Passengers'),
+                   'flights': ('aircraft_delay', 'Flight_Count', None, 'Flights'),
+                   'delay': ('aircraft_delay', 'Flight_Count', 'AirlineDelay_20frac',
+                             'Flights with Aircraft Delay > 20 min')}
+
+# density cell colors, grey for cells with only Amtrak stations then light to dark by weight quintile
+DENSITY_COLORS = ['#969696', '#ffffb2', '#fecc5c', '#fd8d3c', '#f03b20', '#bd0026']
+
+# Leaflet rectangles for one density grid, cells are [x, y, color, weight, airports, stations, ridership]
+# on the web mercator tile grid at the layer's zoom level so only their indices are shipped
+DENSITY_LAYER_TEMPLATE = u"""
+{% macro script(this, kwargs) %}
+    (function(group, n, label, colors, cells) {
+        function lat(y) { return Math.atan(Math.sinh(Math.PI * (1 - 2 * y / n))) * 180 / Math.PI; }
+        function lon(x) { return x / n * 360 - 180; }
+        cells.forEach(function(c) {
+            L.rectangle([[lat(c[1] + 1), lon(c[0])], [lat(c[1]), lon(c[0] + 1)]],
+                        {color: colors[c[2]], weight: 1, fillOpacity: 0.6})
+                .bindPopup('<font color="red">' + c[3] + '</font> ' + label + '<BR>' +
+                           c[4] + ' airports<BR>' + c[5] + ' Amtrak stations<BR>' +
+                           '<font color="green">' + c[6] + '</font> 2016 Amtrak users')
+                .addTo(group);
+        });
+    })({{this._parent.get_name()}}, {{2 ** this.zoom}}, "{{this.label}}", {{this.colors}}, {{this.cells}});
+{% endmacro %}
+"""
+
+# cached layer script, rendered once per change in the layer's inputs (see cached_layer)
+LAYER_FRAGMENT_TEMPLATE = u"""
+{% macro script(this, kwargs) %}
+{{this.fragment}}
+{% endmacro %}
+"""
+LAYER_GROUP_PLACEHOLDER = '__layer_group__'
+
 def geocalc(lat0, lon0, lat1, lon1):
     """
     Return the distance (in mi) between two points in geographical coordinates
@@ -24,93 +156,331 @@ def geocalc(lat0, lon0, lat1, lon1):
     c = np.arctan2(y, x)
     return EARTH_R * c
 
-def midpoint(orig_lat, orig_lon, dest_lat, dest_lon):
-    return (float(orig_lat)+float(dest_lat))*1.0 / 2, (float(orig_lon)+float(dest_lon))*1.0/2
-
-
-if __name__ == '__main__':
-    import numpy as np
-    import pandas as pd
-    import folium
-    import sys
-    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
-
-    parser = ArgumentParser(description='This script loads the aggregated route airline and Amtrak datasets,\n'
-                                        'performs a loose cut on infrequently flown routes to ensure consistency,\n'
-                                        'combines them, and finally creates an interactive map to visualize the routes and their metrics.',
-                            formatter_class=ArgumentDefaultsHelpFormatter)
-
-    parser.add_argument('-q', '--quarter', dest='quarter',
-                        default=None, metavar='QUARTER',
-                        help='QUARTER over which to create the map, default None aggregates over all')
-    parser.add_argument('--monthly-flights', dest='monthly_flights',
-                        default=50, type=int,
-                        help='Minimum monthly flights over a route to ensure consistent pool of travelers')
-    parser.add_argument('--monthly-passengers', dest='monthly_passengers',
-                        default=1000, type=int,
-                        help='Minimum monthly passengers over a route to ensure consistent pool of travelers')
-    args = parser.parse_args()
+def route_arcs(routes, p, geometry_cache):
+    """
+    Great-circle arcs of a route layer, out and back routes both in the layer are offset by p/2 degrees
+    each so they are drawn as parallel curves; arcs are looked up by (route id, offset) in the geometry
+    cache dict and the missing ones are computed in one batch and added to it
+    Return numpy array (routes x ARC_POINTS x [lat, lon])
+    """
+    ids = routes['route_id'].values
+    reverse = np.isin(route_ids(routes['dest_code'], routes['orig_code']), ids)
+    offsets = np.where(reverse, p / 2., 0.)
+    keys = list(zip(ids.tolist(), offsets.tolist()))
+    missing = [i for i, key in enumerate(keys) if key not in geometry_cache]
+    if missing:
+        new_arcs = great_circle_arcs(routes['orig_lat'].values[missing], routes['orig_lon'].values[missing],
+                                     routes['dest_lat'].values[missing], routes['dest_lon'].values[missing],
+                                     offsets[missing], points=ARC_POINTS)
+        for i, new_arc in zip(missing, new_arcs):
+            geometry_cache[keys[i]] = new_arc
+    return np.array([geometry_cache[key] for key in keys]).reshape(len(keys), ARC_POINTS, 2)
+
+def load_geometry_cache(path):
+    """Return dict of (route id, offset) -> arc from a saved geometry cache, empty if there is none"""
+    if not os.path.exists(path):
+        return {}
+    saved = np.load(path)
+    if saved['arc'].shape[1:] != (ARC_POINTS, 2):
+        return {}
+    return dict(zip(zip(saved['route_id'].tolist(), saved['offset'].tolist()), saved['arc']))
+
+def save_geometry_cache(path, geometry_cache):
+    """Save the geometry cache dict of (route id, offset) -> arc"""
+    keys = list(geometry_cache.keys())
+    np.savez(path,
+             route_id=np.array([route_id for route_id, offset in keys], dtype=np.int64),
+             offset=np.array([offset for route_id, offset in keys], dtype=float),
+             arc=np.array([geometry_cache[key] for key in keys]).reshape(len(keys), ARC_POINTS, 2))
+
+def read_route_facts(input_dir):
+    """
+    Read the route fact table created by data_aggregator.py (every route dataset in one row per route)
+    with its column dtypes
+    Return pandas dataframe
+    """
+    with open('{0}/route_facts_dtypes.json'.format(input_dir)) as f:
+        dtypes = json.load(f)
+    return pd.read_csv('{0}/route_facts.csv'.format(input_dir), dtype=dtypes)
 
-    # Input directory
-    if args.quarter:
-        input_dir = 'data/aggregated/q{0}'.format(args.quarter)
-        months = 3
-        mapname_suffix = '_Q{0}'.format(args.quarter)
-    else:
-        input_dir = 'data/aggregated'
-        months = 12
-        mapname_suffix = '_Full_Year'
+def fact_routes(facts, rows, datasets):
+    """
+    Routes of the fact table rows (boolean mask or index labels, kept in that order) with the route info
+    and the columns of the datasets without their dataset prefix, the first dataset's values are kept
+    for columns several datasets have
+    Return pandas dataframe
+    """
+    routes = facts.loc[rows, [col for col in facts.columns if '__' not in col and not col.startswith('has_')]]
+    for dataset in datasets:
+        prefix = '{0}__'.format(dataset)
+        for col in facts.columns:
+            if col.startswith(prefix) and col[len(prefix):] not in routes.columns:
+                routes[col[len(prefix):]] = facts.loc[rows, col].values
+    return routes
+
+def int_txt(values, fmt='{0}', missing='no data for'):
+    """
+    Truncated int text of a numeric column for popups, missing values get the missing text
+    Return list of str
+    """
+    values = np.asarray(values, dtype=float)
+    nan = np.isnan(values)
+    ints = np.where(nan, 0, values).astype(np.int64)
+    return [missing if is_nan else fmt.format(i) for is_nan, i in zip(nan.tolist(), ints.tolist())]
 
-    # output directory
-    map_dir = 'maps'
+def pct_txt(fracs, missing='no data for'):
+    """
+    Percent text of a fraction column for popups, missing values get the missing text
+    Return list of str
+    """
+    pcts = np.asarray(fracs, dtype=float) * 100
+    return [missing if is_nan else '{0:.1f}%'.format(pct) for is_nan, pct in zip(np.isnan(pcts).tolist(), pcts.tolist())]
 
-    print('creating {0}/Route_Mapper{1}.html...'.format(map_dir, mapname_suffix))
-    sys.stdout.flush()
+def bf_pct_txt(routes):
+    """
+    First/business class percent for popups, class data is not available for every route (NaN)
+    Return list of str
+    """
+    return pct_txt(routes['class_bf_frac'])
 
-    # load data
-    aircraft_delay_routes = pd.read_csv('{0}/aircraft_delay_routes.csv'.format(input_dir))
-    aircraft_occupancy_routes = pd.read_csv('{0}/aircraft_occupancy_routes.csv'.format(input_dir))
-    # amtrak data taken over full year for now
-    if args.quarter is not None:
-        amtrak_input_dir = '{0}/..'.format(input_dir)
-    else:
-        amtrak_input_dir = input_dir
+def tod_profile_html(input_dir, route_ids):
+    """
+    Bar chart html of each route's time of day delay profile (fraction of flights with an aircraft delay > 20 min
+    per scheduled departure time bin) from the delay histograms file of data_aggregator.py --air-delay (written by
+    its delay_sketches, not the route dataset), bars scaled to the route's worst bin; empty where the file or the route's profile is missing
+    Return list of str
+    """
+    fname = '{0}/delay_histograms.npz'.format(input_dir)
+    route_ids = np.asarray(route_ids, dtype=np.int64)
+    if not os.path.exists(fname):
+        return [''] * len(route_ids)
+    saved = np.load(fname)
+    if 'tod_flights' not in saved or not len(saved['route_id']):
+        return [''] * len(route_ids)
+    bins = int(saved['tod_bins'])
+    idx = np.minimum(np.searchsorted(saved['route_id'], route_ids), len(saved['route_id']) - 1)
+    found = saved['route_id'][idx] == route_ids
+    flights = saved['tod_flights'][idx].astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fracs = np.where(flights > 0, saved['tod_AirlineDelay_20'][idx] / flights, 0)
+    starts = ['{0:02d}:{1:02d}'.format(minute // 60, minute % 60) for minute in range(0, 1440, 1440 // bins)]
+    width = max(TOD_CHART_WIDTH // bins - 1, 1)
+    bar = """<td><div title="{0} {1:.1f}% of {2:.0f} flights" style="width:{3}px;height:{4}px;margin-right:1px;""" \
+          """background:red"></div></td>""".format
+    html = []
+    for route_found, route_flights, route_fracs in zip(found.tolist(), flights, fracs):
+        if not route_found or not route_flights.sum():
+            html.append('')
+            continue
+        worst = int(np.argmax(route_fracs))
+        heights = np.round(route_fracs / max(route_fracs[worst], 1e-9) * 40).astype(int)
+        bars = ''.join(bar(start, frac * 100, n, width, height)
+                       for start, frac, n, height in zip(starts, route_fracs.tolist(), route_flights.tolist(), heights.tolist()))
+        html.append("""<BR><BR>Aircraft Delay > 20 min by scheduled departure (worst <font color="red">{0} {1:.1f}%</font>)<BR>""" \
+                    """<table cellspacing="0" cellpadding="0"><tr valign="bottom">{2}</tr></table>""" \
+                    """00:00{3}24:00""".format(starts[worst], route_fracs[worst] * 100, bars,
+                                               '&nbsp;' * (TOD_CHART_WIDTH // 7 - 8)))
+    return html
+
+def ot_route_html(routes):
+    """Return list of popup html for the routes in the airline delay layers"""
+    template = """{0} {1}<BR>to<BR>{2} {3}<BR><BR><font color="green">{4}</font> Total Flights<BR><BR>""" \
+               """{5} mi<BR>{6:.1f} min. avg. Air Time<BR>{7:.1f} min. avg. Elapsed Gate to Gate<BR><BR>""" \
+               """<font color="green">{8}</font> First/Business Flyers (from 10% sample of domestic tickets)<BR><BR>""" \
+               """<font color="red">{9:.1f}%</font> Aircraft Delay > 20 min<BR>""" \
+               """<font color="red">{10} min.</font> avg. Aircraft Delay time for non-weather and non-airport ops delays{11}""".format
+    return list(map(template,
+                    routes['orig_code'].tolist(), routes['orig_city'].tolist(),
+                    routes['dest_code'].tolist(), routes['dest_city'].tolist(),
+                    routes['Flight_Count'].tolist(), int_txt(routes['Distance_mean']),
+                    routes['AirTime_mean'].tolist(), routes['ActualElapsedTime_mean'].tolist(),
+                    bf_pct_txt(routes), (routes['AirlineDelay_20frac'].values * 100).tolist(), int_txt(routes['AirlineDelay_mean']),
+                    routes['tod_profile'].tolist() if 'tod_profile' in routes else [''] * len(routes)))
+
+def occ_route_html(routes):
+    """Return list of popup html for the routes in the aircraft occupancy layers"""
+    template = """{0} {1}<BR>to<BR>{2} {3}<BR><BR>""" \
+               """<font color="green">{4}</font> Total Passengers<BR>""" \
+               """<font color="green">{5}</font> Total Departures<BR>{6} mi<BR><Br>""" \
+               """<font color="green">{7}</font> First/Business Flyers (from 10% sample of domestic tickets)<BR><BR>""" \
+               """<font color="red">{8:.1f}%</font> avg. Occupancy<BR><BR>""".format
+    return list(map(template,
+                    routes['orig_code'].tolist(), routes['orig_city'].tolist(),
+                    routes['dest_code'].tolist(), routes['dest_city'].tolist(),
+                    int_txt(routes['PASSENGERS_sum']), int_txt(routes['DEPARTURES_PERFORMED_sum']), int_txt(routes['DISTANCE_mean']),
+                    bf_pct_txt(routes), (routes['occupancy_mean'].values * 100).tolist()))
+
+def cl_route_html(routes):
+    """Return list of popup html for the routes in the first/business class layer"""
+    template = """{0} {1}<BR>to<BR>{2} {3}<BR><BR>""" \
+               """ (10% sample of domestic tickets)<Br><font color="green">{4}</font> Total Passengers<BR>""" \
+               """{5} mi<BR><Br>""" \
+               """<font color="green">{6:.1f}%</font> First/Business Flyers<BR>{7:.1f}% Coach Flyers""".format
+    return list(map(template,
+                    routes['orig_code'].tolist(), routes['orig_city'].tolist(),
+                    routes['dest_code'].tolist(), routes['dest_city'].tolist(),
+                    int_txt(routes['PASSENGERS_sum']), int_txt(routes['DISTANCE_mean']),
+                    (routes['class_bf_frac'].values * 100).tolist(), (routes['class_c_frac'].values * 100).tolist()))
+
+def so_route_html(routes):
+    """Return list of popup html for the routes in the stopover layer"""
+    template = """{0} {1}<BR>to<BR>{2} {3}<BR>""" \
+               """~{4} mi<BR><BR>""" \
+               """(10% sample of domestic tickets)<Br><font color="green">{5}</font> Total Passengers<BR><BR>""" \
+               """<font color="red">{6:.1f}%</font> stopovers<BR>(through {7})""".format
+    return list(map(template,
+                    routes['orig_code'].tolist(), routes['orig_city'].tolist(),
+                    routes['dest_code'].tolist(), routes['dest_city'].tolist(),
+                    int_txt(routes['dist_calc']), int_txt(routes['PASSENGERS_sum']),
+                    (routes['stopover_frac'].values * 100).tolist(), routes['stopover_airports_clean'].tolist()))
+
+def ot_occ_route_html(routes):
+    """Return list of popup html for the routes in the combined airline delay and occupancy layers"""
+    template = """{0} {1}<BR>to<BR>{2} {3}<BR><BR><font color="green">{4}</font> Total Flights (delay data)<BR>""" \
+               """<font color="green">{5}</font> Total Flights (occupancy data)<BR>""" \
+               """<font color="green">{6}</font> Total Passengers (occupancy data)<BR>""" \
+               """{7} mi<BR>{8:.1f} min. avg. Air Time<BR>{9:.1f} min. avg. Elapsed Gate to Gate<BR><BR>""" \
+               """<font color="green">{10}</font> First/Business Flyers (from 10% sample of domestic tickets)<BR><BR>""" \
+               """<font color="red">{11:.1f}%</font> Aircraft Delay > 20 min<BR>""" \
+               """<font color="red">{12} min.</font> avg. Aircraft Delay time for non-weather and non-airport ops delays<BR><BR>""" \
+               """<font color="red">{13:.1f}%</font> avg. Occupancy{14}""".format
+    return list(map(template,
+                    routes['orig_code'].tolist(), routes['orig_city'].tolist(),
+                    routes['dest_code'].tolist(), routes['dest_city'].tolist(),
+                    routes['Flight_Count'].tolist(), routes['DEPARTURES_PERFORMED_sum'].tolist(), routes['PASSENGERS_sum'].tolist(),
+                    int_txt(routes['DISTANCE_mean']), routes['AirTime_mean'].tolist(), routes['ActualElapsedTime_mean'].tolist(),
+                    bf_pct_txt(routes), (routes['AirlineDelay_20frac'].values * 100).tolist(), int_txt(routes['AirlineDelay_mean']),
+                    (routes['occupancy_mean'].values * 100).tolist(),
+                    routes['tod_profile'].tolist() if 'tod_profile' in routes else [''] * len(routes)))
+
+def amtrak_station_html(stations):
+    """Return list of popup html for the Amtrak stations with their ridership, delay and nearest airports"""
+    template = """{0} {1} Amtrak Station<BR>""" \
+               """<font color="green">{2}</font> 2016 users<BR>""" \
+               """<font color="red">{3}</font> avg. delay in 2016<BR><BR>""" \
+               """Nearest airport is {4}, {5}<BR>{6} mi away<BR><BR>""" \
+               """Next nearest airport is {7}, {8}<BR>{9} mi away""".format
+    return list(map(template,
+                    stations['city_caps'].tolist(), stations['code'].tolist(),
+                    int_txt(stations['Users']), int_txt(stations['delay_avg'], '{0} min'),
+                    stations['closest_a1_name'].tolist(), stations['closest_a1_city'].tolist(), int_txt(stations['closest_a1_dist']),
+                    stations['closest_a2_name'].tolist(), stations['closest_a2_city'].tolist(), int_txt(stations['closest_a2_dist'])))
+
+def pareto_route_html(routes):
+    """Return list of popup html for the routes in the pain point skyline layer"""
+    template = """{0} {1}<BR>to<BR>{2} {3}<BR><BR>""" \
+               """Pain point skyline rank <font color="red">{4}</font> (front {5})<BR><BR>""" \
+               """<font color="red">{6}</font> Aircraft Delay > 20 min<BR>""" \
+               """<font color="red">{7}</font> avg. Occupancy<BR>""" \
+               """<font color="green">{8}</font> First/Business Flyers (from 10% sample of domestic tickets)<BR>""" \
+               """<font color="red">{9}</font> stopovers""".format
+    return list(map(template,
+                    routes['orig_code'].tolist(), routes['orig_city'].tolist(),
+                    routes['dest_code'].tolist(), routes['dest_city'].tolist(),
+                    routes['pareto_rank'].tolist(), routes['pareto_front'].tolist(),
+                    pct_txt(routes['AirlineDelay_20frac']), pct_txt(routes['occupancy_mean']),
+                    pct_txt(routes['class_bf_frac']), pct_txt(routes['stopover_frac'])))
+
+def pareto_fronts(values):
+    """
+    Non-dominated sorting of the rows of a metric array (higher values dominate in every column, NaN counts as lowest)
+    A row is dominated when another row is at least as high on every metric and higher on one;
+    front 1 is the Pareto skyline, front 2 the skyline once front 1 is removed, and so on
+    Rows are visited in descending lexicographic order, so every row that dominates a row comes before it,
+    and each row goes into the first front with no row dominating it, found by binary search over the fronts
+    (efficient non-dominated sort, ENS-BS)
+    Return numpy array of front numbers
+    """
+    values = np.where(np.isnan(values), -np.inf, np.asarray(values, dtype=float))
+    order = np.lexsort(-values.T[::-1])
+    front = np.zeros(len(values), dtype=np.int64)
+    # member metric values of each front, grown in place
+    front_values = []
+    front_sizes = []
+    for i in order:
+        row = values[i]
+        lo, hi = 0, len(front_values)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            members = front_values[mid][:front_sizes[mid]]
+            # members come first in the order so are at least as high on the first metric already,
+            # one at least as high on the others dominates the row unless they are identical
+            dominating = members[(members[:, 1:] >= row[1:]).all(axis=1)]
+            if (dominating != row).any():
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(front_values):
+            front_values.append(np.empty((16, values.shape[1])))
+            front_sizes.append(0)
+        elif front_sizes[lo] == len(front_values[lo]):
+            front_values[lo] = np.concatenate([front_values[lo], np.empty_like(front_values[lo])])
+        front_values[lo][front_sizes[lo]] = row
+        front_sizes[lo] += 1
+        front[i] = lo + 1
+    return front
+
+def pareto_ranking(facts, keeps):
+    """
+    Rank routes across the pain point metrics (PARETO_METRICS) of the route fact table, keeps are the boolean
+    masks of the routes kept per dataset; any route kept in one of the datasets is ranked and metrics a route
+    has no kept data for count as lowest
+    Routes are ordered by Pareto front, then by their mean percentile over the metrics
+    Return pandas dataframe of ranked routes
+    """
+    rows = np.logical_or.reduce([keeps[dataset] for dataset, col in PARETO_METRICS])
+    ranked = fact_routes(facts, rows, [])
+    for dataset, col in PARETO_METRICS:
+        ranked[col] = facts['{0}__{1}'.format(dataset, col)].where(keeps[dataset]).values[rows]
+
+    metrics = ranked[[col for key, col in PARETO_METRICS]]
+    ranked['pareto_front'] = pareto_fronts(metrics.values.astype(float))
+    ranked['pareto_score'] = np.nan_to_num(metrics.rank(pct=True).values).mean(axis=1)
+    ranked = ranked.sort_values(['pareto_front', 'pareto_score'], ascending=[True, False], kind='mergesort')
+    ranked['pareto_rank'] = np.arange(1, len(ranked) + 1)
+    return ranked
+
+def save_pareto_table(ranked, fname):
+    """Write the ranked pain point skyline table (rank, front, route and its metrics) to csv"""
+    cols = ['pareto_rank', 'pareto_front', 'pareto_score', 'route_id', 'orig_code', 'orig_name', 'orig_city',
+            'dest_code', 'dest_name', 'dest_city'] + [col for key, col in PARETO_METRICS]
+    ranked[cols].to_csv(fname, index=False, float_format='%.4f')
+    print('wrote {0} ranked routes to {1}'.format(len(ranked), fname))
+
+def load_routes(input_dir, amtrak_input_dir, months, monthly_flights, monthly_passengers):
+    """
+    Load the aggregated route and Amtrak datasets for one period,
+    cut them down to consistently traveled routes and pick the top routes per metric
+    Return dict of pandas dataframes keyed by map layer
+    """
+    # load data (one route fact table, every route dataset's columns side by side)
+    facts = read_route_facts(input_dir)
     amtrak_plus = pd.read_csv('{0}/amtrak_plus.csv'.format(amtrak_input_dir))
     amtrak_plus_delays_only = amtrak_plus.loc[~pd.isnull(amtrak_plus['delay_avg'])]
-    flyer_class_routes = pd.read_csv('{0}/flyer_class_routes.csv'.format(input_dir))
-    flyer_stopover_routes = pd.read_csv('{0}/flyer_stopover_routes.csv'.format(input_dir))
 
-    # light cut to ensure consistently traveled routes
-    flight_cut = args.monthly_flights * months
-    pass_cut = args.monthly_passengers * months
+    # light cut to ensure consistently traveled routes (routes a dataset doesn't cover are never kept)
+    flight_cut = monthly_flights * months
+    pass_cut = monthly_passengers * months
+    keeps = {}
     ## delay (ot = on time)
-    ot_routes0 = aircraft_delay_routes.loc[aircraft_delay_routes['Flight_Count'] > flight_cut]
+    keeps['aircraft_delay'] = (facts['aircraft_delay__Flight_Count'].astype(float) > flight_cut).values
     ## occupancy (occ)
-    occ_routes0 = aircraft_occupancy_routes.loc[aircraft_occupancy_routes['DEPARTURES_PERFORMED_sum'] > flight_cut]
+    keeps['aircraft_occupancy'] = (facts['aircraft_occupancy__DEPARTURES_PERFORMED_sum'].astype(float) > flight_cut).values
     ## class (cl); 0.1 factor because data is 10% sample of all tickets
-    cl_routes = flyer_class_routes.loc[flyer_class_routes['PASSENGERS_sum'] > pass_cut * 0.1]
+    keeps['flyer_class'] = (facts['flyer_class__PASSENGERS_sum'].astype(float) > pass_cut * 0.1).values
     ## stopover (so); 0.1 factor because data is 10% sample of all tickets
-    so_routes = flyer_stopover_routes.loc[flyer_stopover_routes['PASSENGERS_sum'] > pass_cut * 0.1]
+    keeps['flyer_stopover'] = (facts['flyer_stopover__PASSENGERS_sum'].astype(float) > pass_cut * 0.1).values
+    cl_routes = fact_routes(facts, keeps['flyer_class'], ['flyer_class'])
+    so_routes = fact_routes(facts, keeps['flyer_stopover'], ['flyer_stopover'])
 
     # add in fare class data to delay and occupancy data to show where available
-    cl_routes_cols = ['class_bf_frac',
-                      'orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon',
-                      'dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']
-    ot_routes_cl = pd.merge(ot_routes0, cl_routes[cl_routes_cols],
-                            on=['orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon',
-                                'dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon'],
-                            how='left')
-    ot_routes_cols = list(ot_routes0.columns) + ['class_bf_frac']
-    ot_routes = ot_routes_cl[ot_routes_cols]
-    ot_routes['class_bf_frac'].fillna('no data', inplace=True)
-
-    occ_routes_cl = pd.merge(occ_routes0, cl_routes[cl_routes_cols],
-                             on=['orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon',
-                                 'dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon'],
-                             how='left')
-    occ_routes_cols = list(occ_routes0.columns) + ['class_bf_frac']
-    occ_routes = occ_routes_cl[occ_routes_cols]
-    occ_routes['class_bf_frac'].fillna('no data', inplace=True)
+    ## (class_bf_frac stays NaN where there is no class data)
+    class_bf_frac = facts['flyer_class__class_bf_frac'].where(keeps['flyer_class'])
+    ot_routes = fact_routes(facts, keeps['aircraft_delay'], ['aircraft_delay'])
+    ot_routes['class_bf_frac'] = class_bf_frac.values[keeps['aircraft_delay']]
+
+    occ_routes = fact_routes(facts, keeps['aircraft_occupancy'], ['aircraft_occupancy'])
+    occ_routes['class_bf_frac'] = class_bf_frac.values[keeps['aircraft_occupancy']]
 
     # top route cuts per metric
     ot_routes_20 = ot_routes.sort_values(['AirlineDelay_20frac'], ascending=False).iloc[:20]
@@ -123,704 +493,521 @@ if __name__ == '__main__':
     so_routes_20 = so_routes.sort_values(['stopover_frac'], ascending=False).iloc[:20]
     so_routes_40 = so_routes.sort_values(['stopover_frac'], ascending=False).iloc[:40]
 
-    # find overlapping routes in above datasets
+    # find overlapping routes in above datasets, fact table rows in the first dataset's top route order
     ## ot + occ
-    ot_occ_routes = pd.merge(ot_routes_40, occ_routes_40,
-                             on=['orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon',
-                                 'dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon'],
-                             how='inner')
-    ot_occ_routes.rename(columns={'class_bf_frac_x': 'class_bf_frac'}, inplace=True)
+    ot_occ_rows = ot_routes_40.index[ot_routes_40.index.isin(occ_routes_40.index)]
+    ot_occ_routes = fact_routes(facts, ot_occ_rows, ['aircraft_delay', 'aircraft_occupancy'])
+    ot_occ_routes['class_bf_frac'] = class_bf_frac[ot_occ_rows].values
     ## ot + cl
-    ot_cl_routes = pd.merge(ot_routes_40, cl_routes_40,
-                            on=['orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon',
-                                'dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon'],
-                            how='inner')
-    ot_cl_routes.rename(columns={'class_bf_frac_x': 'class_bf_frac'}, inplace=True)
+    ot_cl_rows = ot_routes_40.index[ot_routes_40.index.isin(cl_routes_40.index)]
+    ot_cl_routes = fact_routes(facts, ot_cl_rows, ['aircraft_delay', 'flyer_class'])
     ## occ + cl
-    occ_cl_routes = pd.merge(occ_routes_40, cl_routes_40,
-                             on=['orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon',
-                                 'dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon'],
-                             how='inner')
-    occ_cl_routes.rename(columns={'class_bf_frac_x': 'class_bf_frac',
-                                  'PASSENGERS_sum_x': 'PASSENGERS_sum',
-                                  'DISTANCE_mean_x': 'DISTANCE_mean'}, inplace=True)
+    occ_cl_rows = occ_routes_40.index[occ_routes_40.index.isin(cl_routes_40.index)]
+    occ_cl_routes = fact_routes(facts, occ_cl_rows, ['aircraft_occupancy', 'flyer_class'])
     ## ot + occ + cl
-    ot_occ_cl_routes = pd.merge(ot_occ_routes, cl_routes_40,
-                                on=['orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon',
-                                    'dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon'],
-                                how='inner')
-    ot_occ_cl_routes.rename(columns={'class_bf_frac_x': 'class_bf_frac',
-                                     'PASSENGERS_sum_x': 'PASSENGERS_sum',
-                                     'DISTANCE_mean_x': 'DISTANCE_mean'}, inplace=True)
-
-    # create map -- A lot of code! but just iterating on the same block for the 10 groups below
-    la_coords = [43, -118] # center map on LA
-    m = folium.Map(location=la_coords, zoom_start=5, tiles='stamentoner')
-    # groups for layers
-    g1 = folium.FeatureGroup(name='Airline Delays (top 20 routes)')
-    g2 = folium.FeatureGroup(name='Aircraft Occupancy (top 20 routes)')
-    g3 = folium.FeatureGroup(name='First/Business Class (top 20 routes)')
-    g4 = folium.FeatureGroup(name='Stopovers (top 20 routes)')
-    g5 = folium.FeatureGroup(name='Amtrak Stations and Nearest Airports')
-    g6 = folium.FeatureGroup(name='Amtrak Delays (top 20 stations)')
-    g7 = folium.FeatureGroup(name='Airline Delays & Occupancy (in top 40 of each)')
-    g8 = folium.FeatureGroup(name='Airline Delays & First/Business (in top 40 of each)')
-    g9 = folium.FeatureGroup(name='Occupancy & First/Business (in top 40 of each)')
-    g10 = folium.FeatureGroup(name='Airline Delays & Occupancy & First/Business (in top 40 of each)')
-
-    ############# Airline Delays (top 20 routes) #############
-    orig_list = []
-    dest_no_orig_list = []
-    orig_dest_list = []
-    # get origin airport data to plot
-    for row in ot_routes_20.iterrows():
-        origin, orig_name, orig_city, orig_lat, orig_lon = row[1][
-            ['orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon']]
-        dest, dest_name, dest_city, dest_lat, dest_lon = row[1][
-            ['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']]
-        delay_mean_route, delay_20pct_route, flight_count_route = row[1][['AirlineDelay_mean',
-                                                                          'AirlineDelay_20frac', 'Flight_Count']]
-        dist_mean_route, airtime_mean_route, elapsed_mean_route = row[1][['Distance_mean', 'AirTime_mean',
-                                                                          'ActualElapsedTime_mean']]
-        bf_frac = row[1][['class_bf_frac']]
-        try:
-            bf_pct = '{0:.1f}%'.format(float(bf_frac) * 100)
-        except:
-            bf_pct = 'no data for'
+    ot_occ_cl_rows = ot_occ_rows[ot_occ_rows.isin(cl_routes_40.index)]
+    ot_occ_cl_routes = fact_routes(facts, ot_occ_cl_rows, ['aircraft_delay', 'aircraft_occupancy', 'flyer_class'])
 
-        # only 1 marker per airport
-        if origin not in orig_list:
-            html = """{0} {1}<BR>{2}""".format(origin, orig_name, orig_city)
-            iframe = folium.element.IFrame(html=html, width=300, height=150)
-            popup = folium.Popup(iframe, max_width=1000)
-            g2.add_child(folium.Marker([orig_lat, orig_lon], popup=popup))
-            orig_list.append(origin)
+    # time of day delay profiles of the routes in the delay layers
+    for routes in [ot_routes_20, ot_occ_routes, ot_cl_routes, ot_occ_cl_routes]:
+        routes['tod_profile'] = tod_profile_html(input_dir, routes['route_id'])
 
-        # plot straight line for route from orig to dest
-        g1.add_child(
-            folium.PolyLine([[float(orig_lat), float(orig_lon)], [float(dest_lat), float(dest_lon)]], color='green',
-                            weight=3))
-
-        # plot marker in center of route with route stats(perturb lon coord if out and back routes both included)
-        if set([orig_name, dest_name]) not in orig_dest_list:
-            p = 0
-        else:
-            p = .2
-        route_lat, route_lon = midpoint(orig_lat, orig_lon, dest_lat, dest_lon)
-        html = """{0} {1}<BR>to<BR>{2} {3}<BR><BR><font color="green">{4}</font> Total Flights<BR><BR>""" \
-               """{5} mi<BR>{6:.1f} min. avg. Air Time<BR>{7:.1f} min. avg. Elapsed Gate to Gate<BR><BR>""" \
-               """<font color="green">{8}</font> First/Business Flyers (from 10% sample of domestic tickets)<BR><BR>""" \
-               """<font color="red">{9:.1f}%</font> Aircraft Delay > 20 min<BR>""" \
-               """<font color="red">{10} min.</font> avg. Aircraft Delay time for non-weather and non-airport ops delays""".format(
-            origin,
-            orig_city, dest, dest_city, flight_count_route, int(dist_mean_route), airtime_mean_route,
-            elapsed_mean_route,
-            bf_pct, delay_20pct_route * 100, int(delay_mean_route))
-        iframe = folium.element.IFrame(html=html, width=300, height=400)
-        popup = folium.Popup(iframe, max_width=1000)
-        g1.add_child(folium.Marker([route_lat, route_lon + p], popup=popup,
-                                   icon=folium.Icon(color='green')))
-        orig_dest_list.append(set([orig_name, dest_name]))
+    # routes no other route beats on every metric, over all consistently traveled routes
+    pareto_ranked = pareto_ranking(facts, keeps)
+    pareto_routes = pareto_ranked.loc[pareto_ranked['pareto_front'] == 1]
 
-    # get dest airports with no returns in data (not an origin)
-    for row in ot_routes_20.iterrows():
-        dest, dest_name, dest_city, dest_lat, dest_lon = row[1][
-            ['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']]
-        if dest not in orig_list:
-            html = """{0} {1}<BR>{2}""".format(dest, dest_name, dest_city)
-            iframe = folium.element.IFrame(html=html, width=300, height=100)
-            popup = folium.Popup(iframe, max_width=1000)
-            g1.add_child(folium.Marker([dest_lat, dest_lon], popup=popup))
-            dest_no_orig_list.append([dest, dest_name, dest_city])
+    return {'ot': ot_routes_20, 'occ': occ_routes_20, 'cl': cl_routes_20, 'so': so_routes_20,
+            'amtrak': amtrak_plus, 'amtrak_delays': ot_amtrak_20,
+            'ot_occ': ot_occ_routes, 'ot_cl': ot_cl_routes, 'occ_cl': occ_cl_routes,
+            'ot_occ_cl': ot_occ_cl_routes, 'pareto': pareto_routes, 'pareto_ranked': pareto_ranked}
 
-    ############# Aircraft Occupancy (top 20 routes) #############
-    orig_list = []
-    dest_no_orig_list = []
-    orig_dest_list = []
+def route_layer_records(routes, route_html, height, p, geometry_cache):
+    """
+    Markers and lines for one route layer, shared by the folium map and the multi-period data scripts
+    Routes are drawn as great-circle arcs with their stat marker at the arc's midpoint
+    Return dict with airport markers [lat, lon, html, popup height] and routes {line, marker, html, height}
+    """
+    airports = []
+    airport_list = []
+    route_records = []
+    # rounded to ~1 m
+    arcs = route_arcs(routes, p, geometry_cache).round(5).tolist()
+    orig_cols = [routes[col].values for col in ['orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon']]
+    dest_cols = [routes[col].values for col in ['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']]
     # get origin airport data to plot
-    for row in occ_routes_20.iterrows():
-        origin, orig_name, orig_city, orig_lat, orig_lon = row[1][
-            ['orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon']]
-        dest, dest_name, dest_city, dest_lat, dest_lon = row[1][
-            ['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']]
-        passenger_sum, occupancy_mean, departures_sum = row[1][
-            ['PASSENGERS_sum', 'occupancy_mean', 'DEPARTURES_PERFORMED_sum']]
-        dist_mean_route = row[1]['DISTANCE_mean']
-        bf_frac = row[1][['class_bf_frac']]
-        try:
-            bf_pct = '{0:.1f}%'.format(float(bf_frac) * 100)
-        except:
-            bf_pct = 'no data for'
+    for (origin, orig_name, orig_city, orig_lat, orig_lon), arc, route_html_txt \
+            in zip(zip(*orig_cols), arcs, route_html(routes)):
 
         # only 1 marker per airport
-        if origin not in orig_list:
+        if origin not in airport_list:
             html = """{0} {1}<BR>{2}""".format(origin, orig_name, orig_city)
-            iframe = folium.element.IFrame(html=html, width=300, height=150)
-            popup = folium.Popup(iframe, max_width=1000)
-            g2.add_child(folium.Marker([orig_lat, orig_lon], popup=popup))
-            orig_list.append(origin)
+            airports.append([float(orig_lat), float(orig_lon), html, 150])
+            airport_list.append(origin)
 
-        # plot straight line for route from orig to dest
-        g2.add_child(
-            folium.PolyLine([[float(orig_lat), float(orig_lon)], [float(dest_lat), float(dest_lon)]], color='green',
-                            weight=3))
-
-        # plot marker in center of route with route stats (perturb lon coord if out and back routes both included)
-        if set([orig_name, dest_name]) not in orig_dest_list:
-            p = 0
-        else:
-            p = .3
-        route_lat, route_lon = midpoint(orig_lat, orig_lon, dest_lat, dest_lon)
-        html = """{0} {1}<BR>to<BR>{2} {3}<BR><BR>""" \
-               """<font color="green">{4}</font> Total Passengers<BR>""" \
-               """<font color="green">{5}</font> Total Departures<BR>{6} mi<BR><Br>""" \
-               """<font color="green">{7}</font> First/Business Flyers (from 10% sample of domestic tickets)<BR><BR>""" \
-               """<font color="red">{8:.1f}%</font> avg. Occupancy<BR><BR>""".format(origin,
-                                                                                     orig_city, dest, dest_city,
-                                                                                     int(passenger_sum),
-                                                                                     int(departures_sum),
-                                                                                     int(dist_mean_route), bf_pct,
-                                                                                     occupancy_mean * 100)
-        iframe = folium.element.IFrame(html=html, width=300, height=250)
-        popup = folium.Popup(iframe, max_width=1000)
-        g2.add_child(folium.Marker([route_lat, route_lon + p], popup=popup,
-                                   icon=folium.Icon(color='green')))
-        orig_dest_list.append(set([orig_name, dest_name]))
+        # marker in center of route with route stats
+        route_records.append({'line': arc,
+                              'marker': arc[ARC_POINTS // 2],
+                              'html': route_html_txt,
+                              'height': height})
 
     # get dest airports with no returns in data (not an origin)
-    for row in occ_routes_20.iterrows():
-        dest, dest_name, dest_city, dest_lat, dest_lon = row[1][
-            ['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']]
-        if dest not in orig_list:
+    for dest, dest_name, dest_city, dest_lat, dest_lon in zip(*dest_cols):
+        if dest not in airport_list:
             html = """{0} {1}<BR>{2}""".format(dest, dest_name, dest_city)
-            iframe = folium.element.IFrame(html=html, width=300, height=100)
-            popup = folium.Popup(iframe, max_width=1000)
-            g2.add_child(folium.Marker([dest_lat, dest_lon], popup=popup))
-            dest_no_orig_list.append([dest, dest_name, dest_city])
-
-    ############# First/Business Class (top 20 routes) #############
-    orig_list = []
-    dest_no_orig_list = []
-    orig_dest_list = []
-    # get origin airport data to plot
-    for row in cl_routes_20.iterrows():
-        origin, orig_name, orig_city, orig_lat, orig_lon = row[1][
-            ['orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon']]
-        dest, dest_name, dest_city, dest_lat, dest_lon = row[1][
-            ['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']]
-        passenger_sum, dist_mean_route = row[1][['PASSENGERS_sum', 'DISTANCE_mean']]
-        class_bf, class_c = row[1][['class_bf_frac', 'class_c_frac']]
-
-        # only 1 marker per airport
-        if origin not in orig_list:
-            html = """{0} {1}<BR>{2}""".format(origin, orig_name, orig_city)
-            iframe = folium.element.IFrame(html=html, width=300, height=150)
-            popup = folium.Popup(iframe, max_width=1000)
-            g3.add_child(folium.Marker([orig_lat, orig_lon], popup=popup))
-            orig_list.append(origin)
-
-        # plot straight line for route from orig to dest
-        g3.add_child(
-            folium.PolyLine([[float(orig_lat), float(orig_lon)], [float(dest_lat), float(dest_lon)]], color='green',
-                            weight=3))
-
-        # plot marker in center of route with route stats(perturb lon coord if out and back routes both included)
-        if set([orig_name, dest_name]) not in orig_dest_list:
-            p = 0
-        else:
-            p = .2
-        route_lat, route_lon = midpoint(orig_lat, orig_lon, dest_lat, dest_lon)
-        html = """{0} {1}<BR>to<BR>{2} {3}<BR><BR>""" \
-               """ (10% sample of domestic tickets)<Br><font color="green">{4}</font> Total Passengers<BR>""" \
-               """{5} mi<BR><Br>""" \
-               """<font color="green">{6:.1f}%</font> First/Business Flyers<BR>{7:.1f}% Coach Flyers""".format(origin,
-                                                                                                               orig_city,
-                                                                                                               dest,
-                                                                                                               dest_city,
-                                                                                                               int(
-                                                                                                                   passenger_sum),
-                                                                                                               int(
-                                                                                                                   dist_mean_route),
-                                                                                                               class_bf * 100,
-                                                                                                               class_c * 100)
-        iframe = folium.element.IFrame(html=html, width=300, height=250)
+            airports.append([float(dest_lat), float(dest_lon), html, 100])
+            airport_list.append(dest)
+
+    return {'airports': airports, 'routes': route_records}
+
+def period_layer_records(period_routes, geometry_cache):
+    """Return dict of route layer records keyed by map layer for one period"""
+    records = {}
+    for key, name, html_func, height, p in ROUTE_LAYERS:
+        records[key] = route_layer_records(period_routes[key], globals()[html_func], height, p, geometry_cache)
+    return records
+
+def add_route_layer(group, records):
+    """Plot route layer records (airport markers, route lines and route stat markers) on a folium group"""
+    for lat, lon, html, height in records['airports']:
+        iframe = folium.element.IFrame(html=html, width=300, height=height)
         popup = folium.Popup(iframe, max_width=1000)
-        g3.add_child(folium.Marker([route_lat, route_lon + p], popup=popup,
-                                   icon=folium.Icon(color='green')))
-        orig_dest_list.append(set([orig_name, dest_name]))
-
-        # get dest airports with no returns in data (not an origin)
-    for row in cl_routes_20.iterrows():
-        dest, dest_name, dest_city, dest_lat, dest_lon = row[1][
-            ['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']]
-        if dest not in orig_list:
-            html = """{0} {1}<BR>{2}""".format(dest, dest_name, dest_city)
-            iframe = folium.element.IFrame(html=html, width=300, height=100)
-            popup = folium.Popup(iframe, max_width=1000)
-            g3.add_child(folium.Marker([dest_lat, dest_lon], popup=popup))
-            dest_no_orig_list.append([dest, dest_name, dest_city])
-
-    ############# Stopovers (top 20 routes) #############
-    orig_list = []
-    dest_no_orig_list = []
-    orig_dest_list = []
-    # get origin airport data to plot
-    for row in so_routes_20.iterrows():
-        origin, orig_name, orig_city, orig_lat, orig_lon = row[1][
-            ['orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon']]
-        dest, dest_name, dest_city, dest_lat, dest_lon = row[1][
-            ['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']]
-        passenger_sum, approx_dist = row[1][['PASSENGERS_sum', 'dist_calc']]
-        so_frac, no_so_frac, so_airports = row[1][['stopover_frac', 'no_stopover_frac', 'stopover_airports_clean']]
-
-        # only 1 marker per airport
-        if origin not in orig_list:
-            html = """{0} {1}<BR>{2}""".format(origin, orig_name, orig_city)
-            iframe = folium.element.IFrame(html=html, width=300, height=150)
-            popup = folium.Popup(iframe, max_width=1000)
-            g4.add_child(folium.Marker([orig_lat, orig_lon], popup=popup))
-            orig_list.append(origin)
+        group.add_child(folium.Marker([lat, lon], popup=popup))
 
+    for route in records['routes']:
         # plot straight line for route from orig to dest
-        g4.add_child(
-            folium.PolyLine([[float(orig_lat), float(orig_lon)], [float(dest_lat), float(dest_lon)]], color='green',
-                            weight=3))
-
-        # plot marker in center of route with route stats(perturb lon coord if out and back routes both included)
-        if set([orig_name, dest_name]) not in orig_dest_list:
-            p = 0
-        else:
-            p = .2
-        route_lat, route_lon = midpoint(orig_lat, orig_lon, dest_lat, dest_lon)
-        html = """{0} {1}<BR>to<BR>{2} {3}<BR>""" \
-               """~{4} mi<BR><BR>""" \
-               """(10% sample of domestic tickets)<Br><font color="green">{5}</font> Total Passengers<BR><BR>""" \
-               """<font color="red">{6:.1f}%</font> stopovers<BR>(through {7})""".format(origin,
-                                                                                         orig_city, dest, dest_city,
-                                                                                         int(approx_dist),
-                                                                                         int(passenger_sum),
-                                                                                         so_frac * 100, so_airports)
-        iframe = folium.element.IFrame(html=html, width=300, height=250)
-        popup = folium.Popup(iframe, max_width=1000)
-        g4.add_child(folium.Marker([route_lat, route_lon + p], popup=popup,
-                                   icon=folium.Icon(color='green')))
-        orig_dest_list.append(set([orig_name, dest_name]))
-
-        # get dest airports with no returns in data (not an origin)
-    for row in so_routes_20.iterrows():
-        dest, dest_name, dest_city, dest_lat, dest_lon = row[1][
-            ['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']]
-        if dest not in orig_list:
-            html = """{0} {1}<BR>{2}""".format(dest, dest_name, dest_city)
-            iframe = folium.element.IFrame(html=html, width=300, height=100)
-            popup = folium.Popup(iframe, max_width=1000)
-            g4.add_child(folium.Marker([dest_lat, dest_lon], popup=popup))
-            dest_no_orig_list.append([dest, dest_name, dest_city])
-
-    ############# Amtrak Stations and Nearest Airports #############
-    a_list = []
-    # get origin airport data to plot
-    for row in amtrak_plus.iterrows():
-        t_city, t_code, users, t_delay_avg, t_lat, t_lon = row[1][['city_caps', 'code', 'Users', 'delay_avg', 'lat', 'lon']]
-        a1_code, a1_name, a1_city, a1_dist, a1_lat, a1_lon = row[1][
-            ['closest_a1_code', 'closest_a1_name', 'closest_a1_city', 'closest_a1_dist', 'closest_a1_lat', 'closest_a1_lon']]
-        a2_code, a2_name, a2_city, a2_dist, a2_lat, a2_lon = row[1][
-            ['closest_a2_code', 'closest_a2_name', 'closest_a2_city', 'closest_a2_dist', 'closest_a2_lat', 'closest_a2_lon']]
-        try:
-            users_txt = int(users)
-        except:
-            users_txt = 'no data for'
-        try:
-            delay_txt = int(t_delay_avg)
-        except:
-            delay_txt = 'no data for'
-        else:
-            delay_txt = '{0} min'.format(int(t_delay_avg))
-
-        #print(t_city, t_code, users_txt, delay_txt, a1_name, a1_city, int(a1_dist), a2_name, a2_city, int(a2_dist))
-
-        # plot Amtrak station, users, delay, and nearest airport info
-        html = """{0} {1} Amtrak Station<BR>""" \
-               """<font color="green">{2}</font> 2016 users<BR>""" \
-               """<font color="red">{3}</font> avg. delay in 2016<BR><BR>""" \
-               """Nearest airport is {4}, {5}<BR>{6} mi away<BR><BR>""" \
-               """Next nearest airport is {7}, {8}<BR>{9} mi away""".format(t_city, t_code,
-                                                                            users_txt, delay_txt,
-                                                                            a1_name,
-                                                                            a1_city, int(a1_dist),
-                                                                            a2_name,
-                                                                            a2_city, int(a2_dist))
-        iframe = folium.element.IFrame(html=html, width=300, height=250)
-        popup = folium.Popup(iframe, max_width=1000)
-        g5.add_child(folium.Marker([t_lat, t_lon], popup=popup,
-                                   icon=folium.Icon(color='red')))
-
-        # plot thin line from Amtrak station to 2 closest airports
-        g5.add_child(
-            folium.PolyLine([[float(t_lat), float(t_lon)], [float(a1_lat), float(a1_lon)]], color='red', weight=2))
-        g5.add_child(
-            folium.PolyLine([[float(t_lat), float(t_lon)], [float(a2_lat), float(a2_lon)]], color='red', weight=2))
-
-        html = """{0} {1}<BR>{2}""".format(a1_code, a1_name, a1_city)
-        iframe = folium.element.IFrame(html=html, width=300, height=250)
-        popup = folium.Popup(iframe, max_width=1000)
-        if a1_name not in a_list:
-            g5.add_child(folium.Marker([a1_lat, a1_lon], popup=popup,
-                                       icon=folium.Icon()))
-
-        html = """{0} {1}<BR>{2}""".format(a2_code, a2_name, a2_city)
-        iframe = folium.element.IFrame(html=html, width=300, height=250)
+        group.add_child(folium.PolyLine(route['line'], color='green', weight=3))
+        iframe = folium.element.IFrame(html=route['html'], width=300, height=route['height'])
         popup = folium.Popup(iframe, max_width=1000)
-        if a2_name not in a_list:
-            g5.add_child(folium.Marker([a2_lat, a2_lon], popup=popup,
-                                       icon=folium.Icon()))
-        a_list.append(a1_name)
-        a_list.append(a2_name)
+        group.add_child(folium.Marker(route['marker'], popup=popup,
+                                      icon=folium.Icon(color='green')))
 
-    ############# Amtrak Delays (top 20 stations) #############
+def add_amtrak_layer(group, stations):
+    """Plot Amtrak stations with lines to their 2 nearest airports on a folium group"""
     a_list = []
-    # get origin airport data to plot
-    for row in ot_amtrak_20.iterrows():
-        t_city, t_code, users, t_delay_avg, t_lat, t_lon = row[1][['city_caps', 'code', 'Users', 'delay_avg', 'lat', 'lon']]
-        a1_code, a1_name, a1_city, a1_dist, a1_lat, a1_lon = row[1][
-            ['closest_a1_code', 'closest_a1_name', 'closest_a1_city', 'closest_a1_dist', 'closest_a1_lat',
-             'closest_a1_lon']]
-        a2_code, a2_name, a2_city, a2_dist, a2_lat, a2_lon = row[1][
-            ['closest_a2_code', 'closest_a2_name', 'closest_a2_city', 'closest_a2_dist', 'closest_a2_lat',
-             'closest_a2_lon']]
-        try:
-            users_txt = int(users)
-        except:
-            users_txt = 'no data for'
+    station_cols = [stations[col].values for col in ['lat', 'lon']]
+    a1_cols = [stations[col].values for col in
+               ['closest_a1_code', 'closest_a1_name', 'closest_a1_city', 'closest_a1_lat', 'closest_a1_lon']]
+    a2_cols = [stations[col].values for col in
+               ['closest_a2_code', 'closest_a2_name', 'closest_a2_city', 'closest_a2_lat', 'closest_a2_lon']]
+    for (t_lat, t_lon), (a1_code, a1_name, a1_city, a1_lat, a1_lon), (a2_code, a2_name, a2_city, a2_lat, a2_lon), station_html \
+            in zip(zip(*station_cols), zip(*a1_cols), zip(*a2_cols), amtrak_station_html(stations)):
 
         # plot Amtrak station, users, delay, and nearest airport info
-        html = """{0} {1} Amtrak Station<BR>""" \
-               """<font color="green">{2}</font> 2016 users<BR>""" \
-               """<font color="red">{3} min.</font> avg. delay in 2016<BR><BR>""" \
-               """Nearest airport is {4}, {5}<BR>{6} mi away<BR><BR>""" \
-               """Next nearest airport is {7}, {8}<BR>{9} mi away""".format(t_city, t_code,
-                                                                            users_txt, t_delay_avg,
-                                                                            a1_name,
-                                                                            a1_city, int(a1_dist),
-                                                                            a2_name,
-                                                                            a2_city, int(a2_dist))
-        iframe = folium.element.IFrame(html=html, width=300, height=250)
+        iframe = folium.element.IFrame(html=station_html, width=300, height=250)
         popup = folium.Popup(iframe, max_width=1000)
-        g6.add_child(folium.Marker([t_lat, t_lon], popup=popup,
-                                   icon=folium.Icon(color='red')))
+        group.add_child(folium.Marker([t_lat, t_lon], popup=popup,
+                                      icon=folium.Icon(color='red')))
 
         # plot thin line from Amtrak station to 2 closest airports
-        g6.add_child(
+        group.add_child(
             folium.PolyLine([[float(t_lat), float(t_lon)], [float(a1_lat), float(a1_lon)]], color='red', weight=2))
-        g6.add_child(
+        group.add_child(
             folium.PolyLine([[float(t_lat), float(t_lon)], [float(a2_lat), float(a2_lon)]], color='red', weight=2))
 
-        html = """{0} {1}<BR>{2}""".format(a1_code, a1_name, a1_city)
-        iframe = folium.element.IFrame(html=html, width=300, height=250)
-        popup = folium.Popup(iframe, max_width=1000)
         if a1_name not in a_list:
-            g6.add_child(folium.Marker([a1_lat, a1_lon], popup=popup,
-                                       icon=folium.Icon()))
-
-        html = """{0} {1}<BR>{2}""".format(a2_code, a2_name, a2_city)
-        iframe = folium.element.IFrame(html=html, width=300, height=250)
-        popup = folium.Popup(iframe, max_width=1000)
+            html = """{0} {1}<BR>{2}""".format(a1_code, a1_name, a1_city)
+            iframe = folium.element.IFrame(html=html, width=300, height=250)
+            popup = folium.Popup(iframe, max_width=1000)
+            group.add_child(folium.Marker([a1_lat, a1_lon], popup=popup,
+                                          icon=folium.Icon()))
         if a2_name not in a_list:
-            g6.add_child(folium.Marker([a2_lat, a2_lon], popup=popup,
-                                       icon=folium.Icon()))
+            html = """{0} {1}<BR>{2}""".format(a2_code, a2_name, a2_city)
+            iframe = folium.element.IFrame(html=html, width=300, height=250)
+            popup = folium.Popup(iframe, max_width=1000)
+            group.add_child(folium.Marker([a2_lat, a2_lon], popup=popup,
+                                          icon=folium.Icon()))
         a_list.append(a1_name)
         a_list.append(a2_name)
 
-    ############# Airline Delays & Occupancy (in top 40 of each) #############
-    orig_list = []
-    dest_no_orig_list = []
-    orig_dest_list = []
-    # get origin airport data to plot
-    for row in ot_occ_routes.iterrows():
-        origin, orig_name, orig_city, orig_lat, orig_lon = row[1][
-            ['orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon']]
-        dest, dest_name, dest_city, dest_lat, dest_lon = row[1][
-            ['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']]
-        delay_mean_route, delay_20pct_route, flight_count_route = row[1][['AirlineDelay_mean',
-                                                                          'AirlineDelay_20frac', 'Flight_Count']]
-        airtime_mean_route, elapsed_mean_route = row[1][['AirTime_mean', 'ActualElapsedTime_mean']]
-        passenger_sum, occupancy_mean, departures_sum = row[1][
-            ['PASSENGERS_sum', 'occupancy_mean', 'DEPARTURES_PERFORMED_sum']]
-        dist_mean_route = row[1][['DISTANCE_mean']]
-
-        bf_frac = row[1][['class_bf_frac']]
-        try:
-            bf_pct = '{0:.1f}%'.format(float(bf_frac) * 100)
-        except:
-            bf_pct = 'no data for'
-
-        # only 1 marker per airport
-        if origin not in orig_list:
-            html = """{0} {1}<BR>{2}""".format(origin, orig_name, orig_city)
-            iframe = folium.element.IFrame(html=html, width=300, height=150)
-            popup = folium.Popup(iframe, max_width=1000)
-            g7.add_child(folium.Marker([orig_lat, orig_lon], popup=popup))
-            orig_list.append(origin)
-
-        # plot straight line for route from orig to dest
-        g7.add_child(
-            folium.PolyLine([[float(orig_lat), float(orig_lon)], [float(dest_lat), float(dest_lon)]], color='green',
-                            weight=3))
-
-        # plot marker in center of route with route stats(perturb lon coord if out and back routes both included)
-        if set([orig_name, dest_name]) not in orig_dest_list:
-            p = 0
-        else:
-            p = .2
-        route_lat, route_lon = midpoint(orig_lat, orig_lon, dest_lat, dest_lon)
-        html = """{0} {1}<BR>to<BR>{2} {3}<BR><BR><font color="green">{4}</font> Total Flights (delay data)<BR>""" \
-               """<font color="green">{5}</font> Total Flights (occupancy data)<BR>""" \
-               """<font color="green">{6}</font> Total Passengers (occupancy data)<BR>""" \
-               """{7} mi<BR>{8:.1f} min. avg. Air Time<BR>{9:.1f} min. avg. Elapsed Gate to Gate<BR><BR>""" \
-               """<font color="green">{10}</font> First/Business Flyers (from 10% sample of domestic tickets)<BR><BR>""" \
-               """<font color="red">{11:.1f}%</font> Aircraft Delay > 20 min<BR>""" \
-               """<font color="red">{12} min.</font> avg. Aircraft Delay time for non-weather and non-airport ops delays<BR><BR>""" \
-               """<font color="red">{13:.1f}%</font> avg. Occupancy""".format(origin,
-                                                                              orig_city, dest, dest_city,
-                                                                              flight_count_route, departures_sum,
-                                                                              passenger_sum,
-                                                                              int(dist_mean_route), airtime_mean_route,
-                                                                              elapsed_mean_route, bf_pct,
-                                                                              delay_20pct_route * 100,
-                                                                              int(delay_mean_route),
-                                                                              occupancy_mean * 100)
-        iframe = folium.element.IFrame(html=html, width=300, height=400)
-        popup = folium.Popup(iframe, max_width=1000)
-        g7.add_child(folium.Marker([route_lat, route_lon + p], popup=popup,
-                                   icon=folium.Icon(color='green')))
-        orig_dest_list.append(set([orig_name, dest_name]))
-
-    # get dest airports with no returns in data (not an origin)
-    for row in ot_occ_routes.iterrows():
-        dest, dest_name, dest_city, dest_lat, dest_lon = row[1][
-            ['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']]
-        if dest not in orig_list:
-            html = """{0} {1}<BR>{2}""".format(dest, dest_name, dest_city)
-            iframe = folium.element.IFrame(html=html, width=300, height=100)
-            popup = folium.Popup(iframe, max_width=1000)
-            g7.add_child(folium.Marker([dest_lat, dest_lon], popup=popup))
-            dest_no_orig_list.append([dest, dest_name, dest_city])
+def cached_layer(group, fill, rows, params, funcs, cache_dir, cache_name):
+    """
+    Fill a folium group with one map layer through the fragment cache: the layer's rendered script is
+    keyed by a hash of its input rows, parameters and the code that builds it (plus the folium version),
+    so it is only rendered again when one of those changes
+    fill(group) builds the layer, funcs are the functions whose code the layer depends on
+    """
+    if cache_dir is None:
+        fill(group)
+        return
+
+    key = hashlib.sha1()
+    key.update(pd.util.hash_pandas_object(rows, index=False).values.tobytes())
+    key.update(json.dumps([list(rows.columns), params, folium.__version__]).encode('utf8'))
+    for func in funcs:
+        key.update(inspect.getsource(func).encode('utf8'))
+    path = '{0}/{1}-{2}.js'.format(cache_dir, cache_name, key.hexdigest())
+
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            fragment = f.read().decode('utf8')
+    else:
+        print('rendering {0} layer...'.format(cache_name))
+        sys.stdout.flush()
+        # render the layer on its own, then swap its group name for a placeholder
+        layer = folium.FeatureGroup()
+        fill(layer)
+        figure = folium.element.Figure()
+        figure.add_child(layer)
+        for child in layer._children.values():
+            child.render()
+        fragment = '\n'.join(element.render() for element in figure.script._children.values())
+        fragment = fragment.replace(layer.get_name(), LAYER_GROUP_PLACEHOLDER)
+        # one cached fragment per layer, drop the one it replaces
+        for old_path in glob.glob('{0}/{1}-*.js'.format(cache_dir, cache_name)):
+            os.remove(old_path)
+        with open(path, 'wb') as f:
+            f.write(fragment.encode('utf8'))
+
+    element = folium.element.MacroElement()
+    element._name = 'LayerFragment'
+    element._template = folium.element.Template(LAYER_FRAGMENT_TEMPLATE)
+    element.fragment = fragment.replace(LAYER_GROUP_PLACEHOLDER, group.get_name())
+    group.add_child(element)
+
+def grid_cells(lat, lon, zoom):
+    """
+    Quadtree grid cell (web mercator tile x, y at the zoom level) of each point
+    Return numpy arrays
+    """
+    n = 2 ** zoom
+    lat = np.radians(np.clip(np.asarray(lat, dtype=float), -85.0511, 85.0511))
+    x = np.floor((np.asarray(lon, dtype=float) + 180.) / 360. * n).astype(np.int64)
+    y = np.floor((1. - np.log(np.tan(lat) + 1. / np.cos(lat)) / np.pi) / 2. * n).astype(np.int64)
+    return np.clip(x, 0, n - 1), np.clip(y, 0, n - 1)
 
-    ############# Airline Delays & First/Business (in top 40 of each) #############
-    orig_list = []
-    dest_no_orig_list = []
-    orig_dest_list = []
-    # get origin airport data to plot
-    for row in ot_cl_routes.iterrows():
-        origin, orig_name, orig_city, orig_lat, orig_lon = row[1][
-            ['orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon']]
-        dest, dest_name, dest_city, dest_lat, dest_lon = row[1][
-            ['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']]
-        delay_mean_route, delay_20pct_route, flight_count_route = row[1][['AirlineDelay_mean',
-                                                                          'AirlineDelay_20frac', 'Flight_Count']]
-        dist_mean_route, airtime_mean_route, elapsed_mean_route = row[1][
-            ['Distance_mean', 'AirTime_mean', 'ActualElapsedTime_mean']]
-        bf_frac = row[1][['class_bf_frac']]
-        try:
-            bf_pct = '{0:.1f}%'.format(float(bf_frac) * 100)
-        except:
-            bf_pct = 'no data for'
+def density_points(input_dir, amtrak_input_dir, weight):
+    """
+    Weighted airports from every route endpoint in a route dataset (a route's weight counts at both ends)
+    and Amtrak stations with their ridership
+    Return pandas dataframes of airports (lat, lon, weight) and stations (lat, lon, Users)
+    """
+    dataset, weight_col, frac_col, label = DENSITY_WEIGHTS[weight]
+    facts = read_route_facts(input_dir)
+    routes = fact_routes(facts, facts['has_{0}'.format(dataset)].values, [dataset])
+    route_weight = routes[weight_col].values.astype(float)
+    if frac_col:
+        route_weight = route_weight * routes[frac_col].values
+    codes = np.concatenate([routes['orig_code'].values, routes['dest_code'].values])
+    codes, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+    airports = pd.DataFrame({'lat': np.concatenate([routes['orig_lat'].values, routes['dest_lat'].values])[first],
+                             'lon': np.concatenate([routes['orig_lon'].values, routes['dest_lon'].values])[first],
+                             'weight': np.bincount(inverse, weights=np.concatenate([route_weight, route_weight]))},
+                            index=codes)
+
+    stations = pd.read_csv('{0}/amtrak_plus.csv'.format(amtrak_input_dir))[['lat', 'lon', 'Users']]
+    stations['Users'] = stations['Users'].fillna(0)
+    return airports, stations
+
+def density_cells(airports, stations, zoom):
+    """
+    Bin the weighted airports and Amtrak stations into the quadtree grid at one zoom level
+    Return list of cells [x, y, color index, weight, airports, stations, ridership]
+    """
+    n = 2 ** zoom
+    a_x, a_y = grid_cells(airports['lat'], airports['lon'], zoom)
+    s_x, s_y = grid_cells(stations['lat'], stations['lon'], zoom)
+    cells, inverse = np.unique(np.concatenate([a_x * n + a_y, s_x * n + s_y]), return_inverse=True)
+    a_cell, s_cell = inverse[:len(airports)], inverse[len(airports):]
+    weight = np.bincount(a_cell, weights=airports['weight'].values, minlength=len(cells))
+    airport_count = np.bincount(a_cell, minlength=len(cells))
+    station_count = np.bincount(s_cell, minlength=len(cells))
+    ridership = np.bincount(s_cell, weights=stations['Users'].values, minlength=len(cells))
+
+    # color by weight quintile, cells with only Amtrak stations stay grey
+    color = np.zeros(len(cells), dtype=np.int64)
+    weighted = weight > 0
+    if weighted.any():
+        bounds = np.percentile(weight[weighted], [20, 40, 60, 80])
+        color[weighted] = np.searchsorted(bounds, weight[weighted], side='right') + 1
+
+    return [[int(cell // n), int(cell % n), int(c), int(round(w)), int(a), int(s), int(r)]
+            for cell, c, w, a, s, r in zip(cells, color, weight, airport_count, station_count, ridership)]
+
+def add_density_layers(m, input_dir, amtrak_input_dir, weight, zooms):
+    """Plot one density grid layer per zoom level of airports (by weight) and Amtrak stations on the folium map"""
+    airports, stations = density_points(input_dir, amtrak_input_dir, weight)
+    label = DENSITY_WEIGHTS[weight][3]
+    for zoom in zooms:
+        # approximate cell width at the center of the map
+        cell_mi = 360. / 2 ** zoom * 69 * np.cos(np.radians(37))
+        group = folium.FeatureGroup(name='{0} Density (~{1:.0f} mi grid)'.format(label, cell_mi))
+        layer = folium.element.MacroElement()
+        layer._name = 'DensityGrid'
+        layer._template = folium.element.Template(DENSITY_LAYER_TEMPLATE)
+        layer.zoom = zoom
+        layer.label = label
+        layer.colors = json.dumps(DENSITY_COLORS)
+        layer.cells = json.dumps(density_cells(airports, stations, zoom), separators=(',', ':'))
+        group.add_child(layer)
+        m.add_child(group)
+
+def base_map(period_routes, cache_dir=None, cache_prefix=None):
+    """
+    Create the folium map with the Amtrak layers (taken over the full year for now),
+    reusing their cached fragments (cache_prefix + layer name) from cache_dir if given
+    Return folium map and dict of empty route layer groups keyed by map layer
+    """
+    la_coords = [43, -118] # center map on LA
+    m = folium.Map(location=la_coords, zoom_start=5, tiles='stamentoner')
+    # groups for layers
+    groups = {}
+    for key, name, html_func, height, p in ROUTE_LAYERS:
+        groups[key] = folium.FeatureGroup(name=name)
+    g5 = folium.FeatureGroup(name='Amtrak Stations and Nearest Airports')
+    g6 = folium.FeatureGroup(name='Amtrak Delays (top 20 stations)')
 
-        # only 1 marker per airport
-        if origin not in orig_list:
-            html = """{0} {1}<BR>{2}""".format(origin, orig_name, orig_city)
-            iframe = folium.element.IFrame(html=html, width=300, height=150)
-            popup = folium.Popup(iframe, max_width=1000)
-            g8.add_child(folium.Marker([orig_lat, orig_lon], popup=popup))
-            orig_list.append(origin)
+    ############# Amtrak Stations and Nearest Airports #############
+    cached_layer(g5, lambda group: add_amtrak_layer(group, period_routes['amtrak']),
+                 period_routes['amtrak'], [], [add_amtrak_layer, amtrak_station_html, int_txt],
+                 cache_dir, '{0}_amtrak'.format(cache_prefix))
 
-        # plot straight line for route from orig to dest
-        g8.add_child(
-            folium.PolyLine([[float(orig_lat), float(orig_lon)], [float(dest_lat), float(dest_lon)]], color='green',
-                            weight=3))
-
-        # plot marker in center of route with route stats(perturb lon coord if out and back routes both included)
-        if set([orig_name, dest_name]) not in orig_dest_list:
-            p = 0
-        else:
-            p = .2
-        route_lat, route_lon = midpoint(orig_lat, orig_lon, dest_lat, dest_lon)
-        html = """{0} {1}<BR>to<BR>{2} {3}<BR><BR><font color="green">{4}</font> Total Flights<BR><BR>""" \
-               """{5} mi<BR>{6:.1f} min. avg. Air Time<BR>{7:.1f} min. avg. Elapsed Gate to Gate<BR><BR>""" \
-               """<font color="green">{8}</font> First/Business Flyers (from 10% sample of domestic tickets)<BR><BR>""" \
-               """<font color="red">{9:.1f}%</font> Aircraft Delay > 20 min<BR>""" \
-               """<font color="red">{10} min.</font> avg. Aircraft Delay time for non-weather and non-airport ops delays""".format(
-            origin,
-            orig_city, dest, dest_city, flight_count_route,
-            int(dist_mean_route), airtime_mean_route, elapsed_mean_route, bf_pct,
-            delay_20pct_route * 100, int(delay_mean_route))
-        iframe = folium.element.IFrame(html=html, width=300, height=400)
-        popup = folium.Popup(iframe, max_width=1000)
-        g8.add_child(folium.Marker([route_lat, route_lon + p], popup=popup,
-                                   icon=folium.Icon(color='green')))
-        orig_dest_list.append(set([orig_name, dest_name]))
+    ############# Amtrak Delays (top 20 stations) #############
+    cached_layer(g6, lambda group: add_amtrak_layer(group, period_routes['amtrak_delays']),
+                 period_routes['amtrak_delays'], [], [add_amtrak_layer, amtrak_station_html, int_txt],
+                 cache_dir, '{0}_amtrak_delays'.format(cache_prefix))
 
-    # get dest airports with no returns in data (not an origin)
-    for row in ot_cl_routes.iterrows():
-        dest, dest_name, dest_city, dest_lat, dest_lon = row[1][
-            ['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']]
-        if dest not in orig_list:
-            html = """{0} {1}<BR>{2}""".format(dest, dest_name, dest_city)
-            iframe = folium.element.IFrame(html=html, width=300, height=100)
-            popup = folium.Popup(iframe, max_width=1000)
-            g8.add_child(folium.Marker([dest_lat, dest_lon], popup=popup))
-            dest_no_orig_list.append([dest, dest_name, dest_city])
+    # keep the original layer control order
+    for key in ['ot', 'occ', 'cl', 'so']:
+        m.add_child(groups[key])
+    m.add_child(g5)
+    m.add_child(g6)
+    for key in ['ot_occ', 'ot_cl', 'occ_cl', 'ot_occ_cl', 'pareto']:
+        m.add_child(groups[key])
+    return m, groups
 
-    ############# Occupancy & First/Business (in top 40 of each) #############
-    orig_list = []
-    dest_no_orig_list = []
-    orig_dest_list = []
-    # get origin airport data to plot
-    for row in occ_cl_routes.iterrows():
-        origin, orig_name, orig_city, orig_lat, orig_lon = row[1][
-            ['orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon']]
-        dest, dest_name, dest_city, dest_lat, dest_lon = row[1][
-            ['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']]
-        passenger_sum, occupancy_mean, departures_sum = row[1][
-            ['PASSENGERS_sum', 'occupancy_mean', 'DEPARTURES_PERFORMED_sum']]
-        dist_mean_route = row[1]['DISTANCE_mean']
-        bf_frac = row[1][['class_bf_frac']]
-        try:
-            bf_pct = '{0:.1f}%'.format(float(bf_frac) * 100)
-        except:
-            bf_pct = 'no data for'
+def local_asset(url, asset_dir):
+    """
+    Download a vendored JS/CSS/font file into the shared asset directory once
+    CSS files get their relative url(...) references downloaded and rewritten as well
+    Return asset file name, or None if it could not be downloaded
+    """
+    url_path = urlparse(url).path
+    fname = '{0}-{1}'.format(hashlib.sha1(url.encode('utf8')).hexdigest()[:8], posixpath.basename(url_path))
+    path = '{0}/{1}'.format(asset_dir, fname)
+    if os.path.exists(path):
+        return fname
+    try:
+        content = urlopen(url, timeout=30).read()
+    except Exception as e:
+        print('could not download {0} ({1}), keeping remote link'.format(url, e))
+        return None
+
+    if url_path.endswith('.css'):
+        def local_url(match):
+            ref = match.group(1).strip('\'"')
+            if ref.startswith('data:'):
+                return match.group(0)
+            ref_url, _, suffix = urljoin(url, ref).partition('#')
+            ref_url, _, query = ref_url.partition('?')
+            ref_fname = local_asset(ref_url, asset_dir)
+            if ref_fname is None:
+                return match.group(0)
+            return 'url({0}{1})'.format(ref_fname, '#' + suffix if suffix else '')
+        content = re.sub(r'url\(([^)]+)\)', local_url, content.decode('utf8')).encode('utf8')
+
+    with open(path, 'wb') as f:
+        f.write(content)
+    return fname
+
+def compact_output(path, map_dir, asset_dir='assets'):
+    """
+    Compact a saved map (or map data script): point vendored JS/CSS links at one shared local
+    asset directory, strip indentation and blank lines from the generated html + script,
+    and write precompressed .gz (and .br if the brotli package is installed) variants
+    """
+    with open(path, 'rb') as f:
+        content = f.read().decode('utf8')
+
+    if path.endswith('.html'):
+        if not os.path.exists('{0}/{1}'.format(map_dir, asset_dir)):
+            os.makedirs('{0}/{1}'.format(map_dir, asset_dir))
+        def local_link(match):
+            fname = local_asset(match.group(2), '{0}/{1}'.format(map_dir, asset_dir))
+            if fname is None:
+                return match.group(0)
+            return '{0}{1}/{2}{3}'.format(match.group(1), asset_dir, fname, match.group(3))
+        content = re.sub(r'(<script src="|<link rel="stylesheet" href=")(https?://[^"]+)(")', local_link, content)
+        # popups are base64 iframes and the generated script has one statement per line,
+        # so dropping indentation and blank lines leaves both untouched
+        content = '\n'.join(line.strip() for line in content.splitlines() if line.strip())
+
+    data = content.encode('utf8')
+    with open(path, 'wb') as f:
+        f.write(data)
+    with gzip.open(path + '.gz', 'wb', 9) as f:
+        f.write(data)
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data))
+    print('{0}: {1} kB ({2} kB gzip)'.format(path, len(data) // 1024, os.path.getsize(path + '.gz') // 1024))
+
+def period_selector(groups, period_dir):
+    """Return folium element for the multi-period map's period selector control"""
+    selector = folium.element.MacroElement()
+    selector._name = 'PeriodSelector'
+    selector._template = folium.element.Template(PERIOD_SELECTOR_TEMPLATE)
+    selector.groups = [(key, groups[key]) for key, name, html_func, height, p in ROUTE_LAYERS]
+    selector.periods = json.dumps([[suffix, label] for quarter, suffix, label in PERIODS])
+    selector.period_dir = period_dir
+    return selector
 
-        # only 1 marker per airport
-        if origin not in orig_list:
-            html = """{0} {1}<BR>{2}""".format(origin, orig_name, orig_city)
-            iframe = folium.element.IFrame(html=html, width=300, height=150)
-            popup = folium.Popup(iframe, max_width=1000)
-            g9.add_child(folium.Marker([orig_lat, orig_lon], popup=popup))
-            orig_list.append(origin)
 
-        # plot straight line for route from orig to dest
-        g9.add_child(
-            folium.PolyLine([[float(orig_lat), float(orig_lon)], [float(dest_lat), float(dest_lon)]], color='green',
-                            weight=3))
-
-        # plot marker in center of route with route stats(perturb lon coord if out and back routes both included)
-        if set([orig_name, dest_name]) not in orig_dest_list:
-            p = 0
-        else:
-            p = .2
-        route_lat, route_lon = midpoint(orig_lat, orig_lon, dest_lat, dest_lon)
-        html = """{0} {1}<BR>to<BR>{2} {3}<BR><BR>""" \
-               """<font color="green">{4}</font> Total Passengers<BR>""" \
-               """<font color="green">{5}</font> Total Departures<BR>{6} mi<BR><Br>""" \
-               """<font color="green">{7}</font> First/Business Flyers (from 10% sample of domestic tickets)<BR><BR>""" \
-               """<font color="red">{8:.1f}%</font> avg. Occupancy<BR><BR>""".format(origin,
-                                                                                     orig_city, dest, dest_city,
-                                                                                     int(passenger_sum),
-                                                                                     int(departures_sum),
-                                                                                     int(dist_mean_route), bf_pct,
-                                                                                     occupancy_mean * 100)
-        iframe = folium.element.IFrame(html=html, width=300, height=250)
-        popup = folium.Popup(iframe, max_width=1000)
-        g9.add_child(folium.Marker([route_lat, route_lon + p], popup=popup,
-                                   icon=folium.Icon(color='green')))
-        orig_dest_list.append(set([orig_name, dest_name]))
+if __name__ == '__main__':
+    import glob
+    import gzip
+    import hashlib
+    import inspect
+    import json
+    import os
+    import posixpath
+    import re
+    import sys
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+    try:
+        from urllib.request import urlopen
+        from urllib.parse import urlparse, urljoin
+    except ImportError:
+        from urllib2 import urlopen
+        from urlparse import urlparse, urljoin
 
-    # get dest airports with no returns in data (not an origin)
-    for row in occ_cl_routes.iterrows():
-        dest, dest_name, dest_city, dest_lat, dest_lon = row[1][
-            ['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']]
-        if dest not in orig_list:
-            html = """{0} {1}<BR>{2}""".format(dest, dest_name, dest_city)
-            iframe = folium.element.IFrame(html=html, width=300, height=100)
-            popup = folium.Popup(iframe, max_width=1000)
-            g9.add_child(folium.Marker([dest_lat, dest_lon], popup=popup))
-            dest_no_orig_list.append([dest, dest_name, dest_city])
+    parser = ArgumentParser(description='This script loads the aggregated route airline and Amtrak datasets,\n'
+                                        'performs a loose cut on infrequently flown routes to ensure consistency,\n'
+                                        'combines them, and finally creates an interactive map to visualize the routes and their metrics.',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
 
-    ############# Airline Delays & Occupancy & First/Business (in top 40 of each) #############
-    orig_list = []
-    dest_no_orig_list = []
-    orig_dest_list = []
-    # get origin airport data to plot
-    for row in ot_occ_cl_routes.iterrows():
-        origin, orig_name, orig_city, orig_lat, orig_lon = row[1][
-            ['orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon']]
-        dest, dest_name, dest_city, dest_lat, dest_lon = row[1][
-            ['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']]
-        delay_mean_route, delay_20pct_route, flight_count_route = row[1][['AirlineDelay_mean',
-                                                                          'AirlineDelay_20frac', 'Flight_Count']]
-        airtime_mean_route, elapsed_mean_route = row[1][['AirTime_mean', 'ActualElapsedTime_mean']]
-        passenger_sum, occupancy_mean, departures_sum = row[1][
-            ['PASSENGERS_sum', 'occupancy_mean', 'DEPARTURES_PERFORMED_sum']]
-        dist_mean_route = row[1][['DISTANCE_mean']]
-
-        bf_frac = row[1][['class_bf_frac']]
-        try:
-            bf_pct = '{0:.1f}%'.format(float(bf_frac) * 100)
-        except:
-            bf_pct = 'no data for'
+    parser.add_argument('-q', '--quarter', dest='quarter',
+                        default=None, metavar='QUARTER',
+                        help='QUARTER over which to create the map, default None aggregates over all')
+    parser.add_argument('--monthly-flights', dest='monthly_flights',
+                        default=50, type=int,
+                        help='Minimum monthly flights over a route to ensure consistent pool of travelers')
+    parser.add_argument('--monthly-passengers', dest='monthly_passengers',
+                        default=1000, type=int,
+                        help='Minimum monthly passengers over a route to ensure consistent pool of travelers')
+    parser.add_argument('--multi-period', dest='multi_period',
+                        default=False, action='store_true',
+                        help='Create a single map with a period selector (full year, Q1-Q4) '
+                             'that loads the selected period\'s route data on demand')
+    parser.add_argument('--compact', dest='compact',
+                        default=False, action='store_true',
+                        help='Point maps at shared local copies of the vendored JS/CSS (maps/assets), '
+                             'strip whitespace and write precompressed .gz (and .br with the brotli package) files')
+    parser.add_argument('--density', dest='density',
+                        default=None, choices=sorted(DENSITY_WEIGHTS),
+                        help='Add grid density layers of airports weighted by route passengers, flights or delayed flights, '
+                             'together with Amtrak stations and their ridership')
+    parser.add_argument('--density-zooms', dest='density_zooms',
+                        default=[5, 7, 9], type=int, nargs='+',
+                        help='Map zoom levels whose tile grid is used for the density layers, one layer per zoom')
+    parser.add_argument('--pareto-table', dest='pareto_table',
+                        default=False, action='store_true',
+                        help='Also write every route ranked by pain point skyline front '
+                             '(maps/Route_Mapper_<period>_Pareto_Routes.csv)')
+    parser.add_argument('--no-cache', dest='no_cache',
+                        default=False, action='store_true',
+                        help='Render every map layer again instead of reusing the layers whose inputs did not change '
+                             'from the fragment cache (maps/fragment_cache)')
+    args = parser.parse_args()
 
-        # only 1 marker per airport
-        if origin not in orig_list:
-            html = """{0} {1}<BR>{2}""".format(origin, orig_name, orig_city)
-            iframe = folium.element.IFrame(html=html, width=300, height=150)
-            popup = folium.Popup(iframe, max_width=1000)
-            g10.add_child(folium.Marker([orig_lat, orig_lon], popup=popup))
-            orig_list.append(origin)
+    # heavy imports only once the arguments are parsed, so --help doesn't wait for them
+    import numpy as np
+    import pandas as pd
+    from route_utils import route_ids, great_circle_arcs
+    import folium
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
 
-        # plot straight line for route from orig to dest
-        g10.add_child(
-            folium.PolyLine([[float(orig_lat), float(orig_lon)], [float(dest_lat), float(dest_lon)]], color='green',
-                            weight=3))
-
-        # plot marker in center of route with route stats(perturb lon coord if out and back routes both included)
-        if set([orig_name, dest_name]) not in orig_dest_list:
-            p = 0
-        else:
-            p = .2
-        route_lat, route_lon = midpoint(orig_lat, orig_lon, dest_lat, dest_lon)
-        html = """{0} {1}<BR>to<BR>{2} {3}<BR><BR><font color="green">{4}</font> Total Flights (delay data)<BR>""" \
-               """<font color="green">{5}</font> Total Flights (occupancy data)<BR>""" \
-               """<font color="green">{6}</font> Total Passengers (occupancy data)<BR>""" \
-               """{7} mi<BR>{8:.1f} min. avg. Air Time<BR>{9:.1f} min. avg. Elapsed Gate to Gate<BR><BR>""" \
-               """<font color="green">{10}</font> First/Business Flyers (from 10% sample of domestic tickets)<BR><BR>""" \
-               """<font color="red">{11:.1f}%</font> Aircraft Delay > 20 min<BR>""" \
-               """<font color="red">{12} min.</font> avg. Aircraft Delay time for non-weather and non-airport ops delays<BR><BR>""" \
-               """<font color="red">{13:.1f}%</font> avg. Occupancy""".format(origin,
-                                                                              orig_city, dest, dest_city,
-                                                                              flight_count_route, departures_sum,
-                                                                              passenger_sum,
-                                                                              int(dist_mean_route), airtime_mean_route,
-                                                                              elapsed_mean_route, bf_pct,
-                                                                              delay_20pct_route * 100,
-                                                                              int(delay_mean_route),
-                                                                              occupancy_mean * 100)
-        iframe = folium.element.IFrame(html=html, width=300, height=400)
-        popup = folium.Popup(iframe, max_width=1000)
-        g10.add_child(folium.Marker([route_lat, route_lon + p], popup=popup,
-                                    icon=folium.Icon(color='green')))
-        orig_dest_list.append(set([orig_name, dest_name]))
+    # output directory
+    map_dir = 'maps'
+    # amtrak data taken over full year for now
+    amtrak_input_dir = 'data/aggregated'
+    # rendered layer and route geometry cache
+    if args.no_cache:
+        cache_dir = None
+        geometry_cache = {}
+    else:
+        cache_dir = '{0}/fragment_cache'.format(map_dir)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        geometry_cache = load_geometry_cache('{0}/route_geometry.npz'.format(cache_dir))
+
+    if args.multi_period:
+        print('creating {0}/Route_Mapper_Multi_Period.html...'.format(map_dir))
+        sys.stdout.flush()
+        # one data script per period, only loaded by the map when its period is selected
+        period_dir = 'periods'
+        if not os.path.exists('{0}/{1}'.format(map_dir, period_dir)):
+            os.makedirs('{0}/{1}'.format(map_dir, period_dir))
+        for quarter, mapname_suffix, label in PERIODS:
+            if quarter:
+                input_dir = 'data/aggregated/q{0}'.format(quarter)
+                months = 3
+            else:
+                input_dir = 'data/aggregated'
+                months = 12
+            print('creating {0}/{1}/Route_Mapper{2}.js...'.format(map_dir, period_dir, mapname_suffix))
+            sys.stdout.flush()
+            period_routes = load_routes(input_dir, amtrak_input_dir, months,
+                                        args.monthly_flights, args.monthly_passengers)
+            if quarter is None:
+                full_year_routes = period_routes
+            if args.pareto_table:
+                save_pareto_table(period_routes['pareto_ranked'],
+                                  '{0}/Route_Mapper{1}_Pareto_Routes.csv'.format(map_dir, mapname_suffix))
+            with open('{0}/{1}/Route_Mapper{2}.js'.format(map_dir, period_dir, mapname_suffix), 'w') as f:
+                f.write('routeMapperPeriodLoaded("{0}", {1});\n'.format(
+                    mapname_suffix, json.dumps(period_layer_records(period_routes, geometry_cache), separators=(',', ':'))))
+            if args.compact:
+                compact_output('{0}/{1}/Route_Mapper{2}.js'.format(map_dir, period_dir, mapname_suffix), map_dir)
+
+        m, groups = base_map(full_year_routes, cache_dir, 'Route_Mapper_Multi_Period')
+        m.add_child(period_selector(groups, period_dir))
+        if args.density:
+            # density taken over full year like the amtrak layers
+            add_density_layers(m, 'data/aggregated', amtrak_input_dir, args.density, args.density_zooms)
+        m.add_child(folium.LayerControl())
+        m.save('{0}/Route_Mapper_Multi_Period.html'.format(map_dir))
+        if args.compact:
+            compact_output('{0}/Route_Mapper_Multi_Period.html'.format(map_dir), map_dir)
+        if cache_dir:
+            save_geometry_cache('{0}/route_geometry.npz'.format(cache_dir), geometry_cache)
+        sys.exit(0)
 
-    # get dest airports with no returns in data (not an origin)
-    for row in ot_occ_cl_routes.iterrows():
-        dest, dest_name, dest_city, dest_lat, dest_lon = row[1][
-            ['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']]
-        if dest not in orig_list:
-            html = """{0} {1}<BR>{2}""".format(dest, dest_name, dest_city)
-            iframe = folium.element.IFrame(html=html, width=300, height=100)
-            popup = folium.Popup(iframe, max_width=1000)
-            g10.add_child(folium.Marker([dest_lat, dest_lon], popup=popup))
-            dest_no_orig_list.append([dest, dest_name, dest_city])
+    # Input directory
+    if args.quarter:
+        input_dir = 'data/aggregated/q{0}'.format(args.quarter)
+        months = 3
+        mapname_suffix = '_Q{0}'.format(args.quarter)
+    else:
+        input_dir = 'data/aggregated'
+        months = 12
+        mapname_suffix = '_Full_Year'
 
+    print('creating {0}/Route_Mapper{1}.html...'.format(map_dir, mapname_suffix))
+    sys.stdout.flush()
 
-    m.add_child(g1)
-    m.add_child(g2)
-    m.add_child(g3)
-    m.add_child(g4)
-    m.add_child(g5)
-    m.add_child(g6)
-    m.add_child(g7)
-    m.add_child(g8)
-    m.add_child(g9)
-    m.add_child(g10)
+    period_routes = load_routes(input_dir, amtrak_input_dir, months,
+                                args.monthly_flights, args.monthly_passengers)
+    if args.pareto_table:
+        save_pareto_table(period_routes['pareto_ranked'],
+                          '{0}/Route_Mapper{1}_Pareto_Routes.csv'.format(map_dir, mapname_suffix))
+
+    # create map -- one group per layer, route layers all share the same markers + lines block
+    m, groups = base_map(period_routes, cache_dir, 'Route_Mapper{0}'.format(mapname_suffix))
+    for key, name, html_func, height, p in ROUTE_LAYERS:
+        def fill(group, routes=period_routes[key], route_html=globals()[html_func], height=height, p=p):
+            add_route_layer(group, route_layer_records(routes, route_html, height, p, geometry_cache))
+        cached_layer(groups[key], fill, period_routes[key], [height, p, ARC_POINTS],
+                     [route_layer_records, add_route_layer, globals()[html_func], int_txt, pct_txt, bf_pct_txt,
+                      route_arcs, great_circle_arcs],
+                     cache_dir, 'Route_Mapper{0}_{1}'.format(mapname_suffix, key))
+    if cache_dir:
+        save_geometry_cache('{0}/route_geometry.npz'.format(cache_dir), geometry_cache)
+    if args.density:
+        add_density_layers(m, input_dir, amtrak_input_dir, args.density, args.density_zooms)
     m.add_child(folium.LayerControl())
-    m.save('{0}/Route_Mapper{1}.html'.format(map_dir, mapname_suffix))
\ No newline at end of file
+    m.save('{0}/Route_Mapper{1}.html'.format(map_dir, mapname_suffix))
+    if args.compact:
+        compact_output('{0}/Route_Mapper{1}.html'.format(map_dir, mapname_suffix), map_dir)
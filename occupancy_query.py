@@ -0,0 +1,173 @@
+"""
+This script rolls up aircraft occupancy of any slice (quarters, carriers, aircraft types or classes) from the occupancy cube
+created by data_aggregator.py --occ-cube (occupancy_cube.npz, route x month x carrier x aircraft type), without the T-100 data.
+"""
+from __future__ import print_function
+
+# aircraft classes by the average seats per departure of an aircraft type (class, min seats, max seats)
+AIRCRAFT_CLASSES = [('regional', 0, 100),
+                    ('narrowbody', 100, 230),
+                    ('widebody', 230, float('inf'))]
+
+# cube dimensions a roll-up can be grouped by (dimension, cube array)
+ROLLUP_DIMS = [('route', 'route_id'),
+               ('month', 'period'),
+               ('carrier', 'carrier'),
+               ('aircraft_type', 'aircraft_type')]
+
+def load_occupancy_cube(fname):
+    """
+    Load the occupancy cube into memory
+    Return dict of numpy arrays
+    """
+    saved = np.load(fname)
+    return dict((key, saved[key]) for key in saved.files)
+
+def aircraft_type_classes(cube):
+    """
+    Class (AIRCRAFT_CLASSES) of every aircraft type in the cube by its average seats per departure
+    Return pandas dataframe of aircraft types, seats per departure and class
+    """
+    types, type_idx = np.unique(cube['aircraft_type'], return_inverse=True)
+    seats = np.bincount(type_idx, weights=cube['SEATS'], minlength=len(types))
+    departures = np.bincount(type_idx, weights=cube['DEPARTURES_PERFORMED'], minlength=len(types))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        seats_per_departure = np.where(departures > 0, seats / departures, np.nan)
+    classes = np.full(len(types), '', dtype=object)
+    for name, min_seats, max_seats in AIRCRAFT_CLASSES:
+        classes[(seats_per_departure >= min_seats) & (seats_per_departure < max_seats)] = name
+    return pd.DataFrame({'aircraft_type': types, 'seats_per_departure': seats_per_departure, 'aircraft_class': classes})
+
+def cube_slice(cube, years=None, quarters=None, carriers=None, aircraft_types=None, aircraft_class=None):
+    """
+    Cells of the cube in the slice, every filter left as None keeps all cells
+    Return numpy bool array
+    Raise ValueError for unknown carriers or aircraft classes
+    """
+    keep = np.ones(len(cube['route_id']), dtype=bool)
+    if years:
+        keep &= np.isin(cube['period'] // 100, years)
+    if quarters:
+        keep &= np.isin((cube['period'] % 100 - 1) // 3 + 1, quarters)
+    if carriers:
+        unknown = [carrier for carrier in carriers if carrier not in cube['carriers']]
+        if unknown:
+            raise ValueError('unknown carriers {0}'.format(', '.join(unknown)))
+        keep &= np.isin(cube['carrier'], np.flatnonzero(np.isin(cube['carriers'], carriers)))
+    if aircraft_types:
+        keep &= np.isin(cube['aircraft_type'], aircraft_types)
+    if aircraft_class:
+        if aircraft_class not in [name for name, min_seats, max_seats in AIRCRAFT_CLASSES]:
+            raise ValueError('unknown aircraft class {0}'.format(aircraft_class))
+        types = aircraft_type_classes(cube)
+        keep &= np.isin(cube['aircraft_type'], types.loc[types['aircraft_class'] == aircraft_class, 'aircraft_type'].values)
+    return keep
+
+def cube_rollup(cube, keep, by=('route',)):
+    """
+    Roll the cells of a slice up to the given dimensions (ROLLUP_DIMS) by summing their measures and histograms
+    Return pandas dataframe of the dimensions and the occupancy metrics (same names as aircraft_occupancy_routes.csv)
+    """
+    dims = dict(ROLLUP_DIMS)
+    keys = np.stack([cube[dims[dim]][keep].astype(np.int64) for dim in by], axis=1)
+    groups, group_idx = np.unique(keys, axis=0, return_inverse=True)
+    group_idx = group_idx.ravel()
+    sums = dict((col, np.bincount(group_idx, weights=cube[col][keep], minlength=len(groups)))
+                for col in ['rows', 'DEPARTURES_PERFORMED', 'SEATS', 'PASSENGERS', 'occupancy_n', 'occupancy_sum', 'DISTANCE_sum'])
+    hist = cube['occupancy_hist'][keep]
+    hist = np.stack([np.bincount(group_idx, weights=hist[:, i], minlength=len(groups)) for i in range(hist.shape[1])], axis=1)
+
+    rollup = pd.DataFrame()
+    for i, dim in enumerate(by):
+        if dim == 'route':
+            rollup['orig_code'], rollup['dest_code'] = route_codes(groups[:, i])
+        elif dim == 'carrier':
+            rollup['carrier'] = cube['carriers'][groups[:, i]]
+        else:
+            rollup[dim] = groups[:, i]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rollup['DEPARTURES_PERFORMED_sum'] = sums['DEPARTURES_PERFORMED']
+        rollup['SEATS_sum'] = sums['SEATS']
+        rollup['PASSENGERS_sum'] = sums['PASSENGERS']
+        rollup['occupancy_total'] = sums['PASSENGERS'] / sums['SEATS']
+        rollup['occupancy_med'] = hist_median(hist, cube['occupancy_bins'])
+        rollup['occupancy_mean'] = sums['occupancy_sum'] / sums['occupancy_n']
+        rollup['DISTANCE_mean'] = sums['DISTANCE_sum'] / sums['rows']
+    return rollup
+
+
+if __name__ == '__main__':
+    import numpy as np
+    import pandas as pd
+    from route_utils import route_codes, hist_median
+    import sys
+    import time
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+    parser = ArgumentParser(description='This script rolls up aircraft occupancy of any slice from the occupancy cube created by\n'
+                                        'data_aggregator.py --occ-cube, e.g. occupancy per route of regional aircraft in quarter 2.',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--cube', dest='cube',
+                        default='data/aggregated/occupancy_cube.npz',
+                        help='Occupancy cube file')
+    parser.add_argument('-q', '--quarter', dest='quarter',
+                        default=None, nargs='+', metavar='QUARTER', type=int,
+                        help='QUARTER(s) of the slice, default None uses every quarter')
+    parser.add_argument('--year', dest='year',
+                        default=None, nargs='+', type=int,
+                        help='Year(s) of the slice, default None uses every year')
+    parser.add_argument('--carrier', dest='carrier',
+                        default=None, nargs='+',
+                        help='Carrier code(s) of the slice (e.g. UA WN), default None uses every carrier')
+    parser.add_argument('--aircraft-type', dest='aircraft_type',
+                        default=None, nargs='+', type=int,
+                        help='T-100 aircraft type code(s) of the slice, default None uses every aircraft type')
+    parser.add_argument('--aircraft-class', dest='aircraft_class',
+                        default=None, choices=[name for name, min_seats, max_seats in AIRCRAFT_CLASSES],
+                        help='Aircraft class of the slice by the average seats per departure of each aircraft type '
+                             '(regional under 100, narrowbody under 230, widebody)')
+    parser.add_argument('--by', dest='by',
+                        default=['route'], nargs='+', choices=[dim for dim, col in ROLLUP_DIMS],
+                        help='Dimensions the slice is rolled up to')
+    parser.add_argument('--route', dest='route',
+                        default=None, nargs=2, metavar=('ORIG', 'DEST'),
+                        help='Only list the route from ORIG to DEST (needs route in --by)')
+    parser.add_argument('--min-departures', dest='min_departures',
+                        default=0, type=float,
+                        help='Minimum departures performed of a listed row')
+    parser.add_argument('--aircraft-types', dest='aircraft_types',
+                        default=False, action='store_true',
+                        help='List the aircraft types of the cube with their seats per departure and class instead')
+    parser.add_argument('--output', dest='output',
+                        default=None,
+                        help='Write the table to this csv file instead of printing it')
+    args = parser.parse_args()
+
+    try:
+        cube = load_occupancy_cube(args.cube)
+    except IOError as e:
+        print(e)
+        sys.exit(1)
+
+    if args.aircraft_types:
+        table = aircraft_type_classes(cube)
+    else:
+        start = time.time()
+        try:
+            keep = cube_slice(cube, years=args.year, quarters=args.quarter, carriers=args.carrier,
+                              aircraft_types=args.aircraft_type, aircraft_class=args.aircraft_class)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        table = cube_rollup(cube, keep, by=args.by)
+        print('rolled up {0} of {1} cells to {2} rows in {3:.1f}ms'.format(
+            keep.sum(), len(keep), len(table), (time.time() - start) * 1000))
+        table = table.loc[table['DEPARTURES_PERFORMED_sum'] >= args.min_departures]
+        if args.route and 'route' in args.by:
+            table = table.loc[(table['orig_code'] == args.route[0]) & (table['dest_code'] == args.route[1])]
+    if args.output:
+        table.to_csv(args.output, index=False)
+        print('wrote {0} rows to {1}'.format(len(table), args.output))
+    else:
+        print(table.to_string(index=False))
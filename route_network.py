@@ -0,0 +1,179 @@
+"""
+This script queries the route network created by data_aggregator.py --air-network (airports as nodes,
+coupon legs as edges weighted by passengers, and the connections of every orig -> dest market),
+memory-mapping the stored arrays so queries don't load or rebuild the coupon data.
+"""
+from __future__ import print_function
+
+# arrays of the stored route network
+NETWORK_ARRAYS = ['airports', 'leg_indptr', 'leg_indices', 'leg_passengers', 'leg_coupons',
+                  'od_orig', 'od_dest', 'od_nonstop_passengers', 'od_connecting_passengers',
+                  'via_indptr', 'via_nodes', 'via_passengers']
+
+def load_route_network(network_dir):
+    """
+    Memory-map the route network arrays
+    Return dict of numpy arrays
+    """
+    return dict((key, np.load('{0}/{1}.npy'.format(network_dir, key), mmap_mode='r')) for key in NETWORK_ARRAYS)
+
+def airport_nodes(network, codes):
+    """
+    Node index of airport codes
+    Return numpy array
+    Raise ValueError for unknown airports
+    """
+    codes = np.asarray(codes, dtype=str)
+    nodes = np.searchsorted(network['airports'], codes)
+    known = (nodes < len(network['airports'])) & (network['airports'][np.minimum(nodes, len(network['airports']) - 1)] == codes)
+    if not known.all():
+        raise ValueError('unknown airports {0}'.format(', '.join(codes[~known])))
+    return nodes
+
+def market_index(network, orig, dest):
+    """
+    Index of the orig -> dest market in the od arrays
+    Return int, -1 without passengers in the market
+    Raise ValueError for unknown airports
+    """
+    n_nodes = len(network['airports'])
+    orig_node, dest_node = airport_nodes(network, [orig, dest])
+    ods = network['od_orig'] * n_nodes + network['od_dest']
+    od = np.searchsorted(ods, orig_node * n_nodes + dest_node)
+    if od == len(ods) or ods[od] != orig_node * n_nodes + dest_node:
+        return -1
+    return int(od)
+
+def od_totals(network, orig, dest):
+    """
+    Nonstop and connecting passengers of the orig -> dest market
+    Return nonstop and connecting passengers (0 without passengers in the market)
+    """
+    od = market_index(network, orig, dest)
+    if od < 0:
+        return 0., 0.
+    return float(network['od_nonstop_passengers'][od]), float(network['od_connecting_passengers'][od])
+
+def od_connections(network, orig, dest):
+    """
+    Connection airports carrying traffic for orig -> dest markets
+    Return pandas dataframe of connection airports, their passengers and share of connecting passengers
+    """
+    od = market_index(network, orig, dest)
+    connections = pd.DataFrame(columns=['connection', 'passengers', 'share'])
+    if od < 0:
+        return connections
+    start, end = network['via_indptr'][od], network['via_indptr'][od + 1]
+    connections['connection'] = network['airports'][network['via_nodes'][start:end]]
+    connections['passengers'] = network['via_passengers'][start:end]
+    connections['share'] = connections['passengers'] / network['od_connecting_passengers'][od]
+    return connections.sort_values('passengers', ascending=False).reset_index(drop=True)
+
+def connecting_only_routes(network, min_share=0.9, min_passengers=10):
+    """
+    Markets whose passengers mostly connect and that have no nonstop coupon leg at all
+    Return pandas dataframe of orig, dest, passengers, connecting share and top connection airport
+    """
+    n_nodes = len(network['airports'])
+    legs = np.repeat(np.arange(n_nodes), np.diff(network['leg_indptr'])) * n_nodes + network['leg_indices']
+    if not len(legs):
+        return pd.DataFrame(columns=['orig', 'dest', 'passengers', 'connecting_share', 'top_connection'])
+    ods = network['od_orig'] * n_nodes + network['od_dest']
+    ## legs are sorted by orig then dest
+    leg_pos = np.minimum(np.searchsorted(legs, ods), len(legs) - 1)
+    no_nonstop = legs[leg_pos] != ods
+    passengers = network['od_nonstop_passengers'] + network['od_connecting_passengers']
+    share = network['od_connecting_passengers'] / np.maximum(passengers, 1e-9)
+    keep = no_nonstop & (share >= min_share) & (passengers >= min_passengers) & (network['od_orig'] != network['od_dest'])
+
+    ## connection airport with the most passengers per market
+    via_counts = np.diff(network['via_indptr'])
+    via_od = np.repeat(np.arange(len(ods)), via_counts)
+    order = np.lexsort((-np.asarray(network['via_passengers']), via_od))
+    top_via = np.full(len(ods), -1)
+    top_via[via_od[order][::-1]] = network['via_nodes'][order][::-1]
+
+    routes = pd.DataFrame({'orig': network['airports'][network['od_orig'][keep]],
+                           'dest': network['airports'][network['od_dest'][keep]],
+                           'passengers': passengers[keep],
+                           'connecting_share': share[keep],
+                           'top_connection': np.where(top_via[keep] >= 0, network['airports'][np.maximum(top_via[keep], 0)], '')})
+    return routes.sort_values('passengers', ascending=False).reset_index(drop=True)
+
+def reachable(network, orig, hops=2):
+    """
+    Airports reachable from orig within a number of coupon legs (breadth first over the leg edges)
+    Return pandas dataframe of airports and their fewest legs from orig
+    """
+    indptr = np.asarray(network['leg_indptr'])
+    distance = np.full(len(network['airports']), -1)
+    frontier = airport_nodes(network, [orig])
+    distance[frontier] = 0
+    for hop in range(1, hops + 1):
+        ## every edge out of the frontier: row starts repeated over their lengths plus offsets within the row
+        counts = indptr[frontier + 1] - indptr[frontier]
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        neighbors = np.unique(network['leg_indices'][np.repeat(indptr[frontier], counts) + offsets])
+        frontier = neighbors[distance[neighbors] < 0]
+        if not len(frontier):
+            break
+        distance[frontier] = hop
+    found = np.flatnonzero(distance > 0)
+    return pd.DataFrame({'airport': network['airports'][found], 'hops': distance[found]}).sort_values(
+        ['hops', 'airport']).reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    import numpy as np
+    import pandas as pd
+    import sys
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+    parser = ArgumentParser(description='This script queries the route network created by data_aggregator.py --air-network,\n'
+                                        'e.g. the connections of a market, connecting-only markets or airports within k legs.',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-q', '--quarter', dest='quarter',
+                        default=None, metavar='QUARTER', type=int,
+                        help='QUARTER of the route network, default None uses the network over all quarters')
+    parser.add_argument('--connections', dest='connections',
+                        default=None, nargs=2, metavar=('ORIG', 'DEST'),
+                        help='List the connection airports carrying traffic from ORIG to DEST')
+    parser.add_argument('--connecting-only', dest='connecting_only',
+                        default=False, action='store_true',
+                        help='List markets with a high connecting share but no nonstop leg')
+    parser.add_argument('--min-share', dest='min_share',
+                        default=0.9, type=float,
+                        help='Minimum connecting passenger share for --connecting-only')
+    parser.add_argument('--min-passengers', dest='min_passengers',
+                        default=10, type=float,
+                        help='Minimum market passengers (in the 10%% coupon sample) for --connecting-only')
+    parser.add_argument('--reachable', dest='reachable',
+                        default=None, metavar='ORIG',
+                        help='List airports reachable from ORIG within --hops coupon legs')
+    parser.add_argument('--hops', dest='hops',
+                        default=2, type=int,
+                        help='Maximum coupon legs for --reachable')
+    args = parser.parse_args()
+
+    # input directory
+    if args.quarter:
+        network_dir = 'data/aggregated/q{0}/route_network'.format(args.quarter)
+    else:
+        network_dir = 'data/aggregated/route_network'
+    network = load_route_network(network_dir)
+
+    try:
+        if args.connections:
+            nonstop, connecting = od_totals(network, *args.connections)
+            print('{0} -> {1}: {2:.0f} nonstop, {3:.0f} connecting passengers'.format(
+                args.connections[0], args.connections[1], nonstop, connecting))
+            print(od_connections(network, *args.connections).to_string(index=False))
+        if args.connecting_only:
+            print(connecting_only_routes(network, min_share=args.min_share,
+                                         min_passengers=args.min_passengers).to_string(index=False))
+        if args.reachable:
+            print(reachable(network, args.reachable, hops=args.hops).to_string(index=False))
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
@@ -0,0 +1,225 @@
+"""
+This script serves the aggregated route datasets from memory over a small local HTTP service,
+so route thresholds and top route cuts can be changed live without recreating a map.
+"""
+from __future__ import print_function
+
+# periods served (quarter, input directory, months)
+PERIODS = [(None, 'data/aggregated', 12),
+           (1, 'data/aggregated/q1', 3),
+           (2, 'data/aggregated/q2', 3),
+           (3, 'data/aggregated/q3', 3),
+           (4, 'data/aggregated/q4', 3)]
+
+# datasets served (key, file, flights column, passengers column, passenger factor, metrics)
+## 10 factor on passengers because class and stopover data is a 10% sample of all tickets
+DATASETS = [('delay', 'aircraft_delay_routes.csv', 'Flight_Count', None, 1,
+             ['AirlineDelay_20frac', 'AirlineDelay_10frac', 'AirlineDelay_30frac', 'AirlineDelay_mean',
+              'AirlineDelay_med']),
+            ('occupancy', 'aircraft_occupancy_routes.csv', 'DEPARTURES_PERFORMED_sum', 'PASSENGERS_sum', 1,
+             ['occupancy_mean', 'occupancy_med', 'occupancy_total']),
+            ('class', 'flyer_class_routes.csv', None, 'PASSENGERS_sum', 10,
+             ['class_bf_frac', 'class_c_frac']),
+            ('stopover', 'flyer_stopover_routes.csv', None, 'PASSENGERS_sum', 10,
+             ['stopover_frac', 'stopovers_mean'])]
+
+CONTENT_TYPES = {'.html': 'text/html; charset=utf-8',
+                 '.js': 'application/javascript',
+                 '.css': 'text/css',
+                 '.json': 'application/json',
+                 '.png': 'image/png'}
+
+def route_feature_json(routes):
+    """
+    Pre-serialize each route as a GeoJSON LineString feature with its metrics as properties
+    Return list of json strings
+    """
+    features = []
+    prop_cols = [col for col in routes.columns if col not in ['orig_lat', 'orig_lon', 'dest_lat', 'dest_lon']]
+    for row in routes.itertuples(index=False):
+        row = dict(zip(routes.columns, row))
+        properties = {}
+        for col in prop_cols:
+            value = row[col]
+            if isinstance(value, (float, np.floating)) and np.isnan(value):
+                value = None
+            elif isinstance(value, np.integer):
+                value = int(value)
+            elif isinstance(value, np.floating):
+                value = float(value)
+            properties[col] = value
+        features.append(json.dumps({'type': 'Feature',
+                                    'geometry': {'type': 'LineString',
+                                                 'coordinates': [[float(row['orig_lon']), float(row['orig_lat'])],
+                                                                 [float(row['dest_lon']), float(row['dest_lat'])]]},
+                                    'properties': properties}, separators=(',', ':')))
+    return features
+
+def load_index():
+    """
+    Load every period's route datasets once and index them for threshold + top route queries
+    Return dict of (quarter, metric) -> dict with routes sorted by metric (descending),
+           their flight and passenger counts in that order, and pre-serialized features
+    """
+    index = {}
+    for quarter, input_dir, months in PERIODS:
+        if not os.path.exists(input_dir):
+            continue
+        for key, fname, flights_col, passengers_col, factor, metrics in DATASETS:
+            routes = pd.read_csv('{0}/{1}'.format(input_dir, fname))
+            routes = routes[[col for col in routes.columns if not col.startswith('stopover_airports')]]
+            features = np.array(route_feature_json(routes), dtype=object)
+            flights = routes[flights_col].values if flights_col else np.full(len(routes), np.inf)
+            passengers = routes[passengers_col].values * factor if passengers_col else np.full(len(routes), np.inf)
+            for metric in metrics:
+                # descending, missing metric values last
+                values = routes[metric].values.astype(float)
+                order = np.argsort(np.where(np.isnan(values), -np.inf, -values), kind='mergesort')
+                order = order[~np.isnan(values[order])]
+                index[(quarter, metric)] = {'dataset': key,
+                                            'order': order,
+                                            'flights': flights[order],
+                                            'passengers': passengers[order],
+                                            'features': features,
+                                            'months': months}
+        print('indexed {0}'.format(input_dir))
+        sys.stdout.flush()
+    return index
+
+def query_routes(index, metric, top, min_flights, min_passengers, quarter):
+    """
+    Top routes by metric over the thresholds
+    Return GeoJSON FeatureCollection string
+    """
+    entry = index[(quarter, metric)]
+    keep = (entry['flights'] > min_flights) & (entry['passengers'] > min_passengers)
+    selected = entry['order'][keep][:top]
+    return '{{"type":"FeatureCollection","metric":"{0}","count":{1},"features":[{2}]}}'.format(
+        metric, len(selected), ','.join(entry['features'][selected]))
+
+def route_query_params(index, params, monthly_flights, monthly_passengers):
+    """
+    Parse and validate /routes query parameters, thresholds default to the map_creator monthly cuts
+    Return metric, top, min_flights, min_passengers, quarter
+    Raise ValueError for bad parameters
+    """
+    quarter = params.get('quarter', [None])[0]
+    quarter = int(quarter) if quarter not in [None, '', '0'] else None
+    metric = params.get('metric', ['AirlineDelay_20frac'])[0]
+    if (quarter, metric) not in index:
+        raise ValueError('unknown metric {0} or quarter {1}'.format(metric, quarter))
+    months = index[(quarter, metric)]['months']
+    top = int(params.get('top', [20])[0])
+    min_flights = float(params.get('min_flights', [monthly_flights * months])[0])
+    min_passengers = float(params.get('min_passengers', [monthly_passengers * months])[0])
+    if top < 0:
+        raise ValueError('top must be positive')
+    return metric, top, min_flights, min_passengers, quarter
+
+def http_response(writer, status, content_type, body):
+    """Write an HTTP/1.0 response and close the connection"""
+    if not isinstance(body, bytes):
+        body = body.encode('utf8')
+    writer.write('HTTP/1.0 {0}\r\nContent-Type: {1}\r\nContent-Length: {2}\r\n'
+                 'Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n'.format(
+                     status, content_type, len(body)).encode('latin-1'))
+    writer.write(body)
+
+async def handle_request(index, static_dir, config, monthly_flights, monthly_passengers, reader, writer):
+    """Serve GET /routes, /metrics, /config (front-end settings) and the static front-end (with its vendored Leaflet)"""
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        # skip headers
+        while (await reader.readline()) not in [b'\r\n', b'\n', b'']:
+            pass
+        if len(request_line) < 2 or request_line[0] != 'GET':
+            http_response(writer, '405 Method Not Allowed', 'text/plain', 'only GET is supported')
+            return
+        url = urlparse(request_line[1])
+        if url.path == '/routes':
+            try:
+                query = route_query_params(index, parse_qs(url.query), monthly_flights, monthly_passengers)
+            except ValueError as e:
+                http_response(writer, '400 Bad Request', 'application/json', json.dumps({'error': str(e)}))
+                return
+            http_response(writer, '200 OK', 'application/geo+json', query_routes(index, *query))
+        elif url.path == '/metrics':
+            metrics = {}
+            for (quarter, metric), entry in index.items():
+                metrics.setdefault(metric, entry['dataset'])
+            http_response(writer, '200 OK', 'application/json', json.dumps(metrics))
+        elif url.path == '/config':
+            http_response(writer, '200 OK', 'application/json', json.dumps(config))
+        else:
+            fname = os.path.normpath(url.path.lstrip('/') or 'index.html')
+            path = os.path.join(static_dir, fname)
+            if fname.startswith('..') or not os.path.isfile(path):
+                http_response(writer, '404 Not Found', 'text/plain', 'not found')
+                return
+            with open(path, 'rb') as f:
+                http_response(writer, '200 OK',
+                              CONTENT_TYPES.get(os.path.splitext(path)[1], 'application/octet-stream'), f.read())
+    finally:
+        await writer.drain()
+        writer.close()
+
+
+if __name__ == '__main__':
+    import numpy as np
+    import pandas as pd
+    import asyncio
+    import json
+    import os
+    import sys
+    import time
+    from functools import partial
+    from urllib.parse import urlparse, parse_qs
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+    parser = ArgumentParser(description='This script serves the aggregated route datasets from memory over a local HTTP service,\n'
+                                        'e.g. /routes?metric=occupancy_mean&top=50&min_flights=600&quarter=2 returns GeoJSON,\n'
+                                        'along with a map front-end that queries it.',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--host', dest='host',
+                        default='127.0.0.1',
+                        help='Host to serve on')
+    parser.add_argument('--port', dest='port',
+                        default=8050, type=int,
+                        help='Port to serve on')
+    parser.add_argument('--monthly-flights', dest='monthly_flights',
+                        default=50, type=int,
+                        help='Default minimum monthly flights over a route when min_flights is not given')
+    parser.add_argument('--monthly-passengers', dest='monthly_passengers',
+                        default=1000, type=int,
+                        help='Default minimum monthly passengers over a route when min_passengers is not given')
+    parser.add_argument('--basemap', dest='basemap',
+                        default=None,
+                        help='Basemap tile URL template for the front-end (e.g. https://tile.openstreetmap.org/{z}/{x}/{y}.png), '
+                             'default None draws the routes without a basemap and needs no external service')
+    parser.add_argument('--basemap-attribution', dest='basemap_attribution',
+                        default='',
+                        help='Attribution shown for the --basemap tiles')
+    args = parser.parse_args()
+
+    # front-end directory
+    static_dir = 'static'
+
+    start = time.time()
+    index = load_index()
+    print('loaded {0} route indexes in {1:.1f}s'.format(len(index), time.time() - start))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(asyncio.start_server(
+        partial(handle_request, index, static_dir, {'basemap': args.basemap, 'attribution': args.basemap_attribution},
+                args.monthly_flights, args.monthly_passengers),
+        args.host, args.port))
+    print('serving on http://{0}:{1}/'.format(args.host, args.port))
+    sys.stdout.flush()
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    server.close()
+    loop.run_until_complete(server.wait_closed())
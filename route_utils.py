@@ -0,0 +1,125 @@
+"""
+Route helpers shared by the scripts: integer route ids and their airport codes, approximate medians
+and quantiles from the histogram sketches stored with the aggregated data, and the great-circle arcs routes are drawn as.
+"""
+from __future__ import print_function
+
+import numpy as np
+
+# characters of the base 37 airport code digits, blank first
+ROUTE_CODE_ALPHABET = ' 0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+def route_ids(orig_codes, dest_codes):
+    """
+    Stable integer route id from the orig and dest airport codes
+    Each (up to 3 character) code is read as a base 37 number (blank, 0-9, A-Z) so ids are exact and
+    the same in every dataset and quarter: route_id = orig * 37**3 + dest
+    Raises ValueError for codes that wouldn't come back from route_codes (missing, longer than 3 characters
+    or with other characters than 0-9 and A-Z)
+    Return numpy array
+    """
+    lookup = np.full(128, -1, dtype=np.int64)
+    ## short codes are padded with blanks (the end of the string)
+    lookup[0] = 0
+    lookup[ord('0'):ord('9') + 1] = np.arange(1, 11)
+    lookup[ord('A'):ord('Z') + 1] = np.arange(11, 37)
+    ids = []
+    for codes in [orig_codes, dest_codes]:
+        ## lists as objects, so missing codes (NaN, None) aren't turned into the text 'nan' or 'None'
+        codes = np.asarray(codes, dtype=object if isinstance(codes, (list, tuple)) else None)
+        if codes.dtype.kind == 'O':
+            missing = (codes != codes) | (codes == None)
+        else:
+            missing = np.zeros(len(codes), dtype=bool) if codes.dtype.kind in 'US' else np.isnan(codes)
+        ## one character more than a code has to find the longer ones
+        chars = np.asarray(codes, dtype='U4').view(np.uint32).reshape(-1, 4)
+        chars = np.where((chars >= ord('a')) & (chars <= ord('z')), chars - 32, chars)
+        digits = lookup[np.minimum(chars[:, :3], 127)]
+        invalid = missing | (chars[:, 3] != 0) | (chars[:, :3] > 127).any(axis=1) | (digits < 0).any(axis=1)
+        if invalid.any():
+            raise ValueError('airport codes without a route id: {0}'.format(
+                ', '.join(repr(code) for code in codes[invalid][:5])))
+        ids.append(digits[:, 0] * 37 ** 2 + digits[:, 1] * 37 + digits[:, 2])
+    return ids[0] * 37 ** 3 + ids[1]
+
+def route_codes(route_ids):
+    """
+    Orig and dest airport codes of route ids (inverse of route_ids)
+    Return numpy arrays of orig and dest codes
+    """
+    alphabet = np.array(list(ROUTE_CODE_ALPHABET))
+    codes = []
+    for ids in [np.asarray(route_ids, dtype=np.int64) // 37 ** 3, np.asarray(route_ids, dtype=np.int64) % 37 ** 3]:
+        chars = alphabet[np.stack([ids // 37 ** 2, ids // 37 % 37, ids % 37], axis=1)]
+        codes.append(np.char.strip(np.array([''.join(c) for c in chars], dtype=str)))
+    return codes[0], codes[1]
+
+def hist_median(counts, bins):
+    """
+    Approximate median from histogram sketch counts (rows x bins), interpolated within the median bin
+    Return numpy array
+    """
+    total = counts.sum(axis=1)
+    cum = np.cumsum(counts, axis=1)
+    idx = np.minimum((cum < (total / 2.)[:, None]).sum(axis=1), len(bins) - 1)
+    rows = np.arange(len(counts))
+    below = np.where(idx > 0, cum[rows, np.maximum(idx - 1, 0)], 0)
+    in_bin = counts[rows, idx]
+    lower = np.asarray(bins, dtype=float)[idx]
+    upper = np.append(np.asarray(bins, dtype=float)[1:], np.nan)[idx]
+    frac = np.where(in_bin > 0, (total / 2. - below) / np.where(in_bin > 0, in_bin, 1), 0)
+    median = np.where(np.isnan(upper), lower, lower + frac * (upper - lower))
+    return np.where(total > 0, median, np.nan)
+
+def hist_quantile(counts, edges, q):
+    """
+    Approximate quantile from histogram counts (rows x bins) whose bin i holds (edges[i-1], edges[i]]
+    (first and last bins open ended, their quantiles are the edge), interpolated within the quantile's bin
+    Return numpy array
+    """
+    edges = np.asarray(edges, dtype=float)
+    total = counts.sum(axis=1)
+    cum = np.cumsum(counts, axis=1)
+    rows = np.arange(len(counts))
+    idx = np.minimum((cum < (total * q)[:, None]).sum(axis=1), len(edges))
+    below = np.where(idx > 0, cum[rows, np.maximum(idx - 1, 0)], 0)
+    in_bin = counts[rows, idx]
+    lower = edges[np.clip(idx - 1, 0, len(edges) - 1)]
+    upper = edges[np.minimum(idx, len(edges) - 1)]
+    frac = np.where(in_bin > 0, (total * q - below) / np.where(in_bin > 0, in_bin, 1), 0)
+    quantile = np.where((idx == 0) | (idx == len(edges)), upper, lower + frac * (upper - lower))
+    return np.where(total > 0, quantile, np.nan)
+
+def great_circle_arcs(orig_lat, orig_lon, dest_lat, dest_lon, offset, points=17):
+    """
+    Densified great-circle arcs (points points each) for a batch of routes, each offset to the right of
+    its direction of travel by offset degrees of arc at its midpoint, tapering to 0 at the airports
+    Return numpy array (routes x points x [lat, lon])
+    """
+    def unit_vectors(lat, lon):
+        lat = np.radians(np.asarray(lat, dtype=float))[:, None]
+        lon = np.radians(np.asarray(lon, dtype=float))[:, None]
+        return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+    a = unit_vectors(orig_lat, orig_lon)
+    b = unit_vectors(dest_lat, dest_lon)
+    t = np.linspace(0, 1, points)[None, :]
+
+    # spherical interpolation, falling back to linear for (nearly) identical airports
+    omega = np.arccos(np.clip(np.sum(a * b, axis=-1), -1, 1))
+    sin_omega = np.sin(omega)
+    arc = sin_omega > 1e-12
+    sin_omega = np.where(arc, sin_omega, 1)
+    weight_a = np.where(arc, np.sin((1 - t) * omega) / sin_omega, 1 - t)
+    weight_b = np.where(arc, np.sin(t * omega) / sin_omega, t)
+    points = weight_a[..., None] * a + weight_b[..., None] * b
+    points /= np.linalg.norm(points, axis=-1)[..., None]
+
+    # rotate towards the south pole of the great circle (the right of travel from orig to dest)
+    pole = np.cross(a, b)
+    pole_norm = np.linalg.norm(pole, axis=-1)[..., None]
+    pole = pole / np.where(pole_norm > 0, pole_norm, 1)
+    delta = np.radians(np.asarray(offset, dtype=float))[:, None] * np.sin(np.pi * t)
+    points = np.cos(delta)[..., None] * points - np.sin(delta)[..., None] * pole
+
+    return np.stack([np.degrees(np.arcsin(np.clip(points[..., 2], -1, 1))),
+                     np.degrees(np.arctan2(points[..., 1], points[..., 0]))], axis=-1)
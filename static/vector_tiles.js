@@ -0,0 +1,295 @@
+/*
+ * Mapbox Vector Tile layer for Leaflet, for the maps written by tile_exporter.py: fetches the {z}/{x}/{y}.pbf tiles,
+ * decodes their point and linestring features and draws them on one canvas per tile, styled per layer;
+ * a click on the map opens a popup with the properties of the nearest feature.
+ */
+(function() {
+    // protobuf reader over a tile's bytes
+    function Reader(buf, pos, end) {
+        this.buf = buf;
+        this.pos = pos || 0;
+        this.end = end === undefined ? buf.length : end;
+    }
+    Reader.prototype.varint = function() {
+        var value = 0, shift = 1, b;
+        do {
+            b = this.buf[this.pos++];
+            value += (b & 0x7f) * shift;
+            shift *= 128;
+        } while (b & 0x80);
+        return value;
+    };
+    Reader.prototype.sub = function() {
+        var len = this.varint();
+        var sub = new Reader(this.buf, this.pos, this.pos + len);
+        this.pos += len;
+        return sub;
+    };
+    Reader.prototype.string = function() {
+        var sub = this.sub(), s = '';
+        for (var i = sub.pos; i < sub.end; i++) {
+            s += '%' + ('0' + sub.buf[i].toString(16)).slice(-2);
+        }
+        return decodeURIComponent(s);
+    };
+    Reader.prototype.packed = function() {
+        var sub = this.sub(), values = [];
+        while (sub.pos < sub.end) {
+            values.push(sub.varint());
+        }
+        return values;
+    };
+    Reader.prototype.skip = function(wireType) {
+        if (wireType === 0) { this.varint(); }
+        else if (wireType === 1) { this.pos += 8; }
+        else if (wireType === 2) { this.pos += this.varint(); }
+        else if (wireType === 5) { this.pos += 4; }
+    };
+    Reader.prototype.fields = function(handle) {
+        while (this.pos < this.end) {
+            var tag = this.varint();
+            if (!handle(tag >> 3, tag & 7)) {
+                this.skip(tag & 7);
+            }
+        }
+    };
+
+    function zigzag(n) {
+        return n % 2 ? -(n + 1) / 2 : n / 2;
+    }
+
+    function readValue(r) {
+        var value = null;
+        r.fields(function(field, wireType) {
+            if (field === 1) { value = r.string(); }
+            else if (field === 3) {
+                value = new DataView(r.buf.buffer, r.buf.byteOffset + r.pos, 8).getFloat64(0, true);
+                r.pos += 8;
+            }
+            else if (field === 2) {
+                value = new DataView(r.buf.buffer, r.buf.byteOffset + r.pos, 4).getFloat32(0, true);
+                r.pos += 4;
+            }
+            else if (field === 4 || field === 5) { value = r.varint(); }
+            else if (field === 6) { value = zigzag(r.varint()); }
+            else if (field === 7) { value = !!r.varint(); }
+            else { return false; }
+            return true;
+        });
+        return value;
+    }
+
+    // geometry commands to parts of [x, y] vertices in tile coordinates
+    function readGeometry(commands) {
+        var parts = [], part = null, x = 0, y = 0, i = 0;
+        while (i < commands.length) {
+            var command = commands[i] & 7, count = commands[i] >> 3;
+            i++;
+            if (command === 7) {
+                if (part) { part.push(part[0]); }
+                continue;
+            }
+            for (var j = 0; j < count; j++) {
+                x += zigzag(commands[i++]);
+                y += zigzag(commands[i++]);
+                if (command === 1) {
+                    part = [];
+                    parts.push(part);
+                }
+                part.push([x, y]);
+            }
+        }
+        return parts;
+    }
+
+    function readLayer(r) {
+        var layer = {name: '', extent: 4096, features: []}, keys = [], values = [], raw = [];
+        r.fields(function(field) {
+            if (field === 1) { layer.name = r.string(); }
+            else if (field === 2) { raw.push(r.sub()); }
+            else if (field === 3) { keys.push(r.string()); }
+            else if (field === 4) { values.push(readValue(r.sub())); }
+            else if (field === 5) { layer.extent = r.varint(); }
+            else { return false; }
+            return true;
+        });
+        raw.forEach(function(fr) {
+            var feature = {type: 0, properties: {}, parts: []}, tags = [], commands = [];
+            fr.fields(function(field) {
+                if (field === 2) { tags = fr.packed(); }
+                else if (field === 3) { feature.type = fr.varint(); }
+                else if (field === 4) { commands = fr.packed(); }
+                else { return false; }
+                return true;
+            });
+            for (var i = 0; i + 1 < tags.length; i += 2) {
+                feature.properties[keys[tags[i]]] = values[tags[i + 1]];
+            }
+            feature.parts = readGeometry(commands);
+            layer.features.push(feature);
+        });
+        return layer;
+    }
+
+    function readTile(buf) {
+        var r = new Reader(buf), layers = [];
+        r.fields(function(field) {
+            if (field !== 3) { return false; }
+            layers.push(readLayer(r.sub()));
+            return true;
+        });
+        return layers;
+    }
+
+    // squared distance from p to the segment a-b
+    function segmentDist2(p, a, b) {
+        var dx = b[0] - a[0], dy = b[1] - a[1], t = 0;
+        if (dx || dy) {
+            t = Math.max(0, Math.min(1, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / (dx * dx + dy * dy)));
+        }
+        var x = a[0] + t * dx - p[0], y = a[1] + t * dy - p[1];
+        return x * x + y * y;
+    }
+
+    L.VectorTileLayer = L.GridLayer.extend({
+        options: {
+            // layer name -> style object or function(properties, zoom) returning one
+            // (color, weight, opacity for lines; radius, color, fillOpacity for points)
+            styles: {},
+            // click tolerance in screen pixels
+            clickTolerance: 6
+        },
+
+        initialize: function(url, options) {
+            this._url = url;
+            this._tileFeatures = {};
+            L.GridLayer.prototype.initialize.call(this, options);
+        },
+
+        onAdd: function(map) {
+            L.GridLayer.prototype.onAdd.call(this, map);
+            map.on('click', this._onClick, this);
+        },
+
+        onRemove: function(map) {
+            map.off('click', this._onClick, this);
+            L.GridLayer.prototype.onRemove.call(this, map);
+        },
+
+        createTile: function(coords, done) {
+            var tile = L.DomUtil.create('canvas', 'leaflet-tile');
+            var size = this.getTileSize();
+            var ratio = window.devicePixelRatio || 1;
+            tile.width = size.x * ratio;
+            tile.height = size.y * ratio;
+            var key = this._tileCoordsToKey(coords);
+            var self = this;
+            var request = new XMLHttpRequest();
+            request.open('GET', L.Util.template(this._url, coords));
+            request.responseType = 'arraybuffer';
+            request.onload = function() {
+                if (request.status === 200) {
+                    var layers = readTile(new Uint8Array(request.response));
+                    self._tileFeatures[key] = layers;
+                    self._draw(tile, layers, coords.z, size, ratio);
+                }
+                done(null, tile);
+            };
+            request.onerror = function() {
+                done(null, tile);
+            };
+            request.send();
+            return tile;
+        },
+
+        _style: function(layerName, properties, zoom) {
+            var style = this.options.styles[layerName] || {};
+            return typeof style === 'function' ? style(properties, zoom) : style;
+        },
+
+        _draw: function(tile, layers, zoom, size, ratio) {
+            var ctx = tile.getContext('2d');
+            var self = this;
+            layers.forEach(function(layer) {
+                var scale = size.x * ratio / layer.extent;
+                layer.features.forEach(function(feature) {
+                    var style = self._style(layer.name, feature.properties, zoom);
+                    ctx.globalAlpha = style.opacity === undefined ? 1 : style.opacity;
+                    ctx.strokeStyle = style.color || 'black';
+                    ctx.fillStyle = style.fillColor || style.color || 'black';
+                    ctx.lineWidth = (style.weight || 1) * ratio;
+                    ctx.beginPath();
+                    feature.parts.forEach(function(part) {
+                        if (feature.type === 1) {
+                            ctx.moveTo(part[0][0] * scale + (style.radius || 3) * ratio, part[0][1] * scale);
+                            ctx.arc(part[0][0] * scale, part[0][1] * scale, (style.radius || 3) * ratio, 0, 2 * Math.PI);
+                        } else {
+                            ctx.moveTo(part[0][0] * scale, part[0][1] * scale);
+                            for (var i = 1; i < part.length; i++) {
+                                ctx.lineTo(part[i][0] * scale, part[i][1] * scale);
+                            }
+                        }
+                    });
+                    if (feature.type === 1) {
+                        ctx.globalAlpha = style.fillOpacity === undefined ? 1 : style.fillOpacity;
+                        ctx.fill();
+                        ctx.globalAlpha = style.opacity === undefined ? 1 : style.opacity;
+                    }
+                    ctx.stroke();
+                });
+            });
+            ctx.globalAlpha = 1;
+        },
+
+        _onClick: function(e) {
+            var zoom = this._tileZoom;
+            if (zoom === undefined) {
+                return;
+            }
+            var size = this.getTileSize();
+            var point = this._map.project(e.latlng, zoom);
+            var coords = point.unscaleBy(size).floor();
+            coords.z = zoom;
+            var layers = this._tileFeatures[this._tileCoordsToKey(this._wrapCoords(coords))];
+            if (!layers) {
+                return;
+            }
+            // tile pixels per screen pixel when the tiles are overzoomed past the native zoom
+            var tileScale = this._map.getZoomScale(this._map.getZoom(), zoom);
+            var best = null, bestDist = Infinity;
+            layers.forEach(function(layer) {
+                var scale = layer.extent / size.x;
+                var p = [(point.x - coords.x * size.x) * scale, (point.y - coords.y * size.y) * scale];
+                var tolerance = this.options.clickTolerance * scale / tileScale;
+                layer.features.forEach(function(feature) {
+                    feature.parts.forEach(function(part) {
+                        var dist = part.length === 1 ? segmentDist2(p, part[0], part[0]) : Infinity;
+                        for (var i = 1; i < part.length; i++) {
+                            dist = Math.min(dist, segmentDist2(p, part[i - 1], part[i]));
+                        }
+                        if (dist <= tolerance * tolerance && dist < bestDist) {
+                            best = feature;
+                            bestDist = dist;
+                        }
+                    });
+                });
+            }, this);
+            if (best) {
+                var rows = [];
+                for (var name in best.properties) {
+                    rows.push(name + ': ' + best.properties[name]);
+                }
+                L.popup().setLatLng(e.latlng).setContent(rows.join('<BR>')).openOn(this._map);
+            }
+        },
+
+        _removeTile: function(key) {
+            delete this._tileFeatures[this._tileCoordsToKey(this._wrapCoords(this._keyToTileCoords(key)))];
+            L.GridLayer.prototype._removeTile.call(this, key);
+        }
+    });
+
+    L.vectorTileLayer = function(url, options) {
+        return new L.VectorTileLayer(url, options);
+    };
+})();
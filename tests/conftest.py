@@ -0,0 +1,149 @@
+"""
+The scripts live in the repository root and import numpy, pandas and the shared helpers in their __main__ blocks,
+so the tests put the root on the path and hand the modules the globals their functions use
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import route_utils
+
+
+def script_module(name, **extra):
+    """
+    Import a script as a module with the globals set up by its __main__ block
+    Return module
+    """
+    module = __import__(name)
+    module.np = np
+    module.pd = pd
+    for helper in ['route_ids', 'route_codes', 'hist_median', 'hist_quantile', 'great_circle_arcs']:
+        setattr(module, helper, getattr(route_utils, helper))
+    for key, value in extra.items():
+        setattr(module, key, value)
+    return module
+
+
+# synthetic airports (code, name, city, state, lat, lon) and routes of the raw data fixtures
+AIRPORTS = [('SFO', 'San Francisco International Airport', 'San Francisco', 'CA', 37.619, -122.375),
+            ('LAX', 'Los Angeles International Airport', 'Los Angeles', 'CA', 33.942, -118.408),
+            ('SAN', 'San Diego International Airport', 'San Diego', 'CA', 32.734, -117.190),
+            ('PDX', 'Portland International Airport', 'Portland', 'OR', 45.589, -122.598),
+            ('LAS', 'McCarran International Airport', 'Las Vegas', 'NV', 36.080, -115.152),
+            ('JFK', 'John F Kennedy International Airport', 'New York', 'NY', 40.640, -73.779)]
+ROUTES = [('SFO', 'LAX', 338), ('LAX', 'SFO', 338), ('SAN', 'SFO', 447), ('PDX', 'SFO', 550), ('LAS', 'LAX', 236),
+          ('SFO', 'JFK', 2586), ('PDX', 'LAS', 762)]
+
+
+def airport_states():
+    return dict((code, state) for code, name, city, state, lat, lon in AIRPORTS)
+
+
+def write_airports(data_dir):
+    """Write airports.csv (openflights layout, no header) of the synthetic airports"""
+    os.makedirs(os.path.join(data_dir, 'airports'))
+    rows = [[i + 1, name, city, 'United States', code, 'K' + code, lat, lon, 10, -8, 'A', 'America/Los_Angeles',
+             'airport', 'OurAirports'] for i, (code, name, city, state, lat, lon) in enumerate(AIRPORTS)]
+    pd.DataFrame(rows).to_csv(os.path.join(data_dir, 'airports', 'airports.csv'), header=False, index=False)
+
+
+def write_t100(data_dir, n=600, seed=0):
+    """
+    Write one T-100 segment file of n synthetic rows over the year 2016
+    Return pandas dataframe of the rows
+    """
+    rng = np.random.RandomState(seed)
+    states = airport_states()
+    route = rng.randint(len(ROUTES), size=n)
+    departures = rng.randint(1, 90, size=n)
+    seats = departures * rng.choice([76, 143, 175], size=n)
+    month = rng.randint(1, 13, size=n)
+    rows = pd.DataFrame({'DEPARTURES_SCHEDULED': departures + rng.randint(0, 3, size=n),
+                         'DEPARTURES_PERFORMED': departures,
+                         'PAYLOAD': 0,
+                         'SEATS': seats,
+                         'PASSENGERS': np.floor(seats * rng.uniform(0, 1, size=n)).astype(int),
+                         'FREIGHT': 0,
+                         'MAIL': 0,
+                         'DISTANCE': [ROUTES[i][2] for i in route],
+                         'RAMP_TO_RAMP': np.where(rng.uniform(size=n) < 0.1, np.nan, departures * rng.randint(50, 120, size=n)),
+                         'AIR_TIME': departures * rng.randint(40, 100, size=n),
+                         'UNIQUE_CARRIER': rng.choice(['AA', 'UA', 'WN', 'OO'], size=n),
+                         'AIRCRAFT_TYPE': rng.choice([612, 694, 698, 629], size=n),
+                         'ORIGIN': [ROUTES[i][0] for i in route],
+                         'ORIGIN_STATE_ABR': [states[ROUTES[i][0]] for i in route],
+                         'DEST': [ROUTES[i][1] for i in route],
+                         'DEST_STATE_ABR': [states[ROUTES[i][1]] for i in route],
+                         'YEAR': 2016,
+                         'QUARTER': (month - 1) // 3 + 1,
+                         'MONTH': month})
+    os.makedirs(os.path.join(data_dir, 'aircraft_occupancy'))
+    rows.to_csv(os.path.join(data_dir, 'aircraft_occupancy', 't100_2016.csv'), index=False)
+    return rows
+
+
+def write_on_time(data_dir, n=2000, seed=0):
+    """
+    Write one On-Time Performance file per quarter of n synthetic flights over the year 2016
+    Return pandas dataframe of the flights
+    """
+    rng = np.random.RandomState(seed)
+    states = airport_states()
+    route = rng.randint(len(ROUTES), size=n)
+    month = rng.randint(1, 13, size=n)
+    delayed = rng.uniform(size=n) < 0.6
+    rows = pd.DataFrame({'Year': 2016,
+                         'Quarter': (month - 1) // 3 + 1,
+                         'Month': month,
+                         'DayOfWeek': rng.randint(1, 8, size=n),
+                         'FlightDate': ['2016-{0:02d}-01'.format(m) for m in month],
+                         'UniqueCarrier': rng.choice(['AA', 'UA', 'WN'], size=n),
+                         'AirlineID': 1,
+                         'FlightNum': rng.randint(1, 3000, size=n),
+                         'OriginAirportID': 1,
+                         'Origin': [ROUTES[i][0] for i in route],
+                         'OriginState': [states[ROUTES[i][0]] for i in route],
+                         'OriginStateName': 'x',
+                         'DestAirportID': 2,
+                         'Dest': [ROUTES[i][1] for i in route],
+                         'DestState': [states[ROUTES[i][1]] for i in route],
+                         'DestStateName': 'y',
+                         'DepDelay': rng.randint(-10, 120, size=n).astype(float),
+                         'TaxiOut': rng.randint(5, 40, size=n),
+                         'ArrDelay': rng.randint(-30, 120, size=n).astype(float),
+                         'Cancelled': 0.0,
+                         'CancellationCode': '',
+                         'CarrierDelay': np.where(delayed, rng.randint(0, 60, size=n), np.nan),
+                         'SecurityDelay': 0,
+                         'WeatherDelay': 0,
+                         'NASDelay': 0,
+                         'LateAircraftDelay': np.where(delayed, rng.randint(0, 60, size=n), np.nan),
+                         'AirTime': rng.randint(40, 120, size=n),
+                         'ActualElapsedTime': rng.randint(60, 150, size=n),
+                         'Flights': np.where(rng.uniform(size=n) < 0.02, 0.0, 1.0),
+                         'Distance': [ROUTES[i][2] for i in route],
+                         'CRSDepTime': rng.randint(0, 24, size=n) * 100 + rng.randint(0, 60, size=n)})
+    os.makedirs(os.path.join(data_dir, 'aircraft_delays'))
+    for quarter, quarter_rows in rows.groupby('Quarter'):
+        quarter_rows.to_csv(os.path.join(data_dir, 'aircraft_delays', 'ot_2016_{0}.csv'.format(quarter)), index=False)
+    return rows
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """
+    Empty data directory with the synthetic airports, set as the data directory of data_aggregator
+    (airports loaded as in its __main__ block)
+    Return str
+    """
+    import data_aggregator
+    data_dir = str(tmp_path / 'data')
+    write_airports(data_dir)
+    monkeypatch.setattr(data_aggregator, 'data_dir', data_dir)
+    monkeypatch.setattr(data_aggregator, 'airports', data_aggregator.airport_data())
+    return data_dir
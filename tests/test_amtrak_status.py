@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_aggregator
+
+
+def test_status_minutes():
+    times = pd.Series(['1200A', '1230A', '1200P', '1245P', '1015A', '10:15A', '1015P', '915A', '9:15p',
+                       '2215', '0005', '', '   ', np.nan])
+    minutes = data_aggregator.status_minutes(times)
+    ## 12A is midnight and 12P noon, with or without a colon, any case, 24 hour times as they are
+    np.testing.assert_array_equal(minutes[:11], [0, 30, 720, 765, 615, 615, 1335, 555, 1275, 1335, 5])
+    assert np.isnan(minutes[11:]).all()
+
+
+def test_status_delays():
+    status = pd.DataFrame({'Origin Date': ['01/05/2016', '01/05/2016', '12/31/2015', '12/31/2015', '01/05/2016',
+                                           '01/05/2016', '01/05/2016'],
+                           'Station': [' sac', 'EMY', 'LAX', 'SBA', 'OKJ', 'SJC', 'GAC'],
+                           'Sch Ar': [np.nan, '1000A', '1150P', np.nan, '0800', np.nan, ''],
+                           'Sch Dp': ['1015A', np.nan, np.nan, '1205A', '', np.nan, ''],
+                           'Act Ar': [np.nan, '10:30A', '1210A', np.nan, '0755', np.nan, '1000A'],
+                           'Act Dp': ['10:20A', '', np.nan, '1155P', '0830', np.nan, '']})
+    delays = data_aggregator.status_delays(status)
+    ## departures first, arrivals where a departure is missing, late or early across midnight,
+    ## stops without a scheduled and actual time dropped
+    assert delays['code'].tolist() == ['SAC', 'EMY', 'LAX', 'SBA', 'OKJ']
+    assert delays['delay'].tolist() == [5, 30, 20, -10, -5]
+    assert delays['year'].tolist() == [2016, 2016, 2015, 2015, 2016]
+
+
+def test_amtrak_status_delays(tmp_path):
+    rng = np.random.RandomState(3)
+    n = 500
+    sch = rng.randint(0, 1440, size=n)
+    delay = np.where(rng.uniform(size=n) < 0.2, rng.randint(-10, 0, size=n), rng.randint(0, 200, size=n))
+    act = (sch + delay) % 1440
+    stations = rng.choice(['SAC', 'EMY', 'CHI', 'NYP'], size=n)
+    years = rng.choice([2015, 2016], size=n)
+    status = pd.DataFrame({'Origin Date': ['06/01/{0}'.format(year) for year in years],
+                           'Station': stations,
+                           'Sch Ar': '',
+                           'Sch Dp': ['{0:02d}{1:02d}'.format(t // 60, t % 60) for t in sch],
+                           'Act Ar': '',
+                           'Act Dp': ['{0}{1:02d}{2}'.format((t // 60) % 12 or 12, t % 60, 'P' if t >= 720 else 'A')
+                                      for t in act]})
+    ## two files, read in chunks smaller than a file so stations first show up in later chunks
+    status.iloc[:200].to_csv(str(tmp_path / 'status_1.csv'), index=False)
+    status.iloc[200:].to_csv(str(tmp_path / 'status_2.csv'), index=False)
+    station_delays = data_aggregator.amtrak_status_delays(str(tmp_path), chunksize=37)
+
+    expected = pd.DataFrame({'code': stations, 'year': years, 'delay': delay}).groupby(['code', 'year'])['delay']
+    expected = pd.DataFrame({'delay_n': expected.size(), 'delay_avg': expected.mean(),
+                             'delays': expected.apply(lambda d: np.sort(d.values))}).reset_index()
+    merged = pd.merge(station_delays, expected, on=['code', 'year'], suffixes=('', '_expected'))
+    assert len(merged) == len(station_delays) == len(expected)
+    assert (merged['delay_n'] == merged['delay_n_expected']).all()
+    np.testing.assert_allclose(merged['delay_avg'], merged['delay_avg_expected'], atol=0.05)
+    ## a quantile lands in the histogram bin of the delay it falls on (the ceil(n * q)-th smallest)
+    edges = np.asarray(data_aggregator.DELAY_HIST_EDGES['DepDelay'])
+    for q, col in [(0.5, 'delay_med'), (0.9, 'delay_q90')]:
+        exact = np.array([d[int(np.ceil(len(d) * q)) - 1] for d in merged['delays']])
+        idx = np.searchsorted(edges, exact, side='left')
+        assert ((merged[col] >= edges[idx - 1] - 0.05) & (merged[col] <= edges[idx] + 0.05)).all()
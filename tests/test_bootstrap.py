@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_aggregator
+
+
+@pytest.fixture(scope='module')
+def routes_rows():
+    """Synthetic routes with known fractions and means, as route and row dataframes"""
+    rng = np.random.RandomState(5)
+    sizes = [400, 1000, 2500, 150]
+    probs = [0.1, 0.3, 0.5, 0.8]
+    means = [5.0, 20.0, 12.0, 40.0]
+    rows = []
+    for route_id, (n, p, mean) in enumerate(zip(sizes, probs, means)):
+        rows.append(pd.DataFrame({'route_id': route_id,
+                                  'late': rng.uniform(size=n) < p,
+                                  'delay': np.round(rng.exponential(mean, size=n)),
+                                  'passengers': rng.randint(50, 150, size=n).astype(float)}))
+        rows[-1]['seats'] = rows[-1]['passengers'] + rng.randint(0, 60, size=n)
+    rows = pd.concat(rows, ignore_index=True)
+    ## a missing delay is left out of the mean
+    rows.loc[rows.index[::50], 'delay'] = np.nan
+    routes = pd.DataFrame({'route_id': np.arange(len(sizes) + 1)})
+    return routes, rows
+
+METRICS = [('late_frac', 'late', None), ('delay_mean', 'delay', None), ('load', 'passengers', 'seats')]
+
+
+def bootstrap(routes_rows, replicates=2000, seed=0, workers=1):
+    routes, rows = routes_rows
+    return data_aggregator.bootstrap_cis(routes.copy(), rows, METRICS, replicates=replicates, seed=seed, workers=workers)
+
+
+def test_intervals_contain_the_exact_values(routes_rows):
+    routes, rows = routes_rows
+    cis = bootstrap(routes_rows)
+    grouped = rows.groupby('route_id')
+    exact = {'late_frac': grouped['late'].mean(), 'delay_mean': grouped['delay'].mean(),
+             'load': grouped['passengers'].sum() / grouped['seats'].sum()}
+    for metric, y_col, x_col in METRICS:
+        lo = cis['{0}_lo'.format(metric)].values[:4]
+        hi = cis['{0}_hi'.format(metric)].values[:4]
+        assert ((lo <= exact[metric].values) & (exact[metric].values <= hi) & (lo < hi)).all(), metric
+    ## a route without rows has no interval
+    assert cis.iloc[4][['late_frac_lo', 'delay_mean_hi', 'load_lo']].isnull().all()
+
+
+def test_interval_widths(routes_rows):
+    routes, rows = routes_rows
+    cis = bootstrap(routes_rows, replicates=4000)
+    grouped = rows.groupby('route_id')
+    ## binomial draws: width of the normal interval 2 * 1.96 * sqrt(p (1 - p) / n)
+    p, n = grouped['late'].mean(), grouped['late'].size()
+    expected = 2 * 1.96 * np.sqrt(p * (1 - p) / n)
+    np.testing.assert_allclose((cis['late_frac_hi'] - cis['late_frac_lo']).values[:4], expected.values, rtol=0.15)
+    ## Poisson weights: width of the mean's normal interval 2 * 1.96 * sd / sqrt(n) (rows with a value)
+    delays = grouped['delay']
+    expected = 2 * 1.96 * delays.std(ddof=0) / np.sqrt(delays.count())
+    np.testing.assert_allclose((cis['delay_mean_hi'] - cis['delay_mean_lo']).values[:4], expected.values, rtol=0.15)
+
+
+def test_seed_gives_the_same_intervals_with_any_workers(routes_rows):
+    one = bootstrap(routes_rows, replicates=230, seed=3, workers=1)
+    for workers in [2, 3]:
+        pd.testing.assert_frame_equal(bootstrap(routes_rows, replicates=230, seed=3, workers=workers), one)
+    assert not bootstrap(routes_rows, replicates=230, seed=4, workers=1).equals(one)
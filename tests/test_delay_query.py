@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from conftest import script_module
+
+delay_query = script_module('delay_query')
+
+
+def histogram(route_id, counts, missing, edges=(0, 10, 20)):
+    return {'route_id': np.array(route_id, dtype=np.int64), 'edges': np.array(edges, dtype=float),
+            'counts': np.array(counts, dtype=np.int64), 'missing': np.array(missing, dtype=np.int64)}
+
+
+def test_merge_delay_histograms():
+    merged = delay_query.merge_delay_histograms([histogram([5, 7], [[1, 0, 0, 0], [0, 1, 0, 0]], [1, 0]),
+                                                 histogram([7, 3], [[0, 0, 2, 0], [0, 0, 0, 3]], [2, 4])])
+    assert list(merged['route_id']) == [3, 5, 7]
+    assert merged['counts'].tolist() == [[0, 0, 0, 3], [1, 0, 0, 0], [0, 1, 2, 0]]
+    assert merged['missing'].tolist() == [4, 1, 2]
+
+
+def test_merge_delay_histograms_different_edges():
+    with pytest.raises(ValueError):
+        delay_query.merge_delay_histograms([histogram([1], [[1, 0, 0, 0]], [0]),
+                                            histogram([1], [[1, 0, 0, 0]], [0], edges=(0, 15, 30))])
+
+
+def test_hist_exceedance():
+    ## bins (-inf, 0], (0, 10], (10, 20], (20, inf)
+    hist = histogram([1, 2, 3], [[1, 2, 3, 4], [1, 2, 3, 4], [0, 0, 0, 0]], [0, 10, 0])
+    ## a threshold on an edge is exact: the 3 + 4 flights over 10
+    assert delay_query.hist_exceedance(hist, 10)[:2].tolist() == [0.7, 0.35]
+    ## 15 splits (10, 20] in half, flights without a value count as not over it
+    assert delay_query.hist_exceedance(hist, 15)[:2].tolist() == [0.55, 0.275]
+    ## thresholds are clipped to the edges
+    assert delay_query.hist_exceedance(hist, 100)[0] == 0.4
+    assert np.isnan(delay_query.hist_exceedance(hist, 10)[2])
+
+
+def test_hist_exceedance_matches_flights_on_edges():
+    ## flights delayed exactly by bin edges: the fractions over an edge are the flights' own fractions
+    rng = np.random.RandomState(0)
+    edges = np.arange(0, 121, 5)
+    delays = rng.choice(edges, size=(4, 200))
+    counts = np.stack([np.bincount(np.searchsorted(edges, row, side='left'), minlength=len(edges) + 1)
+                       for row in delays])
+    hist = histogram(np.arange(4), counts, np.zeros(4), edges=edges)
+    for threshold in [15, 45, 90]:
+        np.testing.assert_allclose(delay_query.hist_exceedance(hist, threshold), (delays > threshold).mean(axis=1))
@@ -0,0 +1,27 @@
+from multiprocessing import Pool
+import os
+
+import data_aggregator
+
+
+def test_claim_task_is_exclusive(tmpdir):
+    claims_dir = str(tmpdir)
+    assert data_aggregator.claim_task(claims_dir, 'aircraft_delay_2016_1')
+    assert not data_aggregator.claim_task(claims_dir, 'aircraft_delay_2016_1')
+    assert data_aggregator.claim_task(claims_dir, 'aircraft_delay_2016_2')
+    with open(os.path.join(claims_dir, 'aircraft_delay_2016_1')) as f:
+        assert f.read().endswith(':{0}'.format(os.getpid()))
+
+
+def claim_all(args):
+    claims_dir, task_ids = args
+    return [task_id for task_id in task_ids if data_aggregator.claim_task(claims_dir, task_id)]
+
+
+def test_claim_task_racing_workers(tmpdir):
+    ## workers racing for the same tasks (in different orders) claim every task exactly once
+    task_ids = ['task_{0}'.format(i) for i in range(200)]
+    with Pool(4) as pool:
+        claimed = pool.map(claim_all, [(str(tmpdir), task_ids[::step]) for step in [1, -1, 1, -1]])
+    claimed = sum(claimed, [])
+    assert sorted(claimed) == sorted(task_ids)
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import script_module, write_t100
+import data_aggregator
+
+occupancy_query = script_module('occupancy_query')
+
+
+@pytest.fixture
+def source_rows(data_dir):
+    """Synthetic T-100 rows of the cube (cut to CA routes under 800mi with passengers as data_aggregator does)"""
+    rows = write_t100(data_dir)
+    rows = rows.loc[((rows['ORIGIN_STATE_ABR'] == 'CA') | (rows['DEST_STATE_ABR'] == 'CA')) &
+                    (rows['DISTANCE'] < 800) & (rows['PASSENGERS'] > 0)]
+    rows = rows.rename(columns={'ORIGIN': 'orig_code', 'DEST': 'dest_code', 'UNIQUE_CARRIER': 'carrier'})
+    rows['period'] = rows['YEAR'] * 100 + rows['MONTH']
+    rows['occupancy'] = rows['PASSENGERS'] / rows['SEATS']
+    return rows
+
+
+@pytest.fixture
+def cube(source_rows):
+    """Occupancy cube built by data_aggregator from the synthetic T-100 file"""
+    return data_aggregator.occupancy_cube()
+
+
+def expected_rollup(rows, by):
+    grouped = rows.groupby(by)
+    expected = pd.DataFrame({'DEPARTURES_PERFORMED_sum': grouped['DEPARTURES_PERFORMED'].sum(),
+                             'SEATS_sum': grouped['SEATS'].sum(),
+                             'PASSENGERS_sum': grouped['PASSENGERS'].sum(),
+                             'occupancy_mean': grouped['occupancy'].mean(),
+                             'occupancy_lower_med': grouped['occupancy'].apply(lambda v: np.sort(v.values)[(len(v) + 1) // 2 - 1]),
+                             'DISTANCE_mean': grouped['DISTANCE'].mean()})
+    expected['occupancy_total'] = expected['PASSENGERS_sum'] / expected['SEATS_sum']
+    return expected.reset_index()
+
+
+@pytest.mark.parametrize('quarters,carriers', [(None, None), ([2], None), ([1, 4], ['UA', 'WN'])])
+def test_route_rollup_matches_source_rows(source_rows, cube, quarters, carriers):
+    keep = occupancy_query.cube_slice(cube, quarters=quarters, carriers=carriers)
+    rollup = occupancy_query.cube_rollup(cube, keep, by=('route',))
+
+    rows = source_rows
+    if quarters:
+        rows = rows.loc[((rows['period'] % 100 - 1) // 3 + 1).isin(quarters)]
+    if carriers:
+        rows = rows.loc[rows['carrier'].isin(carriers)]
+    expected = expected_rollup(rows, ['orig_code', 'dest_code'])
+    merged = pd.merge(rollup, expected, on=['orig_code', 'dest_code'], how='outer', suffixes=('', '_expected'))
+    assert len(merged) == len(rollup) == len(expected)
+    for col in ['DEPARTURES_PERFORMED_sum', 'SEATS_sum', 'PASSENGERS_sum', 'occupancy_total', 'occupancy_mean',
+                'DISTANCE_mean']:
+        np.testing.assert_allclose(merged[col], merged['{0}_expected'.format(col)])
+    ## the approximate median is within the bin of the ceil(n / 2)-th smallest occupancy
+    bins = np.append(data_aggregator.OCCUPANCY_BINS, np.inf)
+    idx = np.clip(np.searchsorted(bins, merged['occupancy_lower_med'].values, side='right') - 1, 0, len(bins) - 2)
+    assert ((merged['occupancy_med'] >= bins[idx] - 1e-9) & (merged['occupancy_med'] <= bins[idx + 1] + 1e-9)).all()
+
+def test_multi_dimension_rollup_totals(source_rows, cube):
+    keep = occupancy_query.cube_slice(cube)
+    rollup = occupancy_query.cube_rollup(cube, keep, by=('month', 'carrier', 'aircraft_type'))
+    assert len(rollup) == len(source_rows.groupby(['period', 'carrier', 'AIRCRAFT_TYPE']))
+    assert rollup['PASSENGERS_sum'].sum() == source_rows['PASSENGERS'].sum()
+    assert rollup['SEATS_sum'].sum() == source_rows['SEATS'].sum()
+    assert set(rollup['carrier']) == set(source_rows['carrier'])
+
+
+def test_cube_cells(source_rows, cube):
+    cells = source_rows.groupby(['orig_code', 'dest_code', 'period', 'carrier', 'AIRCRAFT_TYPE'])
+    assert len(cube['route_id']) == len(cells)
+    assert list(cube['carriers']) == sorted(source_rows['carrier'].unique())
+    for col in ['DEPARTURES_SCHEDULED', 'DEPARTURES_PERFORMED', 'SEATS', 'PASSENGERS']:
+        assert cube[col].sum() == source_rows[col].sum()
+    assert cube['AIR_TIME_sum'].sum() == source_rows['AIR_TIME'].sum()
+    ## every row of a cell counted once in its occupancy histogram
+    np.testing.assert_array_equal(cube['occupancy_hist'].sum(axis=1), cube['rows'])
+    assert sorted(cube['rows']) == sorted(cells.size().values)
+
+
+def test_unknown_carrier(cube):
+    with pytest.raises(ValueError):
+        occupancy_query.cube_slice(cube, carriers=['ZZ'])
@@ -0,0 +1,64 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import script_module
+
+map_creator = script_module('map_creator', json=json)
+
+
+def brute_force_fronts(values):
+    """Fronts by peeling off the rows no remaining row dominates, NaN as lowest"""
+    values = np.where(np.isnan(values), -np.inf, values)
+    front = np.zeros(len(values), dtype=int)
+    remaining = np.arange(len(values))
+    n = 0
+    while len(remaining):
+        n += 1
+        rest = values[remaining]
+        dominated = np.array([((rest >= row).all(axis=1) & (rest > row).any(axis=1)).any() for row in rest])
+        front[remaining[~dominated]] = n
+        remaining = remaining[dominated]
+    return front
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_pareto_fronts_match_brute_force(seed):
+    rng = np.random.RandomState(seed)
+    ## few distinct values, so ties, duplicate rows and many fronts are common, and some NaN
+    values = rng.randint(0, 5, size=(300, 4)).astype(float)
+    values[rng.uniform(size=values.shape) < 0.1] = np.nan
+    values = np.concatenate([values, values[:40]])
+    np.testing.assert_array_equal(map_creator.pareto_fronts(values), brute_force_fronts(values))
+
+
+def test_pareto_fronts_duplicates_and_nan():
+    values = np.array([[1., 1.], [1., 1.], [2., np.nan], [2., 0.], [0., 2.], [np.nan, np.nan]])
+    ## identical rows don't dominate each other, NaN is below every value
+    assert map_creator.pareto_fronts(values).tolist() == [1, 1, 2, 1, 1, 3]
+
+
+def test_pareto_ranking():
+    rng = np.random.RandomState(7)
+    n = 60
+    facts = pd.DataFrame({'route_id': np.arange(n), 'orig_code': ['A{0}'.format(i) for i in range(n)],
+                          'dest_code': 'SFO'})
+    keeps = {}
+    for dataset, col in map_creator.PARETO_METRICS:
+        facts['{0}__{1}'.format(dataset, col)] = rng.uniform(size=n)
+        facts['has_{0}'.format(dataset)] = True
+        keeps[dataset] = pd.Series(rng.uniform(size=n) < 0.8, index=facts.index)
+    ranked = map_creator.pareto_ranking(facts, keeps)
+
+    rows = np.logical_or.reduce([keeps[dataset].values for dataset, col in map_creator.PARETO_METRICS])
+    assert sorted(ranked['route_id']) == list(np.flatnonzero(rows))
+    metrics = np.column_stack([facts['{0}__{1}'.format(dataset, col)].where(keeps[dataset]).values
+                               for dataset, col in map_creator.PARETO_METRICS])
+    np.testing.assert_array_equal(ranked['pareto_front'].values, brute_force_fronts(metrics)[ranked['route_id'].values])
+    ## ranks go by front, then by descending score
+    assert ranked['pareto_rank'].tolist() == list(range(1, len(ranked) + 1))
+    assert (np.diff(ranked['pareto_front'].values) >= 0).all()
+    same_front = np.diff(ranked['pareto_front'].values) == 0
+    assert (np.diff(ranked['pareto_score'].values)[same_front] <= 0).all()
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_aggregator
+
+
+def brute_force_pairs(lat, lon, query_lat, query_lon, radius):
+    dist = data_aggregator.geocalc(np.repeat(query_lat, len(lat)), np.repeat(query_lon, len(lat)),
+                                   np.tile(lat, len(query_lat)), np.tile(lon, len(query_lat))).reshape(len(query_lat), len(lat))
+    query, point = np.nonzero(dist <= radius)
+    return set(zip(query.tolist(), point.tolist()))
+
+
+@pytest.mark.parametrize('radius', [5, 25, 300])
+def test_points_within_matches_brute_force(radius):
+    rng = np.random.RandomState(2)
+    ## clusters around a few cities plus points near the poles and the antimeridian
+    lat = np.concatenate([rng.normal(37.6, 0.5, 300), rng.normal(34.0, 0.5, 300), rng.uniform(85, 90, 50),
+                          rng.uniform(-60, 60, 50)])
+    lon = np.concatenate([rng.normal(-122.3, 0.5, 300), rng.normal(-118.3, 0.5, 300), rng.uniform(-180, 180, 50),
+                          rng.uniform(179, 180, 25), rng.uniform(-180, -179, 25)])
+    query_lat = np.concatenate([rng.normal(37.6, 0.5, 40), rng.normal(34.0, 0.5, 40), [89.9, 0, 0]])
+    query_lon = np.concatenate([rng.normal(-122.3, 0.5, 40), rng.normal(-118.3, 0.5, 40), [10, 179.99, -179.99]])
+
+    query, point, dist = data_aggregator.points_within(lat, lon, query_lat, query_lon, radius)
+    pairs = list(zip(query.tolist(), point.tolist()))
+    assert len(pairs) == len(set(pairs))
+    assert set(pairs) == brute_force_pairs(lat, lon, query_lat, query_lon, radius)
+    np.testing.assert_allclose(dist, data_aggregator.geocalc(query_lat[query], query_lon[query], lat[point], lon[point]))
+
+
+def test_rail_alternatives_matches_brute_force():
+    routes = pd.DataFrame({'route_id': [1, 2, 3],
+                           'orig_code': ['SFO', 'BUR', 'SMF'], 'orig_city': ['San Francisco', 'Burbank', 'Sacramento'],
+                           'orig_lat': [37.62, 34.20, 38.70], 'orig_lon': [-122.38, -118.36, -121.59],
+                           'dest_code': ['LAX', 'OAK', 'BOI'], 'dest_city': ['Los Angeles', 'Oakland', 'Boise'],
+                           'dest_lat': [33.94, 37.72, 43.56], 'dest_lon': [-118.41, -122.22, -116.22]})
+    stations = pd.DataFrame({'code': ['SFC', 'EMY', 'OKJ', 'LAX', 'BUR', 'SAC', 'GLN'],
+                             'city_caps': ['SAN FRANCISCO', 'EMERYVILLE', 'OAKLAND', 'LOS ANGELES', 'BURBANK',
+                                           'SACRAMENTO', 'GLENDALE'],
+                             'lat': [37.79, 37.84, 37.79, 34.06, 34.19, 38.58, 34.12],
+                             'lon': [-122.40, -122.29, -122.27, -118.24, -118.35, -121.50, -118.26],
+                             'Users': [100., 200., 300., 400., 500., 600., 700.],
+                             'delay_avg': [1., 2., 3., 4., 5., 6., 7.],
+                             'delay_med': [1., 2., 3., 4., 5., 6., 7.]})
+    radius = 25
+    alternatives = data_aggregator.rail_alternatives(routes, stations, radius=radius)
+
+    expected = set()
+    for route in routes.itertuples():
+        orig_dist = data_aggregator.geocalc(route.orig_lat, route.orig_lon, stations['lat'].values, stations['lon'].values)
+        dest_dist = data_aggregator.geocalc(route.dest_lat, route.dest_lon, stations['lat'].values, stations['lon'].values)
+        for i in np.flatnonzero(orig_dist <= radius):
+            for j in np.flatnonzero(dest_dist <= radius):
+                if i != j:
+                    expected.add((route.route_id, stations['code'][i], stations['code'][j]))
+    assert set(zip(alternatives['route_id'], alternatives['orig_station_code'], alternatives['dest_station_code'])) == expected
+    assert len(alternatives) == len(expected)
+    ## SMF-BOI has no station near Boise
+    assert 3 not in set(alternatives['route_id'])
+    assert (alternatives['orig_station_airport_dist'] <= radius).all()
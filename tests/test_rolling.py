@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import write_on_time, write_t100
+import data_aggregator
+
+
+def full_year_window(dataset, raw_dir, partials_func, period_months):
+    """The one complete 12 month window (2016-12) of the partials of the synthetic data"""
+    partials = data_aggregator.update_partials(dataset, raw_dir, partials_func)
+    rolling = data_aggregator.rolling_routes(dataset, partials, period_months, window_months=12)
+    assert (rolling['window_end'] == '2016-12').all()
+    return rolling
+
+
+def compare(rolling, routes, exact_cols, median_col, bins):
+    merged = pd.merge(rolling, routes, on='route_id', suffixes=('', '_loader'))
+    assert len(merged) == len(rolling) == len(routes)
+    for col in ['orig_code', 'orig_name', 'dest_code', 'dest_city']:
+        assert (merged[col] == merged['{0}_loader'.format(col)]).all()
+    for col in ['orig_lat', 'dest_lon']:
+        np.testing.assert_allclose(merged[col], merged['{0}_loader'.format(col)].astype(float))
+    for col in exact_cols:
+        np.testing.assert_allclose(merged[col], merged['{0}_loader'.format(col)], err_msg=col)
+    ## the median from the histogram sketch is within a bin of the bin of the exact median
+    ## (an even count's exact median is between two values, possibly of neighboring bins)
+    edges = np.concatenate([[-np.inf], np.asarray(bins, dtype=float), [np.inf]])
+    idx = np.searchsorted(edges, merged['{0}_loader'.format(median_col)].values, side='right') - 1
+    assert ((merged[median_col] >= edges[np.maximum(idx - 1, 0)]) &
+            (merged[median_col] <= edges[np.minimum(idx + 2, len(edges) - 1)])).all()
+
+def test_delay_window_matches_loader(data_dir):
+    write_on_time(data_dir)
+    rolling = full_year_window('aircraft_delay', 'aircraft_delays', 'delay_partials', 1)
+    routes = data_aggregator.aircraft_delay_data(None)
+    compare(rolling, routes, ['Flight_Count', 'AirlineDelay_10frac', 'AirlineDelay_20frac', 'AirlineDelay_30frac',
+                              'AirlineDelay_mean', 'Distance_mean', 'AirTime_mean', 'ActualElapsedTime_mean'],
+            'AirlineDelay_med', data_aggregator.DELAY_BINS)
+
+
+def test_occupancy_window_matches_loader(data_dir):
+    write_t100(data_dir)
+    rolling = full_year_window('aircraft_occupancy', 'aircraft_occupancy', 'occupancy_partials', 1)
+    routes = data_aggregator.aircraft_occupancy_data(None)
+    compare(rolling, routes, ['DEPARTURES_PERFORMED_sum', 'SEATS_sum', 'PASSENGERS_sum', 'occupancy_total',
+                              'occupancy_mean', 'DISTANCE_mean', 'RAMP_TO_RAMP_mean', 'AIR_TIME_mean'],
+            'occupancy_med', data_aggregator.OCCUPANCY_BINS)
+
+
+def test_windows_subtract_expired_months(data_dir):
+    ## 3 month windows over monthly partials: every window is the sum of its own 3 months
+    rows = write_t100(data_dir)
+    partials = data_aggregator.update_partials('aircraft_occupancy', 'aircraft_occupancy', 'occupancy_partials')
+    rolling = data_aggregator.rolling_routes('aircraft_occupancy', partials, 1, window_months=3)
+    assert sorted(rolling['window_end'].unique()) == ['2016-{0:02d}'.format(m) for m in range(3, 13)]
+    cut = rows.loc[(rows['ORIGIN_STATE_ABR'] == 'CA') | (rows['DEST_STATE_ABR'] == 'CA')]
+    cut = cut.loc[(cut['DISTANCE'] < 800) & (cut['PASSENGERS'] > 0)]
+    for end in [3, 7, 12]:
+        window = cut.loc[(cut['MONTH'] > end - 3) & (cut['MONTH'] <= end)]
+        expected = window.groupby(['ORIGIN', 'DEST'])['SEATS'].sum()
+        got = rolling.loc[rolling['window_end'] == '2016-{0:02d}'.format(end)].set_index(['orig_code', 'dest_code'])['SEATS_sum']
+        pd.testing.assert_series_equal(got.sort_index(), expected.sort_index().astype(float), check_names=False)
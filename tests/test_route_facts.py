@@ -0,0 +1,67 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from conftest import AIRPORTS, airport_states, script_module
+
+import data_aggregator
+
+
+def route_frame(pairs, state_cols):
+    """Route info columns of the synthetic airports for (orig, dest) pairs, with a dataset's state column names"""
+    airports = dict((code, (name, city, lat, lon)) for code, name, city, state, lat, lon in AIRPORTS)
+    states = airport_states()
+    rows = []
+    for orig, dest in pairs:
+        row = {'orig_code': orig, 'dest_code': dest, state_cols[0]: states[orig], state_cols[1]: states[dest]}
+        for prefix, code in [('orig', orig), ('dest', dest)]:
+            for col, value in zip(['name', 'city', 'lat', 'lon'], airports[code]):
+                row['{0}_{1}'.format(prefix, col)] = value
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def test_route_facts_round_trip(tmp_path):
+    ## delays written with route ids and on-time state columns, classes without route ids and with T-100 ones
+    delays = route_frame([('SFO', 'LAX'), ('LAX', 'SFO'), ('LAS', 'LAX')], ['OriginState', 'DestState'])
+    delays.insert(0, 'route_id', data_aggregator.route_utils.route_ids(delays['orig_code'], delays['dest_code']))
+    delays['Flight_Count'] = [1200, 950, 40]
+    delays['AirlineDelay_mean'] = [12.5, 8.0, np.nan]
+    classes = route_frame([('SFO', 'LAX'), ('PDX', 'SFO')], ['ORIGIN_STATE_ABR', 'DEST_STATE_ABR'])
+    classes['PASSENGERS_sum'] = [310.0, 45.0]
+    classes['Market_Count'] = [12, 3]
+    delays.to_csv(str(tmp_path / 'aircraft_delay_routes.csv'), index=False)
+    classes.to_csv(str(tmp_path / 'flyer_class_routes.csv'), index=False)
+
+    ## written as the --route-facts step does
+    facts, dtypes = data_aggregator.route_fact_table(str(tmp_path))
+    facts.to_csv(str(tmp_path / 'route_facts.csv'), index=False)
+    with open(str(tmp_path / 'route_facts_dtypes.json'), 'w') as f:
+        json.dump(dtypes, f, indent=1)
+    map_creator = script_module('map_creator', json=json)
+    read = map_creator.read_route_facts(str(tmp_path))
+
+    pd.testing.assert_frame_equal(read, facts)
+    assert read['aircraft_delay__Flight_Count'].dtype == 'Int64'
+    assert read['flyer_class__Market_Count'].dtype == 'Int64'
+    assert read['has_aircraft_delay'].dtype == bool and read['has_flyer_class'].dtype == bool
+    assert 'aircraft_occupancy__PASSENGERS_sum' not in read.columns and 'has_aircraft_occupancy' not in read.columns
+
+    ## one row per route of either dataset, in route id order
+    route_ids = data_aggregator.route_utils.route_ids(['SFO', 'LAX', 'LAS', 'PDX'], ['LAX', 'SFO', 'LAX', 'SFO'])
+    assert list(read['route_id']) == sorted(route_ids)
+    read = read.set_index(['orig_code', 'dest_code'])
+    assert read.loc[('PDX', 'SFO'), 'orig_state'] == 'OR' and read.loc[('LAS', 'LAX'), 'dest_state'] == 'CA'
+    assert list(read.loc[[('SFO', 'LAX'), ('LAX', 'SFO'), ('PDX', 'SFO')], 'has_aircraft_delay']) == [True, True, False]
+    assert list(read.loc[[('SFO', 'LAX'), ('LAX', 'SFO'), ('PDX', 'SFO')], 'has_flyer_class']) == [True, False, True]
+    assert read.loc[('SFO', 'LAX'), 'aircraft_delay__Flight_Count'] == 1200
+    assert read.loc[('SFO', 'LAX'), 'flyer_class__Market_Count'] == 12
+
+    ## routes a dataset doesn't cover are missing in its columns, counts included
+    assert read.loc[('PDX', 'SFO'), 'aircraft_delay__Flight_Count'] is pd.NA
+    assert np.isnan(read.loc[('PDX', 'SFO'), 'aircraft_delay__AirlineDelay_mean'])
+    assert read.loc[('LAX', 'SFO'), 'flyer_class__Market_Count'] is pd.NA
+    assert np.isnan(read.loc[('LAS', 'LAX'), 'flyer_class__PASSENGERS_sum'])
+    ## a missing value of a covered route stays missing
+    assert read.loc[('LAS', 'LAX'), 'has_aircraft_delay'] and np.isnan(read.loc[('LAS', 'LAX'), 'aircraft_delay__AirlineDelay_mean'])
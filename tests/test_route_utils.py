@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from route_utils import route_ids, route_codes, hist_median, hist_quantile
+
+
+def test_route_ids_round_trip():
+    orig = np.array(['SFO', 'LAX', 'BUR', 'A1', 'Z', '9ZZ'])
+    dest = np.array(['LAX', 'SFO', 'OAK', 'SAN', 'ZZZ', '000'])
+    ids = route_ids(orig, dest)
+    assert len(np.unique(ids)) == len(ids)
+    round_orig, round_dest = route_codes(ids)
+    assert list(round_orig) == list(orig)
+    assert list(round_dest) == list(dest)
+
+
+def test_route_ids_are_case_insensitive_and_exact():
+    assert route_ids(['sfo'], ['lax'])[0] == route_ids(['SFO'], ['LAX'])[0]
+    ## blank 0, digits 1-10, letters 11-36
+    assert route_ids(['A'], ['1'])[0] == 11 * 37 ** 2 * 37 ** 3 + 2 * 37 ** 2
+
+
+@pytest.mark.parametrize('code', ['SFOX', 'S-F', 'S F', 'ÉAB', np.nan, None])
+def test_route_ids_reject_codes_without_round_trip(code):
+    ## too long, characters outside 0-9 and A-Z, or missing (would be read as 'NAN')
+    with pytest.raises(ValueError):
+        route_ids(np.array(['SFO', code], dtype=object), np.array(['LAX', 'SFO'], dtype=object))
+    with pytest.raises(ValueError):
+        route_ids(['LAX', 'SFO'], ['SFO', code])
+
+
+def test_route_codes_empty():
+    orig, dest = route_codes(np.array([], dtype=np.int64))
+    assert len(orig) == 0 and len(dest) == 0
+
+
+def test_hist_median():
+    bins = [0, 10, 20, 30]
+    counts = np.array([[2, 2, 0, 0],
+                       [0, 0, 0, 5],
+                       [0, 0, 0, 0]])
+    median = hist_median(counts, bins)
+    ## half of the 4 values is reached at the end of the first bin, the open ended last bin gives its edge
+    assert median[0] == 10
+    assert median[1] == 30
+    assert np.isnan(median[2])
+
+
+def test_hist_quantile():
+    ## bins (-inf, 0], (0, 10], (10, 20], (20, inf)
+    edges = [0, 10, 20]
+    counts = np.array([[1, 2, 3, 4],
+                       [0, 0, 0, 0]])
+    ## the median (5th of 10 values) is 2 of the 3 values into (10, 20]
+    assert hist_quantile(counts, edges, 0.5)[0] == pytest.approx(10 + 10 * 2 / 3.)
+    ## quantiles in the open ended bins are their edge
+    assert hist_quantile(counts, edges, 0.95)[0] == 20
+    assert hist_quantile(counts, edges, 0.05)[0] == 0
+    assert np.isnan(hist_quantile(counts, edges, 0.5)[1])
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_aggregator
+
+
+@pytest.fixture(scope='module')
+def population():
+    """Synthetic rows of 3 routes over 4 months with a ratio y / x per route"""
+    rng = np.random.RandomState(2)
+    rows = []
+    for route_id in range(3):
+        for month in range(1, 5):
+            n = rng.randint(30, 200)
+            x = rng.randint(50, 180, size=n).astype(float)
+            rows.append(pd.DataFrame({'route_id': route_id, 'period': 201600 + month, 'x': x,
+                                      'y': np.floor(x * rng.uniform(0.3 + 0.2 * route_id, 1, size=n))}))
+    return pd.concat(rows, ignore_index=True)
+
+
+def test_full_sample_is_exact(population):
+    sample = data_aggregator.stratified_sample(population, ['route_id', 'period'], 1.0)
+    assert len(sample) == len(population)
+    estimates = data_aggregator.sample_estimates(sample, ['route_id', 'period'], 'y', 'x')
+    totals = population.groupby('route_id')[['y', 'x']].sum()
+    np.testing.assert_allclose(estimates['estimate'], totals['y'] / totals['x'])
+    ## every row sampled: no sampling error left
+    np.testing.assert_allclose(estimates['se'], 0, atol=1e-12)
+    np.testing.assert_allclose(estimates['lo'], estimates['hi'])
+
+
+def test_ratio_standard_error(population):
+    sample = data_aggregator.stratified_sample(population, ['route_id', 'period'], 0.2, min_rows=10, seed=4)
+    estimates = data_aggregator.sample_estimates(sample, ['route_id', 'period'], 'y', 'x')
+    sizes = population.groupby(['route_id', 'period']).size()
+    for route_id, route in sample.groupby('route_id'):
+        ## stratified ratio estimate and its linearized variance, stratum by stratum
+        strata = [(sizes[route_id, period], stratum) for period, stratum in route.groupby('period')]
+        Y = sum(N * stratum['y'].mean() for N, stratum in strata)
+        X = sum(N * stratum['x'].mean() for N, stratum in strata)
+        R = Y / X
+        var = sum(N ** 2 * (1 - len(stratum) * 1.0 / N) * np.var(stratum['y'] - R * stratum['x'], ddof=1) / len(stratum)
+                  for N, stratum in strata)
+        assert estimates.loc[route_id, 'estimate'] == pytest.approx(R)
+        assert estimates.loc[route_id, 'se'] == pytest.approx(np.sqrt(var) / X)
+        assert 0 < estimates.loc[route_id, 'se']
+        assert estimates.loc[route_id, 'hi'] - estimates.loc[route_id, 'lo'] == pytest.approx(2 * 1.96 * np.sqrt(var) / X)
+    ## at most max(min_rows, frac * rows) rows of a stratum
+    n = sample.groupby(['route_id', 'period']).size()
+    assert (n == np.minimum(sizes, np.maximum(10, np.ceil(0.2 * sizes)))).all()
+
+
+def test_mean_standard_error(population):
+    ## a mean is a ratio with x = 1: the usual standard error of a mean with finite population correction
+    rows = population.loc[population['route_id'] == 0].assign(period=0, one=1)
+    sample = data_aggregator.stratified_sample(rows, ['route_id', 'period'], 0.25, seed=1)
+    estimate = data_aggregator.sample_estimates(sample, ['route_id', 'period'], 'y', 'one').loc[0]
+    N, n = len(rows), len(sample)
+    assert estimate['estimate'] == pytest.approx(sample['y'].mean())
+    assert estimate['se'] == pytest.approx(np.sqrt((1 - n * 1.0 / N) * sample['y'].var(ddof=1) / n))
+
+
+def test_rank_intervals():
+    rng = np.random.RandomState(0)
+    estimate = rng.uniform(size=40)
+    half = rng.uniform(0, 0.2, size=40)
+    lo, hi = estimate - half, estimate + half
+    rank, best, worst, uncertain = data_aggregator.rank_intervals(lo, hi, estimate, top=10)
+    assert sorted(rank) == list(range(1, 41))
+    assert (rank[np.argsort(-estimate)] == np.arange(1, 41)).all()
+    for i in range(40):
+        ## routes certainly above the route, and the ones that could be
+        assert best[i] == 1 + (lo > hi[i]).sum()
+        assert worst[i] == 1 + np.delete(hi > lo[i], i).sum()
+        assert best[i] <= rank[i] <= worst[i]
+    assert (uncertain == ((best <= 10) & (worst > 10))).all()
@@ -0,0 +1,160 @@
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+from conftest import script_module
+
+tile_exporter = script_module('tile_exporter', os=os, struct=struct, sys=__import__('sys'), text_type=str)
+
+
+def read_varint(buf, pos):
+    value, shift = 0, 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        value |= (b & 0x7f) << shift
+        shift += 7
+        if not b & 0x80:
+            return value, pos
+
+
+def read_fields(buf):
+    """Protobuf fields of a message as a list of (field, value), length-delimited values as bytes"""
+    fields, pos = [], 0
+    while pos < len(buf):
+        tag, pos = read_varint(buf, pos)
+        field, wire_type = tag >> 3, tag & 7
+        if wire_type == 0:
+            value, pos = read_varint(buf, pos)
+        elif wire_type == 1:
+            value, pos = buf[pos:pos + 8], pos + 8
+        elif wire_type == 2:
+            length, pos = read_varint(buf, pos)
+            value, pos = buf[pos:pos + length], pos + length
+        else:
+            raise ValueError('unexpected wire type {0}'.format(wire_type))
+        fields.append((field, value))
+    return fields
+
+
+def packed(buf):
+    values, pos = [], 0
+    while pos < len(buf):
+        value, pos = read_varint(buf, pos)
+        values.append(value)
+    return values
+
+
+def unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def decode_value(buf):
+    field, value = read_fields(buf)[0]
+    if field == 1:
+        return value.decode('utf8')
+    if field == 3:
+        return struct.unpack('<d', value)[0]
+    if field == 5:
+        return value
+    if field == 6:
+        return unzigzag(value)
+    if field == 7:
+        return bool(value)
+    raise ValueError('unexpected value field {0}'.format(field))
+
+
+def decode_geometry(commands):
+    parts, x, y, i = [], 0, 0, 0
+    while i < len(commands):
+        command, count = commands[i] & 7, commands[i] >> 3
+        i += 1
+        for _ in range(count):
+            x += unzigzag(commands[i])
+            y += unzigzag(commands[i + 1])
+            i += 2
+            if command == 1:
+                parts.append([])
+            parts[-1].append((x, y))
+    return parts
+
+
+def decode_tile(buf):
+    """Decode a vector tile to dict of layer name -> dict of extent, version and features (id, type, properties, parts)"""
+    layers = {}
+    for field, layer_buf in read_fields(buf):
+        assert field == 3
+        fields = read_fields(layer_buf)
+        keys = [value.decode('utf8') for f, value in fields if f == 3]
+        values = [decode_value(value) for f, value in fields if f == 4]
+        features = []
+        for f, feature_buf in fields:
+            if f != 2:
+                continue
+            feature = dict(read_fields(feature_buf))
+            tags = packed(feature[2])
+            features.append({'id': feature[1], 'type': feature[3],
+                             'properties': dict((keys[tags[i]], values[tags[i + 1]]) for i in range(0, len(tags), 2)),
+                             'parts': decode_geometry(packed(feature[4]))})
+        layers[dict(fields)[1].decode('utf8')] = {'extent': dict(fields)[5], 'version': dict(fields)[15],
+                                                  'features': features}
+    return layers
+
+
+def test_encode_layer_round_trip():
+    properties = [{'code': u'SFO', 'passengers': 1250000, 'delta': -3, 'delay_20frac': 0.125, 'hub': True},
+                  {'code': u'São Paulo', 'passengers': 0, 'delay_20frac': 0.125},
+                  {'code': u'LAX', 'passengers': np.int64(300), 'delay_20frac': np.float64(2.5), 'hub': np.bool_(False)}]
+    lines = [(0, [[(10, 20), (4000, 30), (2000, 4090)]]),
+             (2, [[(-50, -60), (100, 100)], [(4100, 4100), (3000, 2000), (3001, 2001)]])]
+    tile = decode_tile(tile_exporter.encode_layer('routes', lines, properties, 2) +
+                       tile_exporter.encode_layer('airports', [(1, [[(7, 8)]])], properties, 1))
+
+    assert tile['routes']['extent'] == tile_exporter.EXTENT and tile['routes']['version'] == 2
+    routes = tile['routes']['features']
+    assert [feature['id'] for feature in routes] == [0, 2]
+    assert all(feature['type'] == 2 for feature in routes)
+    assert routes[0]['parts'] == lines[0][1]
+    assert routes[1]['parts'] == lines[1][1]
+    assert routes[0]['properties'] == properties[0]
+    assert routes[1]['properties'] == {'code': u'LAX', 'passengers': 300, 'delay_20frac': 2.5, 'hub': False}
+
+    airports = tile['airports']['features']
+    assert airports == [{'id': 1, 'type': 1, 'properties': properties[1], 'parts': [[(7, 8)]]}]
+
+
+def test_export_tiles_simplifies_route_arcs(tmpdir):
+    routes = pd.DataFrame({'orig_code': ['SFO', 'SEA'], 'orig_name': ['a', 'b'], 'orig_city': ['c', 'd'],
+                           'orig_lat': [37.62, 47.45], 'orig_lon': [-122.38, -122.31],
+                           'dest_code': ['BOS', 'SAN'], 'dest_name': ['e', 'f'], 'dest_city': ['g', 'h'],
+                           'dest_lat': [42.36, 32.73], 'dest_lon': [-71.01, -117.19],
+                           'weight': [2.0, 1.0]})
+    for fname, metric_cols in tile_exporter.ROUTE_METRICS:
+        for prop in metric_cols.values():
+            routes[prop] = 1.0
+    airports = pd.DataFrame({'code': ['SFO'], 'name': ['a'], 'city': ['c'], 'passengers': [10],
+                             'lat': [37.62], 'lon': [-122.38], 'weight': [10.0]})
+    stations = pd.DataFrame({'city_caps': ['OAKLAND'], 'State': ['CA'], 'code': ['OKJ'], 'Users': [5.0],
+                             'delay_avg': [np.nan], 'delay_med': [np.nan], 'lat': [37.79], 'lon': [-122.27],
+                             'weight': [5.0]})
+    tile_dir = str(tmpdir)
+    tile_exporter.export_tiles(tile_dir, routes, airports, stations, 2, 8, 8, 500)
+
+    def route_vertices(zoom):
+        vertices = {}
+        for root, dirs, files in os.walk(os.path.join(tile_dir, str(zoom))):
+            for fname in files:
+                with open(os.path.join(root, fname), 'rb') as f:
+                    layers = decode_tile(f.read())
+                for feature in layers.get('routes', {'features': []})['features']:
+                    vertices[feature['id']] = vertices.get(feature['id'], 0) + sum(len(part) for part in feature['parts'])
+        return vertices
+
+    low, high = route_vertices(2), route_vertices(8)
+    assert set(low) == set(high) == {0, 1}
+    ## the cross-country arc keeps its curve at zoom 8 but is simplified to a few vertices at zoom 2
+    assert high[0] > 10
+    assert low[0] < high[0]
+    assert low[0] < tile_exporter.ARC_POINTS
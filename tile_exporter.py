@@ -0,0 +1,483 @@
+"""
+This script exports the aggregated route, airport and Amtrak station datasets as Mapbox Vector Tiles,
+simplified and thinned per zoom level, so the full route network can be drawn by a vector tile layer
+instead of one marker and line per route.
+"""
+from __future__ import print_function
+
+# tile coordinate extent and clipping buffer (in tile coordinate units)
+EXTENT = 4096
+BUFFER = 64
+
+# points per great-circle route arc, dense enough for the highest zoom levels; simplification per zoom drops the rest
+ARC_POINTS = 65
+
+# route metrics taken from each aggregated dataset (dataset, {dataset column: tile property})
+ROUTE_METRICS = [('aircraft_delay_routes.csv', {'AirlineDelay_20frac': 'delay_20frac',
+                                                'AirlineDelay_mean': 'delay_mean',
+                                                'Flight_Count': 'flights'}),
+                 ('aircraft_occupancy_routes.csv', {'occupancy_mean': 'occupancy_mean',
+                                                    'PASSENGERS_sum': 'passengers',
+                                                    'DEPARTURES_PERFORMED_sum': 'departures'}),
+                 ('flyer_class_routes.csv', {'class_bf_frac': 'class_bf_frac',
+                                             'PASSENGERS_sum': 'class_sample_passengers'}),
+                 ('flyer_stopover_routes.csv', {'stopover_frac': 'stopover_frac',
+                                                'PASSENGERS_sum': 'stopover_sample_passengers'})]
+
+ROUTE_COLS = ['orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon',
+              'dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon']
+
+VIEWER_TEMPLATE = u"""<!DOCTYPE html>
+<html>
+<head>
+    <meta http-equiv="content-type" content="text/html; charset=UTF-8" />
+    <link rel="stylesheet" href="static/leaflet/leaflet.css" />
+    <script src="static/leaflet/leaflet.js"></script>
+    <script src="static/vector_tiles.js"></script>
+    <style>html, body, #map {{ width: 100%; height: 100%; margin: 0; padding: 0; }}</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+    var map = L.map('map', {{center: [43, -118], zoom: 5}});
+    var basemap = {basemap};
+    if (basemap) {{
+        L.tileLayer(basemap.url, {{attribution: basemap.attribution}}).addTo(map);
+    }}
+
+    L.vectorTileLayer('{tile_url}', {{
+        minNativeZoom: {min_zoom},
+        maxNativeZoom: {max_zoom},
+        styles: {{
+            routes: function(properties, zoom) {{
+                var passengers = properties.passengers || 0;
+                return {{color: 'green', weight: 1 + 3 * Math.min(1, passengers / 1000000), opacity: 0.6}};
+            }},
+            airports: {{radius: 3, color: 'blue', fill: true, fillOpacity: 0.8, weight: 1}},
+            amtrak: {{radius: 3, color: 'red', fill: true, fillOpacity: 0.8, weight: 1}}
+        }}
+    }}).addTo(map);
+</script>
+</body>
+</html>
+"""
+
+def route_features(input_dir):
+    """
+    Combine the aggregated route datasets into one feature per orig/dest route,
+    with each dataset's metrics as properties (missing where a dataset has no data for the route)
+    Return pandas dataframe
+    """
+    route_dfs = []
+    for fname, metric_cols in ROUTE_METRICS:
+        route_df = pd.read_csv('{0}/{1}'.format(input_dir, fname))
+        route_dfs.append(route_df[ROUTE_COLS + list(metric_cols.keys())].rename(columns=metric_cols))
+
+    # descriptive columns from whichever dataset has the route
+    routes = pd.concat([route_df[ROUTE_COLS] for route_df in route_dfs]).drop_duplicates(['orig_code', 'dest_code'])
+    for route_df in route_dfs:
+        metric_df = route_df.drop([col for col in ROUTE_COLS if col not in ['orig_code', 'dest_code']], axis=1)
+        routes = pd.merge(routes, metric_df, on=['orig_code', 'dest_code'], how='left')
+
+    # thinning weight, 10x for the 10% sample of domestic tickets where T-100 passengers are missing
+    routes['weight'] = routes['passengers'].fillna(routes['class_sample_passengers'] * 10) \
+                                           .fillna(routes['stopover_sample_passengers'] * 10).fillna(0)
+    routes = routes.reset_index(drop=True)
+    print('{0} routes'.format(len(routes)))
+    return routes
+
+def airport_features(routes):
+    """
+    Airports at either end of the routes, weighted by the passengers on their routes
+    Return pandas dataframe
+    """
+    orig = routes[['orig_code', 'orig_name', 'orig_city', 'orig_lat', 'orig_lon', 'weight']]
+    orig.columns = ['code', 'name', 'city', 'lat', 'lon', 'weight']
+    dest = routes[['dest_code', 'dest_name', 'dest_city', 'dest_lat', 'dest_lon', 'weight']]
+    dest.columns = ['code', 'name', 'city', 'lat', 'lon', 'weight']
+    airports = pd.concat([orig, dest]).groupby('code', as_index=False).agg(
+        {'name': 'first', 'city': 'first', 'lat': 'first', 'lon': 'first', 'weight': 'sum'})
+    airports['passengers'] = airports['weight']
+    print('{0} airports'.format(len(airports)))
+    return airports
+
+def station_features(input_dir):
+    """
+    Amtrak stations with ridership and delays, weighted by ridership
+    Return pandas dataframe
+    """
+    amtrak_plus = pd.read_csv('{0}/amtrak_plus.csv'.format(input_dir))
+    stations = amtrak_plus[['city_caps', 'State', 'code', 'lat', 'lon', 'Users', 'delay_avg', 'delay_med']]
+    stations = stations.drop_duplicates('code').reset_index(drop=True)
+    stations['weight'] = stations['Users'].fillna(0)
+    print('{0} amtrak stations'.format(len(stations)))
+    return stations
+
+def mercator(lat, lon, zoom):
+    """
+    Return web mercator world coordinates (in tile coordinate units) at zoom level
+    """
+    scale = EXTENT * 2.0 ** zoom
+    lat = np.radians(np.clip(np.asarray(lat, dtype=float), -85.0511, 85.0511))
+    x = (np.asarray(lon, dtype=float) + 180.0) / 360.0 * scale
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0 * scale
+    return x, y
+
+def simplify(xy, tolerance):
+    """
+    Douglas-Peucker simplification of an (n, 2) vertex array
+    Return boolean array of vertices to keep
+    """
+    keep = np.zeros(len(xy), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(xy) - 1)]
+    while stack:
+        i0, i1 = stack.pop()
+        if i1 - i0 < 2:
+            continue
+        d = xy[i1] - xy[i0]
+        seg_len = np.hypot(d[0], d[1])
+        rel = xy[i0 + 1:i1] - xy[i0]
+        if seg_len == 0:
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dist = np.abs(d[0] * rel[:, 1] - d[1] * rel[:, 0]) / seg_len
+        i_max = np.argmax(dist)
+        if dist[i_max] > tolerance:
+            i_mid = i0 + 1 + i_max
+            keep[i_mid] = True
+            stack.append((i0, i_mid))
+            stack.append((i_mid, i1))
+    return keep
+
+def line_segments(lines, zoom, tolerance):
+    """
+    Project, quantize and simplify line features at zoom level
+    lines: list of (n, 2) [lat, lon] vertex arrays
+    Return feature index and start/end world coordinate arrays for every remaining segment
+    """
+    feature_idx, x0, y0, x1, y1 = [], [], [], [], []
+    for i, line in enumerate(lines):
+        line = np.asarray(line, dtype=float)
+        x, y = mercator(line[:, 0], line[:, 1], zoom)
+        xy = np.round(np.column_stack([x, y]))
+        # drop repeated vertices after quantization, then simplify what is left
+        moved = np.ones(len(xy), dtype=bool)
+        moved[1:] = np.any(xy[1:] != xy[:-1], axis=1)
+        xy = xy[moved]
+        if len(xy) < 2:
+            continue
+        xy = xy[simplify(xy, tolerance)]
+        feature_idx.append(np.full(len(xy) - 1, i))
+        x0.append(xy[:-1, 0])
+        y0.append(xy[:-1, 1])
+        x1.append(xy[1:, 0])
+        y1.append(xy[1:, 1])
+    if not feature_idx:
+        empty = np.array([])
+        return empty.astype(int), empty, empty, empty, empty
+    return (np.concatenate(feature_idx), np.concatenate(x0), np.concatenate(y0),
+            np.concatenate(x1), np.concatenate(y1))
+
+def clip_segments(feature_idx, x0, y0, x1, y1):
+    """
+    Clip every segment to every tile (plus buffer) its bounding box covers (vectorized Liang-Barsky)
+    Return tile x, tile y, feature index and clipped tile-local segment coordinates
+    """
+    tx0 = np.floor((np.minimum(x0, x1) - BUFFER) / EXTENT).astype(int)
+    tx1 = np.floor((np.maximum(x0, x1) + BUFFER) / EXTENT).astype(int)
+    ty0 = np.floor((np.minimum(y0, y1) - BUFFER) / EXTENT).astype(int)
+    ty1 = np.floor((np.maximum(y0, y1) + BUFFER) / EXTENT).astype(int)
+    nx = tx1 - tx0 + 1
+    ny = ty1 - ty0 + 1
+
+    # one row per (segment, tile) candidate
+    seg = np.repeat(np.arange(len(x0)), nx * ny)
+    offset = np.arange(len(seg)) - np.repeat(np.cumsum(nx * ny) - nx * ny, nx * ny)
+    tx = tx0[seg] + offset % nx[seg]
+    ty = ty0[seg] + offset // nx[seg]
+
+    sx, sy = x0[seg], y0[seg]
+    dx, dy = x1[seg] - sx, y1[seg] - sy
+    xmin, xmax = tx * EXTENT - BUFFER, (tx + 1) * EXTENT + BUFFER
+    ymin, ymax = ty * EXTENT - BUFFER, (ty + 1) * EXTENT + BUFFER
+    t0 = np.zeros(len(seg))
+    t1 = np.ones(len(seg))
+    valid = np.ones(len(seg), dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for p, q in [(-dx, sx - xmin), (dx, xmax - sx), (-dy, sy - ymin), (dy, ymax - sy)]:
+            r = q / p
+            parallel = p == 0
+            valid &= ~(parallel & (q < 0))
+            entering = (p < 0) & ~parallel
+            leaving = (p > 0) & ~parallel
+            t0 = np.where(entering, np.maximum(t0, r), t0)
+            t1 = np.where(leaving, np.minimum(t1, r), t1)
+    valid &= t0 <= t1
+
+    cx0 = np.round(sx + t0 * dx - tx * EXTENT).astype(int)
+    cy0 = np.round(sy + t0 * dy - ty * EXTENT).astype(int)
+    cx1 = np.round(sx + t1 * dx - tx * EXTENT).astype(int)
+    cy1 = np.round(sy + t1 * dy - ty * EXTENT).astype(int)
+    valid &= (cx0 != cx1) | (cy0 != cy1)
+    return tx[valid], ty[valid], feature_idx[seg[valid]], cx0[valid], cy0[valid], cx1[valid], cy1[valid]
+
+def line_tiles(lines, weights, zoom, tolerance, max_features):
+    """
+    Tile line features at zoom level, keeping the max_features heaviest features per tile
+    Return dict of (tile x, tile y) -> list of (feature index, list of tile-local vertex lists)
+    """
+    feature_idx, x0, y0, x1, y1 = line_segments(lines, zoom, tolerance)
+    tx, ty, f, cx0, cy0, cx1, cy1 = clip_segments(feature_idx, x0, y0, x1, y1)
+    order = np.lexsort((f, ty, tx))
+    tiles = {}
+    for i in order:
+        tile = tiles.setdefault((tx[i], ty[i]), {})
+        parts = tile.setdefault(f[i], [])
+        # join onto the previous part when the segments connect
+        if parts and parts[-1][-1] == (cx0[i], cy0[i]):
+            parts[-1].append((cx1[i], cy1[i]))
+        else:
+            parts.append([(cx0[i], cy0[i]), (cx1[i], cy1[i])])
+
+    thinned = {}
+    for key, tile in tiles.items():
+        ranked = sorted(tile.keys(), key=lambda fi: -weights[fi])[:max_features]
+        thinned[key] = [(fi, tile[fi]) for fi in ranked]
+    return thinned
+
+def point_tiles(lats, lons, weights, zoom, max_features):
+    """
+    Tile point features at zoom level, keeping the max_features heaviest features per tile
+    Return dict of (tile x, tile y) -> list of (feature index, [[tile-local vertex]])
+    """
+    x, y = mercator(lats, lons, zoom)
+    tx = np.floor(x / EXTENT).astype(int)
+    ty = np.floor(y / EXTENT).astype(int)
+    px = np.round(x - tx * EXTENT).astype(int)
+    py = np.round(y - ty * EXTENT).astype(int)
+    order = np.lexsort((-np.asarray(weights, dtype=float), ty, tx))
+    tiles = {}
+    for i in order:
+        tile = tiles.setdefault((tx[i], ty[i]), [])
+        if len(tile) < max_features:
+            tile.append((i, [[(px[i], py[i])]]))
+    return tiles
+
+def _varint(n):
+    """Protobuf varint encoding of a non-negative integer"""
+    out = bytearray()
+    n = int(n)
+    while True:
+        bits = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+def _field(field, data):
+    """Protobuf length-delimited field"""
+    return _varint(field << 3 | 2) + _varint(len(data)) + data
+
+def _value(value):
+    """Protobuf encoding of a vector tile Value message"""
+    if isinstance(value, (bool, np.bool_)):
+        return _varint(7 << 3) + _varint(int(value))
+    if isinstance(value, (int, np.integer)):
+        if value >= 0:
+            return _varint(5 << 3) + _varint(value)
+        return _varint(6 << 3) + _varint(_zigzag(int(value)))
+    if isinstance(value, (float, np.floating)):
+        return _varint(3 << 3 | 1) + struct.pack('<d', value)
+    return _field(1, text_type(value).encode('utf8'))
+
+def _geometry(geom_type, parts):
+    """Vector tile geometry command integers for point (1) or linestring (2) parts"""
+    commands = []
+    cx, cy = 0, 0
+    for part in parts:
+        commands.append(1 | 1 << 3)
+        for i, (x, y) in enumerate(part):
+            if geom_type == 2 and i == 1:
+                commands.append(2 | (len(part) - 1) << 3)
+            commands.append(_zigzag(int(x - cx)))
+            commands.append(_zigzag(int(y - cy)))
+            cx, cy = x, y
+    return commands
+
+def encode_layer(name, features, properties, geom_type):
+    """
+    Protobuf encoding of a vector tile layer
+    features: list of (feature index, parts)
+    properties: list of property dicts per feature index (missing values left out)
+    """
+    keys, values = [], []
+    key_idx, value_idx = {}, {}
+    feature_bytes = []
+    for fi, parts in features:
+        tags = []
+        for key, value in properties[fi].items():
+            if key not in key_idx:
+                key_idx[key] = len(keys)
+                keys.append(key)
+            value_key = (type(value).__name__, value)
+            if value_key not in value_idx:
+                value_idx[value_key] = len(values)
+                values.append(value)
+            tags += [key_idx[key], value_idx[value_key]]
+        geometry = _geometry(geom_type, parts)
+        feature = _varint(1 << 3) + _varint(fi) + \
+                  _field(2, b''.join(_varint(t) for t in tags)) + \
+                  _varint(3 << 3) + _varint(geom_type) + \
+                  _field(4, b''.join(_varint(g) for g in geometry))
+        feature_bytes.append(_field(2, feature))
+
+    layer = _varint(15 << 3) + _varint(2) + _field(1, name.encode('utf8')) + b''.join(feature_bytes) + \
+            b''.join(_field(3, key.encode('utf8')) for key in keys) + \
+            b''.join(_field(4, _value(value)) for value in values) + \
+            _varint(5 << 3) + _varint(EXTENT)
+    return _field(3, layer)
+
+def feature_properties(df, cols):
+    """Return list of property dicts per row, leaving out missing values"""
+    properties = []
+    for row in df[cols].itertuples(index=False):
+        props = {}
+        for col, value in zip(cols, row):
+            if pd.isnull(value):
+                continue
+            if isinstance(value, (float, np.floating)) and float(value).is_integer() and col != 'lat' and col != 'lon':
+                value = int(value)
+            props[col] = value
+        properties.append(props)
+    return properties
+
+def export_tiles(tile_dir, routes, airports, stations, min_zoom, max_zoom, tolerance, max_features):
+    """
+    Write {tile_dir}/{z}/{x}/{y}.pbf vector tiles with routes, airports and amtrak layers
+    Return number of tiles written
+    """
+    # the great-circle arcs map_creator.py draws (without its offset of out and back routes)
+    route_lines = great_circle_arcs(routes['orig_lat'].values, routes['orig_lon'].values, routes['dest_lat'].values,
+                                    routes['dest_lon'].values, np.zeros(len(routes)), points=ARC_POINTS)
+    route_cols = ['orig_code', 'orig_name', 'orig_city', 'dest_code', 'dest_name', 'dest_city'] + \
+                 [prop for fname, metric_cols in ROUTE_METRICS for prop in metric_cols.values()]
+    route_props = feature_properties(routes, route_cols)
+    airport_props = feature_properties(airports, ['code', 'name', 'city', 'passengers'])
+    station_props = feature_properties(stations, ['city_caps', 'State', 'code', 'Users', 'delay_avg', 'delay_med'])
+
+    n_tiles = 0
+    for zoom in range(min_zoom, max_zoom + 1):
+        layers = [('routes', line_tiles(route_lines, routes['weight'].values, zoom, tolerance, max_features),
+                   route_props, 2),
+                  ('airports', point_tiles(airports['lat'].values, airports['lon'].values,
+                                           airports['weight'].values, zoom, max_features), airport_props, 1),
+                  ('amtrak', point_tiles(stations['lat'].values, stations['lon'].values,
+                                         stations['weight'].values, zoom, max_features), station_props, 1)]
+        tile_keys = set()
+        for name, tiles, props, geom_type in layers:
+            tile_keys.update(tiles.keys())
+        for tx, ty in tile_keys:
+            # skip tiles wrapped around the antimeridian or off the map
+            if tx < 0 or ty < 0 or tx >= 2 ** zoom or ty >= 2 ** zoom:
+                continue
+            tile = b''.join(encode_layer(name, tiles[(tx, ty)], props, geom_type)
+                            for name, tiles, props, geom_type in layers if (tx, ty) in tiles)
+            out_dir = '{0}/{1}/{2}'.format(tile_dir, zoom, tx)
+            if not os.path.exists(out_dir):
+                os.makedirs(out_dir)
+            with open('{0}/{1}.pbf'.format(out_dir, ty), 'wb') as f:
+                f.write(tile)
+            n_tiles += 1
+        print('zoom {0}: {1} tiles'.format(zoom, len(tile_keys)))
+        sys.stdout.flush()
+    return n_tiles
+
+
+if __name__ == '__main__':
+    import numpy as np
+    import pandas as pd
+    import json
+    import os
+    import shutil
+    import struct
+    import sys
+    from route_utils import great_circle_arcs
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+    try:
+        text_type = unicode
+    except NameError:
+        text_type = str
+
+    parser = ArgumentParser(description='This script exports the aggregated route, airport and Amtrak station datasets\n'
+                                        'as Mapbox Vector Tiles, simplified and thinned per zoom level,\n'
+                                        'along with a map that draws them through a vector tile layer.',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-q', '--quarter', dest='quarter',
+                        default=None, metavar='QUARTER',
+                        help='QUARTER of aggregated data to export, default None exports all quarters')
+    parser.add_argument('--min-zoom', dest='min_zoom',
+                        default=3, type=int,
+                        help='Lowest zoom level to write tiles for')
+    parser.add_argument('--max-zoom', dest='max_zoom',
+                        default=8, type=int,
+                        help='Highest zoom level to write tiles for, the map overzooms past it')
+    parser.add_argument('--tolerance', dest='tolerance',
+                        default=8.0, type=float,
+                        help='Line simplification tolerance in tile coordinate units (4096 per tile)')
+    parser.add_argument('--max-features', dest='max_features',
+                        default=500, type=int,
+                        help='Maximum features per layer per tile, lighter routes/airports/stations are dropped first')
+    parser.add_argument('--basemap', dest='basemap',
+                        default=None,
+                        help='Tile URL template of a basemap drawn under the tiles (e.g. https://tile.openstreetmap.org/{z}/{x}/{y}.png), '
+                             'default None draws no basemap so the map works offline')
+    parser.add_argument('--basemap-attribution', dest='basemap_attribution',
+                        default='',
+                        help='Attribution html shown for --basemap')
+    args = parser.parse_args()
+
+    # input directory
+    if args.quarter:
+        input_dir = 'data/aggregated/q{0}'.format(args.quarter)
+        mapname_suffix = '_Q{0}'.format(args.quarter)
+    else:
+        input_dir = 'data/aggregated'
+        mapname_suffix = '_Full_Year'
+    # amtrak data taken over full year for now
+    amtrak_input_dir = 'data/aggregated'
+
+    # output directory
+    map_dir = 'maps'
+    tile_dir = 'tiles{0}'.format(mapname_suffix)
+
+    print('creating {0}/{1}/...'.format(map_dir, tile_dir))
+    sys.stdout.flush()
+    routes = route_features(input_dir)
+    airports = airport_features(routes)
+    stations = station_features(amtrak_input_dir)
+    n_tiles = export_tiles('{0}/{1}'.format(map_dir, tile_dir), routes, airports, stations,
+                           args.min_zoom, args.max_zoom, args.tolerance, args.max_features)
+    print('{0} tiles'.format(n_tiles))
+
+    with open('{0}/{1}/metadata.json'.format(map_dir, tile_dir), 'w') as f:
+        json.dump({'tiles': ['{z}/{x}/{y}.pbf'], 'minzoom': args.min_zoom, 'maxzoom': args.max_zoom,
+                   'vector_layers': [{'id': 'routes'}, {'id': 'airports'}, {'id': 'amtrak'}]}, f, indent=2)
+
+    # local copies of Leaflet and the vector tile layer next to the map, so it needs no CDN
+    if os.path.exists('{0}/static'.format(map_dir)):
+        shutil.rmtree('{0}/static'.format(map_dir))
+    shutil.copytree('static/leaflet', '{0}/static/leaflet'.format(map_dir))
+    shutil.copy('static/vector_tiles.js', '{0}/static/vector_tiles.js'.format(map_dir))
+
+    print('creating {0}/Route_Mapper_Vector_Tiles{1}.html...'.format(map_dir, mapname_suffix))
+    basemap = {'url': args.basemap, 'attribution': args.basemap_attribution} if args.basemap else None
+    with open('{0}/Route_Mapper_Vector_Tiles{1}.html'.format(map_dir, mapname_suffix), 'w') as f:
+        f.write(VIEWER_TEMPLATE.format(tile_url='{0}/{{z}}/{{x}}/{{y}}.pbf'.format(tile_dir),
+                                       min_zoom=args.min_zoom, max_zoom=args.max_zoom, basemap=json.dumps(basemap)))